@@ -0,0 +1,56 @@
+"""Throughput of `summarize_many` over many recs vs `summarize` per rec.
+
+The rec is repeated `n_recs` times (default 10k) under distinct `rec_id`s; the
+per-rec loop is timed on a sample and extrapolated.
+
+    python benchmarks/analysis_many.py some.rec 10000
+"""
+
+import sys
+import time
+
+import polars as pl
+
+from elma_recplot.analysis import summarize, summarize_many
+from elma_recplot.elma_loader import load_rec
+
+LOOP_SAMPLE = 100
+
+
+def _repeat(table, n_recs):
+    # As `concat_rec_frames`/`concat_rec_events` would tag them
+    return pl.concat(
+        [
+            table.with_columns(pl.lit(rec_id, pl.UInt32).alias("rec_id"))
+            for rec_id in range(n_recs)
+        ]
+    )
+
+
+def main(rec_path, n_recs):
+    with open(rec_path, "rb") as f:
+        rec = load_rec(f, columns=("x", "y", "t", "rot"))
+    frames = _repeat(rec.frames, n_recs)
+    events = _repeat(rec.events, n_recs)
+    print(f"{rec_path}: {n_recs} recs, {len(frames)} frames, {len(events)} events")
+
+    start = time.perf_counter()
+    for _ in range(LOOP_SAMPLE):
+        summarize(rec)
+    loop = (time.perf_counter() - start) / LOOP_SAMPLE * n_recs
+
+    start = time.perf_counter()
+    stats = summarize_many(frames, events)
+    batch = time.perf_counter() - start
+    assert len(stats) == n_recs
+
+    for name, elapsed in (("per-rec loop", loop), ("summarize_many", batch)):
+        print(
+            f"{name:>14}: {elapsed:8.3f} s, "
+            f"{n_recs / elapsed:10.0f} recs/s, "
+            f"{len(frames) / elapsed / 1e6:8.2f} M frames/s"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10_000)
@@ -0,0 +1,76 @@
+"""CLI startup time, and the slowest imports of a command, via -X importtime.
+
+    python benchmarks/cli_startup.py [--max-ms 100] [command args...]
+
+Defaults to `get-lev --help`. Exits non-zero if the median wall time of a run
+exceeds --max-ms, or if `--help` imports a heavy dependency.
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 10
+# Only the commands actually doing work should load these
+HEAVY_MODULES = ("numpy", "polars", "plotly", "requests", "rich", "pandas")
+
+
+def _run(args: list[str], importtime: bool = False) -> subprocess.CompletedProcess:
+    flags = ["-X", "importtime"] if importtime else []
+    return subprocess.run(
+        [sys.executable, *flags, "-m", "elma_recplot", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def _imports(stderr: str) -> list[tuple[int, str]]:
+    # -> (cumulative us, top-level module), slowest first
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit() and not module.startswith("  "):
+            imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)
+
+
+def main():
+    args = sys.argv[1:]
+    max_ms = 100.0
+    if args[:1] == ["--max-ms"]:
+        max_ms, args = float(args[1]), args[2:]
+    args = args or ["get-lev", "--help"]
+
+    _run(args)  # warm up the bytecode cache
+    times = []
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        _run(args)
+        times.append((time.perf_counter() - t) * 1000)
+    median = statistics.median(times)
+    print(f"elma-recplot {' '.join(args)}: median {median:.1f} ms over {RUNS} runs")
+
+    imports = _imports(_run(args, importtime=True).stderr)
+    print("Slowest top-level imports:")
+    for cumulative, module in imports[:10]:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    heavy = sorted(
+        {module for _, module in imports if module.split(".")[0] in HEAVY_MODULES}
+    )
+    failed = False
+    if heavy and "--help" in args:
+        print(f"FAIL: heavy modules imported: {heavy}")
+        failed = True
+    if median > max_ms:
+        print(f"FAIL: median {median:.1f} ms > {max_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Memory held by many loaded recs, wide vs compact frames, and the time of
+`summarize_many` over them.
+
+    python benchmarks/compact_frames.py [n_recs] [n_frames]
+
+Each mode runs in a fresh process, so RSS growth is its own.
+"""
+
+import io
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from synthetic import make_rec
+
+
+def _max_rss_bytes() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _run(compact: bool, n_recs: int, n_frames: int) -> dict:
+    from elma_recplot.analysis import summarize_many
+    from elma_recplot.elma_loader import (
+        LoadResult,
+        concat_rec_events,
+        concat_rec_frames,
+        load_rec,
+    )
+
+    data = make_rec(n_frames, n_frames // 30)
+    load_rec(io.BytesIO(data), compact=compact)  # warm up imports
+    rss_before = _max_rss_bytes()
+    results = [load_rec(io.BytesIO(data), compact=compact) for _ in range(n_recs)]
+    held = sum(rec.frames.estimated_size() for rec in results)
+    rss_growth = _max_rss_bytes() - rss_before
+
+    loaded = [LoadResult(source="", value=rec) for rec in results]
+    frames, events = concat_rec_frames(loaded), concat_rec_events(loaded)
+    start = time.perf_counter()
+    summarize_many(frames, events)
+    return {
+        "frames_bytes": held,
+        "rss_growth_bytes": rss_growth,
+        "summarize_s": time.perf_counter() - start,
+    }
+
+
+def main(n_recs: int, n_frames: int):
+    print(f"{n_recs} recs of {n_frames} frames")
+    for compact in (False, True):
+        # polars' thread pool deadlocks in forked children
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            result = pool.submit(_run, compact, n_recs, n_frames).result()
+        print(
+            f"{'compact' if compact else 'wide':>8}: "
+            f"frames {result['frames_bytes'] / 2**20:8.1f} MiB, "
+            f"RSS growth {result['rss_growth_bytes'] / 2**20:8.1f} MiB, "
+            f"summarize_many {result['summarize_s']:6.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 3_000,
+    )
@@ -0,0 +1,36 @@
+"""Figure build time and HTML size of `add_lev_to_fig`, per-item vs batched.
+
+python benchmarks/draw_lev.py some.lev
+"""
+
+import sys
+import time
+
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from elma_recplot.elma_loader import load_lev
+from elma_recplot.plot import add_lev_to_fig
+
+
+def main(lev_path):
+    with open(lev_path, "rb") as f:
+        lev = load_lev(f)
+    print(f"{lev_path}: {len(lev.polygons)} polygons, {len(lev.objects)} objects")
+    for batched in (False, True):
+        fig = go.Figure()
+        start = time.perf_counter()
+        add_lev_to_fig(lev, fig, batched=batched)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        html = pio.to_html(fig, include_plotlyjs=False)
+        write = time.perf_counter() - start
+        print(
+            f"batched={batched!s:>5}: build {build:7.3f} s, html {write:7.3f} s, "
+            f"{len(html.encode()):10d} bytes, {len(fig.data)} traces, "
+            f"{len(fig.layout.shapes)} shapes"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,43 @@
+"""HTML size and write time of a rec page: JSON float lists vs typed arrays.
+
+python benchmarks/figure_size.py some.lev some.rec
+"""
+
+import io
+import sys
+import time
+
+import numpy as np
+
+from elma_recplot.elma_loader import load_lev, load_rec
+from elma_recplot.plot import draw_event_timeline, draw_rec, write_figures_html
+
+
+def _as_lists(fig):
+    # Decimal JSON text, as written by plotly < 6
+    for trace in fig.data:
+        for attr in ("x", "y"):
+            values = getattr(trace, attr, None)
+            if isinstance(values, np.ndarray):
+                trace[attr] = values.tolist()
+    return fig
+
+
+def main(lev_path, rec_path):
+    with open(lev_path, "rb") as f:
+        lev = load_lev(f)
+    with open(rec_path, "rb") as f:
+        rec = load_rec(f)
+    for mode in ("lists", "float64", "float32"):
+        figs = [draw_rec(rec, lev), draw_event_timeline(rec)]
+        if mode == "lists":
+            figs = [_as_lists(fig) for fig in figs]
+        out = io.StringIO()
+        start = time.perf_counter()
+        write_figures_html(figs, out, compact=mode == "float32")
+        elapsed = time.perf_counter() - start
+        print(f"{mode:>8}: {len(out.getvalue()):10d} bytes, write {elapsed:7.3f} s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2])
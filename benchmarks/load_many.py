@@ -0,0 +1,33 @@
+"""Wall time of `load_recs_many` / `load_levs_many` over a directory by worker count.
+
+python benchmarks/load_many.py recs_dir/ 1 2 4 8
+"""
+
+import glob
+import os
+import sys
+import time
+
+from elma_recplot.elma_loader import load_levs_many, load_recs_many
+
+
+def main(directory, worker_counts):
+    recs = sorted(glob.glob(os.path.join(directory, "*.rec")))
+    levs = sorted(glob.glob(os.path.join(directory, "*.lev")))
+    print(f"{directory}: {len(recs)} recs, {len(levs)} levs")
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        rec_results = load_recs_many(recs, workers=workers)
+        lev_results = load_levs_many(levs, workers=workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        n_failed = sum(not r.ok for r in rec_results + lev_results)
+        print(
+            f"workers={workers:3d}: {elapsed:8.3f} s, "
+            f"speedup {baseline / elapsed:5.2f}x, {n_failed} failed"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], [int(w) for w in sys.argv[2:]] or [1, os.cpu_count()])
@@ -0,0 +1,76 @@
+"""Allocations and bytes copied when decoding rec frame columns.
+
+Compares the per-column `read()` decode against the single-block decode used by
+`load_rec`.
+
+    python benchmarks/load_rec_alloc.py some.rec
+"""
+
+import struct
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+from previous_loaders import _col_from_buffer
+
+from elma_recplot.elma_loader import (
+    REC_FRAME_COLUMNS,
+    REC_FRAME_SIZE,
+    REC_HEADER_FORMAT_STR,
+    _read_block,
+    frame_columns_from_block,
+)
+
+
+def _per_column(buffer, number_of_frames):
+    return {
+        name: _col_from_buffer(buffer, number_of_frames, dtype)
+        for name, dtype in REC_FRAME_COLUMNS
+    }
+
+
+def _single_block(buffer, number_of_frames):
+    block = _read_block(buffer, REC_FRAME_SIZE * number_of_frames)
+    return frame_columns_from_block(block, number_of_frames)
+
+
+def _owner(array):
+    base = array.base
+    while isinstance(base, memoryview):
+        base = base.obj
+    return base
+
+
+def _measure(decode, data, number_of_frames):
+    buffer = BytesIO(data)
+    buffer.seek(struct.calcsize(REC_HEADER_FORMAT_STR))
+    tracemalloc.start()
+    start = time.perf_counter()
+    columns = decode(buffer, number_of_frames)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Every backing buffer is one allocation that the file bytes were copied into
+    bases = [_owner(col) for col in columns.values()]
+    buffers = {id(b): b for b in bases}
+    n_bytes = sum(memoryview(b).nbytes for b in buffers.values())
+    return len(buffers), n_bytes, peak, elapsed
+
+
+def main(rec_path):
+    with open(rec_path, "rb") as f:
+        data = f.read()
+    (number_of_frames, _, _) = struct.unpack_from(REC_HEADER_FORMAT_STR, data)
+    print(f"{rec_path}: {number_of_frames} frames")
+    for name, decode in (("per-column", _per_column), ("single-block", _single_block)):
+        n_buffers, n_bytes, peak, elapsed = _measure(decode, data, number_of_frames)
+        print(
+            f"{name:>12}: {n_buffers:3d} buffer allocations, "
+            f"{n_bytes:10d} bytes copied, {peak:10d} bytes peak, "
+            f"{elapsed * 1e3:8.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
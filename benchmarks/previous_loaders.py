@@ -0,0 +1,106 @@
+"""The per-column / per-polygon `read()` loaders that `load_rec` and `load_lev`
+replaced, as references for the benchmarks and tests comparing against them.
+
+Default columns only; no `BufferReader` fast path or raw header/trailer.
+"""
+
+import struct
+import typing
+
+import numpy as np
+import polars as pl
+
+from elma_recplot.elma_loader import (
+    LEV_HEADER_FORMAT_STR,
+    LEV_ITEM_COUNT_SUBTRAHEND,
+    LEV_OBJECT_DTYPE,
+    MAGIC_TIME_SCALER,
+    POLY_HEADER_FORMAT_STR,
+    REC_EVENT_DTYPE,
+    REC_FRAME_COLUMNS,
+    REC_HEADER_FORMAT_STR,
+    REL_POS_SCALER,
+)
+
+
+def _col_from_buffer(buffer, size, dtype):
+    # Works with simple or composite dtypes
+    return np.frombuffer(buffer.read((np.dtype(dtype).itemsize) * size), dtype=dtype)
+
+
+def load_rec(rec_data: typing.BinaryIO) -> tuple[pl.DataFrame, pl.DataFrame]:
+    # -> (frames, events)
+    (number_of_frames, _, _) = struct.unpack(
+        REC_HEADER_FORMAT_STR, rec_data.read(struct.calcsize(REC_HEADER_FORMAT_STR))
+    )
+    frames = pl.DataFrame(
+        data={
+            name: _col_from_buffer(rec_data, number_of_frames, dtype)
+            for name, dtype in REC_FRAME_COLUMNS
+        }
+    ).with_columns(
+        [
+            (pl.int_range(pl.len()).cast(pl.Float32) / 30).alias("t"),
+            (pl.col("x") + pl.col("l_wheel_x_rel") / REL_POS_SCALER).alias("l_wheel_x"),
+            (pl.col("y") + pl.col("l_wheel_y_rel") / REL_POS_SCALER).alias("l_wheel_y"),
+            (pl.col("x") + pl.col("r_wheel_x_rel") / REL_POS_SCALER).alias("r_wheel_x"),
+            (pl.col("y") + pl.col("r_wheel_y_rel") / REL_POS_SCALER).alias("r_wheel_y"),
+            (pl.col("x") + pl.col("head_x_rel") / REL_POS_SCALER).alias("head_x"),
+            (pl.col("y") + pl.col("head_y_rel") / REL_POS_SCALER).alias("head_y"),
+            ((pl.col("dir_and_throttle") & 0b1) == 0b1).alias("is_gasing"),
+            ((pl.col("dir_and_throttle") & 0b10) == 0b10).alias("is_right"),
+            ((pl.col("dir_and_throttle") & 0b11) == 0b11).alias("is_gasing_right"),
+            ((pl.col("dir_and_throttle") & 0b11) == 0b01).alias("is_gasing_left"),
+        ]
+    )
+    (number_of_events,) = struct.unpack("I", rec_data.read(struct.calcsize("I")))
+    events = pl.DataFrame(
+        _col_from_buffer(rec_data, number_of_events, REC_EVENT_DTYPE)
+    ).with_columns(pl.col("timestamp") * MAGIC_TIME_SCALER)
+    return frames, events
+
+
+def _poly_area(x: pl.Series, y: pl.Series) -> float:
+    _x = x.to_numpy()
+    _y = y.to_numpy()
+    return 0.5 * (np.dot(_x, np.roll(_y, 1)) - np.dot(_y, np.roll(_x, 1)))
+
+
+def load_lev(
+    lev_data: typing.BinaryIO,
+) -> tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    # -> (polygons, polygons_coords, objects)
+    *_, num_polygons = struct.unpack(
+        LEV_HEADER_FORMAT_STR, lev_data.read(struct.calcsize(LEV_HEADER_FORMAT_STR))
+    )
+    num_polygons = round(num_polygons - LEV_ITEM_COUNT_SUBTRAHEND)
+    summary_rows = []
+    poly_coords_dfs = []
+    for p_idx in range(num_polygons):
+        grass, num_vertices = struct.unpack(
+            POLY_HEADER_FORMAT_STR,
+            lev_data.read(struct.calcsize(POLY_HEADER_FORMAT_STR)),
+        )
+        poly_coords_df = pl.DataFrame(
+            _col_from_buffer(
+                lev_data, num_vertices, np.dtype([("x", np.float64), ("y", np.float64)])
+            )
+        ).with_columns(pl.lit(p_idx).alias("index"), pl.col("y") * -1.0)
+        poly_coords_dfs.append(poly_coords_df)
+        summary_rows.append(
+            {
+                "index": p_idx,
+                "is_grass": bool(grass),
+                "n_vertices": num_vertices,
+                "area": _poly_area(poly_coords_df["x"], poly_coords_df["y"]),
+            }
+        )
+    polygons = pl.DataFrame(summary_rows)
+    polygons_coords = pl.concat(poly_coords_dfs)
+
+    (n_objects,) = struct.unpack("d", lev_data.read(struct.calcsize("d")))
+    n_objects = round(n_objects - LEV_ITEM_COUNT_SUBTRAHEND)
+    objects = pl.DataFrame(
+        _col_from_buffer(lev_data, n_objects, LEV_OBJECT_DTYPE)
+    ).with_columns(pl.col("y") * -1.0)
+    return polygons, polygons_coords, objects
@@ -0,0 +1,66 @@
+"""Byte-exact load -> dump round trip of .rec/.lev files, and dump speed.
+
+    python benchmarks/roundtrip.py [files_or_dirs...]
+
+Without arguments, checks synthetic files (see synthetic.py). Exits non-zero
+if any file doesn't round trip.
+"""
+
+import glob
+import os
+import sys
+import time
+
+from synthetic import make_lev, make_rec
+
+from elma_recplot.elma_loader import (
+    BufferReader,
+    dump_lev,
+    dump_rec,
+    first_roundtrip_mismatch,
+    load_lev,
+    load_rec,
+)
+
+REPEATS = 5
+
+
+def _sources(args):
+    if not args:
+        yield "synthetic.rec", make_rec(180_000, 5_000)
+        yield "synthetic.lev", make_lev(2_000, 64, 500)
+        return
+    for arg in args:
+        paths = (
+            sorted(glob.glob(os.path.join(arg, "*.rec")))
+            + sorted(glob.glob(os.path.join(arg, "*.lev")))
+            if os.path.isdir(arg)
+            else [arg]
+        )
+        for path in paths:
+            with open(path, "rb") as f:
+                yield path, f.read()
+
+
+def main(args):
+    n_failed = 0
+    for name, data in _sources(args):
+        kind = "lev" if name.lower().endswith(".lev") else "rec"
+        mismatch = first_roundtrip_mismatch(data, kind)
+        n_failed += mismatch is not None
+        loaded = (load_lev if kind == "lev" else load_rec)(BufferReader(data))
+        dumper = dump_lev if kind == "lev" else dump_rec
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            dumper(loaded)
+        elapsed = (time.perf_counter() - start) / REPEATS
+        status = "ok" if mismatch is None else f"MISMATCH at byte {mismatch}"
+        print(
+            f"{name}: {status}; dump {elapsed * 1e3:8.2f} ms, "
+            f"{len(data) / elapsed / 2**20:8.1f} MiB/s"
+        )
+    sys.exit(1 if n_failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,60 @@
+"""Nearest-edge query time per rec frame: grid index vs brute force.
+
+python benchmarks/spatial_index.py some.lev some.rec
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from elma_recplot.elma_loader import load_lev, load_rec
+from elma_recplot.spatial import _point_segment_distance
+
+BRUTE_FORCE_CHUNK = 1000
+
+
+def _brute_force(index, x, y):
+    return np.concatenate(
+        [
+            _point_segment_distance(
+                x[i : i + BRUTE_FORCE_CHUNK, None],
+                y[i : i + BRUTE_FORCE_CHUNK, None],
+                index.x0,
+                index.y0,
+                index.x1,
+                index.y1,
+            ).min(axis=1)  # fmt: skip
+            for i in range(0, len(x), BRUTE_FORCE_CHUNK)
+        ]
+    )
+
+
+def main(lev_path, rec_path):
+    with open(lev_path, "rb") as f:
+        lev = load_lev(f)
+    with open(rec_path, "rb") as f:
+        rec = load_rec(f, columns=("x", "y"))
+    x = rec.frames["x"].to_numpy().astype(np.float64)
+    y = rec.frames["y"].to_numpy().astype(np.float64)
+
+    start = time.perf_counter()
+    index = lev.spatial_index
+    build = time.perf_counter() - start
+    print(
+        f"{lev_path}: {index.n_edges} edges, {index.n_x}x{index.n_y} grid, "
+        f"built in {build * 1e3:.1f} ms; {rec_path}: {len(x)} frames"
+    )
+    start = time.perf_counter()
+    distance, _, _ = index.nearest_edge(x, y)
+    indexed = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = _brute_force(index, x, y)
+    brute = time.perf_counter() - start
+    assert np.allclose(distance, expected)
+    for name, elapsed in (("brute force", brute), ("grid index", indexed)):
+        print(f"{name:>11}: {elapsed * 1e3:9.2f} ms, {len(x) / elapsed:12.0f} frames/s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2])
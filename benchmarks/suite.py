@@ -0,0 +1,177 @@
+"""Throughput and peak memory of loading, plotting and HTML writing, on
+synthetic recs/levs of several sizes (see synthetic.py).
+
+    python benchmarks/suite.py [--sizes small medium] [--out results.json] \\
+        [--baseline old.json] [--max-slowdown 1.25]
+
+Each (stage, size) runs in a fresh process, so peak RSS growth is its own.
+With --baseline, prints the time ratio per case and exits non-zero if any case
+got slower than --max-slowdown.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from synthetic import make_lev, make_rec
+
+SIZES = {
+    # frames, events, polygons, vertices per polygon, objects
+    "small": dict(frames=1_800, events=50, polygons=20, vertices=8, objects=10),
+    "medium": dict(frames=18_000, events=500, polygons=200, vertices=32, objects=100),
+    "large": dict(
+        frames=180_000, events=5_000, polygons=2_000, vertices=64, objects=500
+    ),
+}
+STAGES = (
+    "load_rec",
+    "validate_rec",
+    "load_lev",
+    "draw_rec",
+    "draw_event_timeline",
+    "write_html",
+)
+REPEATS = 5
+
+
+def _setup(stage: str, size: dict):
+    # -> (function to time, unit count for throughput, unit name)
+    from elma_recplot.elma_loader import BufferReader, load_lev, load_rec
+    from elma_recplot.plot import draw_event_timeline, draw_rec, write_figures_html
+    from elma_recplot.validate import check_rec
+
+    rec_data = make_rec(size["frames"], size["events"])
+    lev_data = make_lev(size["polygons"], size["vertices"], size["objects"])
+    if stage == "load_rec":
+        return lambda: load_rec(BufferReader(rec_data)), len(rec_data), "B"
+    if stage == "validate_rec":
+        return lambda: check_rec(rec_data), len(rec_data), "B"
+    if stage == "load_lev":
+        return lambda: load_lev(BufferReader(lev_data)), len(lev_data), "B"
+    rec = load_rec(BufferReader(rec_data))
+    lev = load_lev(BufferReader(lev_data))
+    if stage == "draw_rec":
+        return lambda: draw_rec(rec, lev), size["frames"], "frames"
+    if stage == "draw_event_timeline":
+        return lambda: draw_event_timeline(rec), size["frames"], "frames"
+    figs = [draw_rec(rec, lev), draw_event_timeline(rec)]
+    return lambda: write_figures_html(figs, io.StringIO()), size["frames"], "frames"
+
+
+def _max_rss_bytes() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _run_case(stage: str, size_name: str) -> dict:
+    # Runs in a fresh worker process. The RSS baseline is taken before the
+    #  first run: peak RSS only grows, so after a warm-up run the timed runs
+    #  would show none of the stage's memory
+    run, n_units, unit = _setup(stage, SIZES[size_name])
+    rss_before = _max_rss_bytes()
+    run()  # warm up imports and caches
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    median = statistics.median(times)
+    return {
+        "stage": stage,
+        "size": size_name,
+        **SIZES[size_name],
+        "median_s": median,
+        "min_s": min(times),
+        "throughput": n_units / median,
+        "throughput_unit": f"{unit}/s",
+        # Python/numpy allocations only; polars allocates outside tracemalloc
+        "traced_peak_bytes": traced_peak,
+        # Over the inputs from `_setup`; includes what the warm-up run imports
+        "rss_growth_bytes": max(0, _max_rss_bytes() - rss_before),
+        "peak_rss_bytes": _max_rss_bytes(),
+    }
+
+
+def _meta() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": REPEATS,
+    }
+
+
+def _compare(results: list[dict], baseline_path: str, max_slowdown: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {(r["stage"], r["size"]): r for r in json.load(f)["results"]}
+    ok = True
+    print(f"\nvs {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["stage"], result["size"]))
+        if old is None:
+            continue
+        ratio = result["median_s"] / old["median_s"]
+        slow = ratio > max_slowdown
+        ok &= not slow
+        print(
+            f"{result['stage']:>20} {result['size']:>7}: "
+            f"{ratio:6.2f}x time{'  SLOWER' if slow else ''}"
+        )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=list(SIZES))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--max-slowdown", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = []
+    for size_name in args.sizes:
+        for stage in args.stages:
+            # polars' thread pool deadlocks in forked children
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                result = pool.submit(_run_case, stage, size_name).result()
+            results.append(result)
+            print(
+                f"{stage:>20} {size_name:>7}: {result['median_s'] * 1e3:10.2f} ms, "
+                f"{result['throughput']:14.0f} {result['throughput_unit']}, "
+                f"peak {result['traced_peak_bytes'] / 2**20:8.1f} MiB traced, "
+                f"{result['rss_growth_bytes'] / 2**20:8.1f} MiB RSS growth"
+            )
+    with open(args.out, "w") as f:
+        json.dump({"meta": _meta(), "results": results}, f, indent=2)
+    print(f"Wrote {args.out!r}")
+    if args.baseline and not _compare(results, args.baseline, args.max_slowdown):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
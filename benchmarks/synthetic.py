@@ -0,0 +1,176 @@
+"""Synthetic .rec/.lev files in the binary layout `load_rec`/`load_lev` parse.
+
+    python benchmarks/synthetic.py out_dir/ --frames 18000 --events 500 \\
+        --polygons 200 --vertices 32 --objects 100 [--recs 10] [--seed 0]
+
+Writes out_dir/SYNTH.lev and out_dir/synthetic_<i>.rec, which are driven on
+it, for the benchmarks that take file paths. Same seed -> same bytes.
+"""
+
+import argparse
+import os
+import struct
+
+import numpy as np
+
+from elma_recplot.elma_loader import (
+    LEV_HEADER_FORMAT_STR,
+    LEV_INTEGRITY_FORMAT_STR,
+    LEV_INTEGRITY_OFFSET,
+    LEV_ITEM_COUNT_SUBTRAHEND,
+    LEV_LINK_OFFSET,
+    LEV_OBJECT_DTYPE,
+    LEV_VERSION,
+    MAGIC_TIME_SCALER,
+    POLY_HEADER_FORMAT_STR,
+    REC_END_MARKER,
+    REC_EVENT_DTYPE,
+    REC_FRAME_COLUMNS,
+    REC_HEADER_FORMAT_STR,
+    EventType,
+    ObjType,
+)
+
+LEV_SIZE = 200.0  # world units; polygons are laid out on a grid inside
+
+
+def make_rec(
+    n_frames: int, n_events: int, seed: int = 0, link: int | None = None
+) -> bytes:
+    # A bike wandering around the level at 30 fps, with random events.
+    #  `link`: of the lev it's driven on (see `make_lev`); random by default
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.normal(0.0, 0.05, n_frames)) + LEV_SIZE / 2
+    y = np.cumsum(rng.normal(0.0, 0.05, n_frames)) - LEV_SIZE / 2
+    columns = {
+        "x": x,
+        "y": y,
+        "l_wheel_x_rel": rng.normal(-850, 20, n_frames),
+        "l_wheel_y_rel": rng.normal(-600, 20, n_frames),
+        "r_wheel_x_rel": rng.normal(850, 20, n_frames),
+        "r_wheel_y_rel": rng.normal(-600, 20, n_frames),
+        "head_x_rel": rng.normal(0, 20, n_frames),
+        "head_y_rel": rng.normal(450, 20, n_frames),
+        "rot": np.cumsum(rng.integers(-50, 51, n_frames)) % 10_000,
+        "left_wheel_rot": rng.integers(0, 128, n_frames),
+        "right_wheel_rot": rng.integers(0, 128, n_frames),
+        # Gas/direction flips every couple of seconds
+        "dir_and_throttle": np.repeat(rng.integers(0, 4, n_frames // 60 + 1), 60)[
+            :n_frames
+        ],
+        "back_wheel": np.zeros(n_frames),
+        "collision_strength": rng.integers(0, 2, n_frames) * rng.integers(0, 100),
+    }
+    events = np.zeros(n_events, dtype=REC_EVENT_DTYPE)
+    duration = n_frames / 30
+    events["timestamp"] = np.sort(rng.uniform(0, duration, n_events)) / (
+        MAGIC_TIME_SCALER
+    )
+    events["event_type"] = rng.choice([e.value for e in EventType], n_events)
+    events["event_info"] = rng.integers(0, 100, n_events)
+    events["event_info_2"] = rng.uniform(0, 1, n_events)
+    return b"".join(
+        [
+            struct.pack(
+                REC_HEADER_FORMAT_STR,
+                n_frames,
+                rng.integers(2**32) if link is None else link,
+                b"SYNTH.lev",
+            ),
+            *(
+                columns[name].astype(dtype).tobytes()
+                for name, dtype in REC_FRAME_COLUMNS
+            ),
+            struct.pack("I", n_events),
+            events.tobytes(),
+            struct.pack("I", REC_END_MARKER),
+        ]
+    )
+
+
+def _polygon(rng, n_vertices: int, cx: float, cy: float, radius: float) -> bytes:
+    # Star-shaped, so it never self-intersects
+    angle = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+    r = radius * rng.uniform(0.5, 1.0, n_vertices)
+    # Stored y is flipped by `load_lev`
+    coords = np.column_stack([cx + r * np.cos(angle), -(cy + r * np.sin(angle))])
+    return struct.pack(POLY_HEADER_FORMAT_STR, 0, n_vertices) + coords.tobytes()
+
+
+def make_lev(n_polygons: int, n_vertices: int, n_objects: int, seed: int = 0) -> bytes:
+    # One outer polygon around the level, the others on a grid inside it
+    rng = np.random.default_rng(seed)
+    per_row = max(1, int(np.ceil(np.sqrt(max(n_polygons - 1, 1)))))
+    cell = LEV_SIZE / per_row
+    polygons = [
+        _polygon(rng, max(n_vertices, 3), LEV_SIZE / 2, -LEV_SIZE / 2, LEV_SIZE)
+    ][:n_polygons]
+    for i in range(n_polygons - 1):
+        row, col = divmod(i, per_row)
+        polygons.append(
+            _polygon(
+                rng,
+                max(n_vertices, 3),
+                (col + 0.5) * cell,
+                -(row + 0.5) * cell,
+                cell * 0.4,
+            )
+        )
+    objects = np.zeros(n_objects, dtype=LEV_OBJECT_DTYPE)
+    objects["x"] = rng.uniform(0, LEV_SIZE, n_objects)
+    objects["y"] = rng.uniform(0, LEV_SIZE, n_objects)
+    objects["object_type"] = rng.choice(
+        [ObjType.EXIT.value, ObjType.APPLE.value, ObjType.KILLER.value], n_objects
+    )
+    objects["object_type"][:1] = ObjType.PLAYER.value
+    objects["object_type"][1:2] = ObjType.EXIT.value
+    header = bytearray(
+        struct.pack(
+            LEV_HEADER_FORMAT_STR,
+            LEV_VERSION,
+            rng.integers(2**32),
+            b"Synthetic benchmark level",
+            b"default",
+            b"ground",
+            b"sky",
+            n_polygons + LEV_ITEM_COUNT_SUBTRAHEND,
+        )
+    )
+    # Integrity sums within the ranges Elma accepts (not the real sums)
+    struct.pack_into(
+        LEV_INTEGRITY_FORMAT_STR, header, LEV_INTEGRITY_OFFSET, 0.0, 11877, 12112, 23090
+    )
+    return b"".join(
+        [
+            header,
+            *polygons,
+            struct.pack("d", n_objects + LEV_ITEM_COUNT_SUBTRAHEND),
+            objects.tobytes(),
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--frames", type=int, default=18_000)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--polygons", type=int, default=200)
+    parser.add_argument("--vertices", type=int, default=32)
+    parser.add_argument("--objects", type=int, default=100)
+    parser.add_argument("--recs", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    os.makedirs(args.out_dir, exist_ok=True)
+    lev = make_lev(args.polygons, args.vertices, args.objects, args.seed)
+    with open(os.path.join(args.out_dir, "SYNTH.lev"), "wb") as f:
+        f.write(lev)
+    (link,) = struct.unpack_from("<I", lev, LEV_LINK_OFFSET)
+    for i in range(args.recs):
+        with open(os.path.join(args.out_dir, f"synthetic_{i}.rec"), "wb") as f:
+            f.write(make_rec(args.frames, args.events, args.seed + i, link=link))
+    print(f"Wrote SYNTH.lev and {args.recs} rec(s) to {args.out_dir!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,110 @@
+import glob
 import logging
 import os
+import typing
 from datetime import datetime
 
 import click
-import plotly.io as pio
 
-from elma_recplot.elma_loader import load_lev, load_rec
-from elma_recplot.eol_tools import get_lev_by_id, get_rec_by_id_and_name
-from elma_recplot.page_creation import make_recent_replay_page
-from elma_recplot.plot import draw_event_timeline, draw_rec
+from elma_recplot.defaults import (
+    DEFAULT_BLOB_STORE_DIR,
+    DEFAULT_HEATMAP_CELL_SIZE,
+    DEFAULT_LAYER_CACHE_DIR,
+    DEFAULT_MAX_BYTES,
+    HEATMAP_LAYERS,
+    LOD_METHODS,
+    POOL_MAXSIZE,
+)
 from elma_recplot.util import init_logging
 
+# Commands import what they need when run: polars, plotly, requests etc. take
+#  most of the startup time, and short commands/`--help` shouldn't pay for them
+if typing.TYPE_CHECKING:
+    from elma_recplot.blob_store import BlobStore
+    from elma_recplot.layer_cache import LevLayerCache
+
 logger = logging.getLogger("elma_recplot")
 
 
 @click.group()
-def cli():
+@click.option(
+    "--profile",
+    "profile_out",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write per-stage timings/counters of this run (JSON, or CSV if *.csv)",
+)
+@click.option(
+    "--cprofile",
+    "cprofile_out",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Dump cProfile stats of this run (main process only)",
+)
+@click.option(
+    "--pyinstrument",
+    "pyinstrument_out",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write a pyinstrument HTML report of this run (needs pyinstrument)",
+)
+@click.pass_context
+def cli(ctx, profile_out, cprofile_out, pyinstrument_out):
     init_logging()
+    if profile_out:
+        from elma_recplot import profiling
+
+        profiling.enable()
+
+        def _write_profile():
+            logger.info(f"Writing profile summary to {profile_out!r}")
+            profiling.write_summary(profile_out)
+
+        ctx.call_on_close(_write_profile)
+    if cprofile_out:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def _write_cprofile():
+            profiler.disable()
+            logger.info(f"Writing cProfile stats to {cprofile_out!r}")
+            profiler.dump_stats(cprofile_out)
+
+        ctx.call_on_close(_write_cprofile)
+    if pyinstrument_out:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise click.UsageError("--pyinstrument needs pyinstrument installed")
+
+        sampler = Profiler()
+        sampler.start()
+
+        def _write_pyinstrument():
+            sampler.stop()
+            logger.info(f"Writing pyinstrument report to {pyinstrument_out!r}")
+            with open(pyinstrument_out, "w", encoding="utf-8") as f:
+                f.write(sampler.output_html())
+
+        ctx.call_on_close(_write_pyinstrument)
+
+
+def _check_lod_tolerance(lod_method, lod_tolerance):
+    if lod_tolerance is not None and lod_method == "lttb":
+        raise click.BadParameter(
+            "only applies to --lod-method rdp/grid", param_hint="--lod-tolerance"
+        )
 
 
 @cli.command(help="DL lev by ID")
 @click.argument("lev_id", type=int)
 @click.option("--outfile", default="dl.lev", type=click.File("wb"))
 def get_lev(lev_id, outfile):
-    lev = get_lev_by_id(lev_id).getvalue()
+    from elma_recplot.eol_tools import get_lev_by_id
+
+    lev = get_lev_by_id(lev_id).read()
     logger.info(f"Writing level {lev_id} to {outfile.name!r}")
     outfile.write(lev)
 
@@ -33,7 +114,9 @@ def get_lev(lev_id, outfile):
 @click.argument("rec_name")
 @click.option("--outfile", default="dl.rec", type=click.File("wb"))
 def get_rec(rec_id: str, rec_name: str, outfile):
-    rec = get_rec_by_id_and_name(rec_id, rec_name).getvalue()
+    from elma_recplot.eol_tools import get_rec_by_id_and_name
+
+    rec = get_rec_by_id_and_name(rec_id, rec_name).read()
     logger.info(f"Writing rec {rec_id}/{rec_name} to {outfile.name!r}")
     outfile.write(rec)
 
@@ -42,14 +125,202 @@ def get_rec(rec_id: str, rec_name: str, outfile):
 @click.argument("lev_file", type=click.File("rb"))
 @click.argument("rec_file", type=click.File("rb"))
 @click.option("--outfile", default="rec_plot.html", type=click.File("w"))
-def plot_rec(rec_file, lev_file, outfile):
+@click.option("--max-points", default=None, type=int, help="Trajectory point budget")
+@click.option("--lod-method", default="lttb", type=click.Choice(LOD_METHODS))
+@click.option(
+    "--lod-tolerance",
+    default=None,
+    type=float,
+    help="rdp/grid tolerance in world units; overrides the point budget",
+)
+@click.option(
+    "--compact/--no-compact", default=True, help="Embed coordinates as float32"
+)
+@click.option(
+    "--layer-cache-dir",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="Reuse rendered level layers from this directory",
+)
+def plot_rec(
+    rec_file,
+    lev_file,
+    outfile,
+    max_points,
+    lod_method,
+    lod_tolerance,
+    compact,
+    layer_cache_dir,
+):
+    from elma_recplot.elma_loader import load_lev, load_rec
+    from elma_recplot.layer_cache import LevLayerCache
+    from elma_recplot.plot import draw_event_timeline, draw_rec, write_figures_html
+
+    _check_lod_tolerance(lod_method, lod_tolerance)
     rec = load_rec(rec_file)
     lev = load_lev(lev_file)
-    fig_map = draw_rec(rec, lev)
+    fig_map = draw_rec(
+        rec,
+        lev,
+        max_points=max_points,
+        lod_method=lod_method,
+        layer_cache=LevLayerCache(layer_cache_dir) if layer_cache_dir else None,
+        lod_tolerance=lod_tolerance,
+    )
     fig_events = draw_event_timeline(rec)
     logger.info(f"Saving plot to {outfile.name!r}")
-    pio.write_html(fig_map, file=outfile, include_plotlyjs="cdn")
-    pio.write_html(fig_events, file=outfile, include_plotlyjs=False)
+    write_figures_html([fig_map, fig_events], outfile, compact=compact)
+
+
+@cli.command(help="Overlay several local recs of one lev as plotly html")
+@click.argument("lev_file", type=click.File("rb"))
+@click.argument("rec_files", type=click.File("rb"), nargs=-1, required=True)
+@click.option("--outfile", default="recs_plot.html", type=click.File("w"))
+@click.option(
+    "--reference", default=0, type=int, help="Position of the rec to compare against"
+)
+@click.option(
+    "--max-points", default=None, type=int, help="Trajectory point budget per rec"
+)
+@click.option("--lod-method", default="lttb", type=click.Choice(LOD_METHODS))
+@click.option(
+    "--lod-tolerance",
+    default=None,
+    type=float,
+    help="rdp/grid tolerance in world units; overrides the point budget",
+)
+@click.option(
+    "--compact/--no-compact", default=True, help="Embed coordinates as float32"
+)
+@click.option(
+    "--layer-cache-dir",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="Reuse rendered level layers from this directory",
+)
+def plot_recs(
+    lev_file,
+    rec_files,
+    outfile,
+    reference,
+    max_points,
+    lod_method,
+    lod_tolerance,
+    compact,
+    layer_cache_dir,
+):
+    from elma_recplot.compare import time_deltas
+    from elma_recplot.elma_loader import load_lev, load_rec
+    from elma_recplot.layer_cache import LevLayerCache
+    from elma_recplot.plot import draw_event_timeline, draw_recs, write_figures_html
+
+    _check_lod_tolerance(lod_method, lod_tolerance)
+    if not 0 <= reference < len(rec_files):
+        raise click.BadParameter(
+            f"must be below the number of recs ({len(rec_files)})",
+            param_hint="--reference",
+        )
+    columns = ("x", "y", "t", "is_gasing_left", "is_gasing_right")
+    recs = [load_rec(rec_file, columns=columns) for rec_file in rec_files]
+    names = [os.path.basename(rec_file.name) for rec_file in rec_files]
+    lev = load_lev(lev_file)
+    fig_map = draw_recs(
+        recs,
+        lev,
+        names=names,
+        max_points=max_points,
+        lod_method=lod_method,
+        layer_cache=LevLayerCache(layer_cache_dir) if layer_cache_dir else None,
+        lod_tolerance=lod_tolerance,
+    )
+    fig_events = draw_event_timeline(
+        recs[reference], deltas=time_deltas(recs, reference=reference), names=names
+    )
+    logger.info(f"Saving plot of {len(recs)} recs to {outfile.name!r}")
+    write_figures_html([fig_map, fig_events], outfile, compact=compact)
+
+
+@cli.command(help="Heatmap of bike positions/events over all recs of a lev")
+@click.argument("lev_file", type=click.File("rb"))
+@click.argument("rec_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--outfile", default="heatmap.html", type=click.File("w"))
+@click.option("--layer", default="position", type=click.Choice(HEATMAP_LAYERS))
+@click.option(
+    "--cell-size", default=DEFAULT_HEATMAP_CELL_SIZE, type=float, help="World units"
+)
+@click.option("--workers", default=None, type=int)
+def heatmap(lev_file, rec_dir, outfile, layer, cell_size, workers):
+    from elma_recplot.elma_loader import load_lev
+    from elma_recplot.heatmap import Heatmap, heatmap_many
+    from elma_recplot.plot import draw_heatmap, write_figures_html
+
+    lev = load_lev(lev_file)
+    recs = sorted(glob.glob(os.path.join(rec_dir, "*.rec")))
+    counts = heatmap_many(Heatmap.for_lev(lev, cell_size), recs, workers=workers)
+    logger.info(f"Saving {layer} heatmap of {counts.n_recs} recs to {outfile.name!r}")
+    write_figures_html([draw_heatmap(counts, lev, layer=layer)], outfile)
+
+
+@cli.command(help="Check recs/levs for truncation, bad values and lev mismatches")
+@click.argument("paths", type=click.Path(exists=True), nargs=-1, required=True)
+@click.option("--workers", default=None, type=int)
+@click.option(
+    "--outfile",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Per-file status as .csv or .parquet",
+)
+@click.option("--all", "show_all", is_flag=True, help="List valid files too")
+def validate(paths, workers, outfile, show_all):
+    from elma_recplot.validate import validate_many
+
+    # Directories: the recs/levs in them. Recs are checked against levs found
+    #  among all paths
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "*.lev")))
+            files += sorted(glob.glob(os.path.join(path, "*.rec")))
+        else:
+            files.append(path)
+    statuses = validate_many(files, workers=workers)
+    invalid = statuses.filter(~statuses["ok"])
+    shown = statuses if show_all else invalid
+    if len(shown):
+        columns = ["file", "kind", "ok", "problems"]
+        click.echo(shown.select(columns).to_pandas().to_markdown(index=False))
+    if outfile is not None:
+        if outfile.endswith(".parquet"):
+            statuses.write_parquet(outfile)
+        else:
+            statuses.write_csv(outfile)
+    n_unchecked = statuses.filter(statuses["lev_checked"].not_()).height
+    click.echo(
+        f"{len(invalid)}/{len(statuses)} files invalid; "
+        f"{n_unchecked} recs without their lev among the files"
+    )
+    if len(invalid):
+        raise SystemExit(1)
+
+
+@cli.command(help="Crawl replay metadata pages into a parquet file")
+@click.option("--first-page", default=0, type=int)
+@click.option("--last-page", default=100, type=int, help="Inclusive")
+@click.option("--page-size", default=100, type=int)
+@click.option("--workers", default=8, type=int)
+@click.option("--rps", default=5.0, type=float, help="Max requests per second")
+@click.option("--outfile", default="replays.parquet", type=click.Path(dir_okay=False))
+def crawl_replays(first_page, last_page, page_size, workers, rps, outfile):
+    from elma_recplot.eol_tools import crawl_replays_to_parquet
+
+    n_replays = crawl_replays_to_parquet(
+        range(first_page, last_page + 1),
+        outfile,
+        page_size=page_size,
+        workers=workers,
+        requests_per_second=rps,
+    )
+    logger.info(f"Wrote {n_replays} replays to {outfile!r}")
 
 
 @cli.command(help="Create a page with recent replays")
@@ -63,9 +334,153 @@ def plot_rec(rec_file, lev_file, outfile):
     "--rec-dir", default="recs", type=click.Path(exists=True, file_okay=False)
 )
 @click.option("--num", default=20, type=int)
-def make_page(index_page, index_dir, rec_dir, num):
+@click.option("--max-points", default=None, type=int, help="Trajectory point budget")
+@click.option("--lod-method", default="lttb", type=click.Choice(LOD_METHODS))
+@click.option(
+    "--lod-tolerance",
+    default=None,
+    type=float,
+    help="rdp/grid tolerance in world units; overrides the point budget",
+)
+@click.option(
+    "--compact/--no-compact", default=True, help="Embed coordinates as float32"
+)
+@click.option("--download-workers", default=POOL_MAXSIZE, type=int)
+@click.option("--render-workers", default=None, type=int, help="Default: one per CPU")
+@click.option(
+    "--layer-cache-dir",
+    default=DEFAULT_LAYER_CACHE_DIR,
+    type=click.Path(file_okay=False),
+    help="Rendered level layer cache; empty to disable",
+)
+@click.option(
+    "--max-pages", default=50, type=int, help="API pages to walk for new replays"
+)
+def make_page(
+    index_page,
+    index_dir,
+    rec_dir,
+    num,
+    max_points,
+    lod_method,
+    lod_tolerance,
+    compact,
+    download_workers,
+    render_workers,
+    layer_cache_dir,
+    max_pages,
+):
+    from elma_recplot.page_creation import make_recent_replay_page
+
+    _check_lod_tolerance(lod_method, lod_tolerance)
     make_recent_replay_page(
-        index_page=os.path.join(index_dir, index_page), rec_dir=rec_dir, num=num
+        index_page=os.path.join(index_dir, index_page),
+        rec_dir=rec_dir,
+        num=num,
+        max_points=max_points,
+        lod_method=lod_method,
+        lod_tolerance=lod_tolerance,
+        compact=compact,
+        download_workers=download_workers,
+        render_workers=render_workers,
+        layer_cache_dir=layer_cache_dir or None,
+        max_pages=max_pages,
+    )
+
+
+@cli.group(help="Inspect/prune the rendered level layer cache")
+@click.option(
+    "--cache-dir", default=DEFAULT_LAYER_CACHE_DIR, type=click.Path(file_okay=False)
+)
+@click.pass_context
+def layer_cache(ctx, cache_dir):
+    # Opened by the subcommands, so `layer-cache <cmd> --help` stays light
+    ctx.obj = cache_dir
+
+
+def _open_layer_cache(cache_dir: str) -> "LevLayerCache":
+    from elma_recplot.layer_cache import LevLayerCache
+
+    return LevLayerCache(cache_dir)
+
+
+@layer_cache.command(name="stats", help="List cached level layers")
+@click.pass_obj
+def layer_cache_stats(cache_dir):
+    stats = _open_layer_cache(cache_dir).stats().sort("last_used", descending=True)
+    click.echo(stats.to_pandas().to_markdown(index=False))
+    click.echo(f"{len(stats)} layers, {stats['bytes'].sum()} bytes")
+
+
+@layer_cache.command(
+    name="prune", help="Drop layers of old layer versions or unused for a while"
+)
+@click.option("--max-age-days", default=None, type=float)
+@click.pass_obj
+def layer_cache_prune(cache_dir, max_age_days):
+    _open_layer_cache(cache_dir).prune(max_age_days=max_age_days)
+
+
+@cli.group(help="Inspect/trim the downloaded rec/lev blob store")
+@click.option(
+    "--store-dir", default=DEFAULT_BLOB_STORE_DIR, type=click.Path(file_okay=False)
+)
+@click.pass_context
+def cache(ctx, store_dir):
+    # Opened by the subcommands, so `cache <cmd> --help` stays light
+    ctx.obj = store_dir
+
+
+def _open_blob_store(store_dir: str) -> "BlobStore":
+    from elma_recplot.blob_store import BlobStore
+
+    return BlobStore(store_dir, max_bytes=None)
+
+
+@cache.command(name="stats", help="Entries and bytes per kind")
+@click.pass_obj
+def cache_stats(store_dir):
+    store = _open_blob_store(store_dir)
+    stats = store.stats()
+    click.echo(stats.to_pandas().to_markdown(index=False))
+    click.echo(f"{store.total_bytes()} bytes in {store.store_dir!r}")
+
+
+@cache.command(
+    name="gc", help="Drop unreferenced blobs and least recently used entries"
+)
+@click.option("--max-bytes", default=DEFAULT_MAX_BYTES, type=int)
+@click.pass_obj
+def cache_gc(store_dir, max_bytes):
+    store = _open_blob_store(store_dir)
+    freed = store.gc(max_bytes=max_bytes)
+    click.echo(f"Freed {freed} bytes; {store.total_bytes()} bytes remain")
+
+
+@cli.command(help="Convert a directory of recs/levs into a parquet store")
+@click.argument("src_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("store_dir", type=click.Path(file_okay=False))
+@click.option("--workers", default=None, type=int)
+@click.option(
+    "--files-per-part",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Files loaded and written at a time; bounds peak memory",
+)
+def ingest(src_dir, store_dir, workers, files_per_part):
+    from elma_recplot.store import INGEST_FILES_PER_PART
+    from elma_recplot.store import ingest as ingest_to_store
+
+    new_index = ingest_to_store(
+        src_dir,
+        store_dir,
+        workers=workers,
+        files_per_part=files_per_part or INGEST_FILES_PER_PART,
+    )
+    n_failed = new_index["error"].count()
+    logger.info(
+        f"Ingested {len(new_index) - n_failed} files into {store_dir!r}, "
+        f"{n_failed} failed"
     )
 
 
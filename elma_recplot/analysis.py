@@ -0,0 +1,168 @@
+import logging
+import math
+import typing
+
+import polars as pl
+
+from elma_recplot.elma_loader import ROT_FULL_TURN, EventType, Rec, frame_expr
+
+logger = logging.getLogger(__name__)
+
+# Ground touches are only recorded on impact: gaps between touches at least
+#  this long (s) are counted as airtime
+MIN_AIR_GAP = 0.5
+VOLT_EVENT_TYPES = (EventType.VOLT_LEFT.value, EventType.VOLT_RIGHT.value)
+
+FrameT = typing.TypeVar("FrameT", pl.DataFrame, pl.LazyFrame)
+
+# Everything below works on one rec (by=None) or on many concatenated ones,
+#  grouped by `by` (see `concat_rec_frames`/`concat_rec_events`). Frames need
+#  the `x`, `y` and `rot` columns, and `t` unless they're compact (then it's
+#  taken from the row index); rows of a rec must be in frame order.
+
+
+def _per(expr: pl.Expr, by: str | None) -> pl.Expr:
+    return expr if by is None else expr.over(by)
+
+
+def _diff(name: str, by: str | None) -> pl.Expr:
+    return _per(pl.col(name).diff(), by)
+
+
+def _with_t(frames: FrameT, by: str | None) -> FrameT:
+    if "t" in frames.collect_schema().names():
+        return frames
+    return frames.with_columns(frame_expr("t", by=by))
+
+
+def with_motion(frames: FrameT, by: str | None = None) -> FrameT:
+    # Adds velocity (vx, vy, speed), acceleration (ax, ay, acceleration) and
+    #  angular_velocity (rad/s) by finite differences; null where undefined
+    frames = _with_t(frames, by)
+    dt = _diff("t", by)
+    half_turn = ROT_FULL_TURN / 2
+    # Unwrapped: a step across 0/ROT_FULL_TURN is a small rotation
+    d_rot = (_diff("rot", by).cast(pl.Float32) + half_turn) % ROT_FULL_TURN - half_turn
+    return (
+        frames.with_columns(
+            (_diff("x", by) / dt).alias("vx"),
+            (_diff("y", by) / dt).alias("vy"),
+            (d_rot * (2 * math.pi / ROT_FULL_TURN) / dt).alias("angular_velocity"),
+        )
+        .with_columns(
+            (pl.col("vx") ** 2 + pl.col("vy") ** 2).sqrt().alias("speed"),
+            (_diff("vx", by) / dt).alias("ax"),
+            (_diff("vy", by) / dt).alias("ay"),
+        )
+        .with_columns(
+            (pl.col("ax") ** 2 + pl.col("ay") ** 2).sqrt().alias("acceleration"),
+        )
+    )
+
+
+def _ground_touches(events: FrameT, by: str | None) -> FrameT:
+    # -> touch time `t` (as frames' Float32) and time until the next touch
+    keys = [by] if by else []
+    return (
+        events.filter(pl.col("event_type") == EventType.GROUND.value)
+        .select(*keys, pl.col("timestamp").cast(pl.Float32).alias("t"))
+        .sort(*keys, "t")
+        .with_columns(_per(pl.col("t").diff().shift(-1), by).alias("gap"))
+    )
+
+
+def with_airtime(frames: FrameT, events: FrameT, by: str | None = None) -> FrameT:
+    # Adds `airborne`: the frame lies in a gap of >= MIN_AIR_GAP between two
+    #  ground touches. Before the first and after the last touch is unknown
+    #  and counted as grounded. Touches are sorted by (`by`, t) and frames are
+    #  in frame order per rec, which polars can't check within `by` groups
+    return (
+        _with_t(frames, by)
+        .join_asof(
+            _ground_touches(events, by), on="t", by=by, check_sortedness=by is None
+        )
+        .with_columns((pl.col("gap") >= MIN_AIR_GAP).fill_null(False).alias("airborne"))
+        .drop("gap")
+    )
+
+
+def apple_splits(events: FrameT, by: str | None = None) -> FrameT:
+    # One row per apple taken: its number, time and time since the previous
+    return (
+        events.filter(pl.col("event_type") == EventType.APPLE.value)
+        .sort(*([by] if by else []), "timestamp")
+        .select(
+            *([by] if by else []),
+            _per(pl.int_range(1, pl.len() + 1, dtype=pl.UInt32), by).alias("apple"),
+            pl.col("timestamp").alias("t"),
+            _diff("timestamp", by).fill_null(pl.col("timestamp")).alias("split"),
+        )
+    )
+
+
+def summarize_many(
+    frames: pl.DataFrame | pl.LazyFrame,
+    events: pl.DataFrame | pl.LazyFrame,
+    by: str = "rec_id",
+) -> pl.DataFrame:
+    # One row of run statistics per `by` group; a single lazy query, so all
+    #  groups are processed in parallel
+    frame_stats = (
+        with_motion(frames.lazy(), by)
+        .group_by(by)
+        .agg(
+            pl.len().alias("n_frames"),
+            pl.col("t").max().alias("duration"),
+            (pl.col("x").diff() ** 2 + pl.col("y").diff() ** 2)
+            .sqrt()
+            .sum()
+            .alias("distance"),
+            pl.col("speed").mean().alias("mean_speed"),
+            pl.col("speed").max().alias("max_speed"),
+            pl.col("acceleration").max().alias("max_acceleration"),
+            pl.col("angular_velocity").abs().max().alias("max_angular_velocity"),
+        )
+    )
+    event_type = pl.col("event_type")
+    event_stats = (
+        events.lazy()
+        .group_by(by)
+        .agg(
+            (event_type == EventType.APPLE.value).sum().alias("n_apples"),
+            event_type.is_in(VOLT_EVENT_TYPES).sum().alias("n_volts"),
+            (event_type == EventType.TURN.value).sum().alias("n_turns"),
+            (event_type == EventType.GROUND.value).sum().alias("n_ground_touches"),
+        )
+    )
+    gap = pl.col("gap")
+    air_stats = (
+        _ground_touches(events.lazy(), by)
+        .group_by(by)
+        .agg(
+            gap.filter(gap >= MIN_AIR_GAP).sum().alias("airtime"),
+            gap.filter(gap >= MIN_AIR_GAP).max().alias("max_airtime"),
+        )
+    )
+    return (
+        frame_stats.join(event_stats, on=by, how="left")
+        .join(air_stats, on=by, how="left")
+        .with_columns(
+            pl.col(
+                "n_apples", "n_volts", "n_turns", "n_ground_touches", "airtime"
+            ).fill_null(0)
+        )
+        .sort(by)
+        .collect()
+    )
+
+
+def summarize(rec: Rec) -> dict:
+    by = "rec_id"
+    rec_id = pl.lit(0, pl.UInt32).alias(by)
+    return (
+        summarize_many(
+            rec.frames.with_columns(rec_id), rec.events.with_columns(rec_id), by=by
+        )
+        .drop(by)
+        .row(0, named=True)
+    )
@@ -0,0 +1,262 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import polars as pl
+
+from elma_recplot.defaults import DEFAULT_BLOB_STORE_DIR, DEFAULT_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+STORE_FILE = "blobs.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES objects(sha256),
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (kind, id, name)
+);
+CREATE TABLE IF NOT EXISTS pins (
+    sha256 TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (sha256, pid)
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+CREATE INDEX IF NOT EXISTS entries_sha256 ON entries(sha256);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill would terminate it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class BlobStore:
+    # Downloaded rec/lev files, content-addressed, in one SQLite file
+    #  <store_dir>/blobs.sqlite: each distinct content once, plus entries
+    #  mapping (kind, id, name) to it and tracking last use; the least
+    #  recently used entries are evicted beyond `max_bytes`.
+    #  Pinned content (`pin=True` on lookup/put, until `unpin`) is kept by gc
+    #  in any process, for files handed on to be read later. Pins are stored
+    #  per pid; those of exited processes are dropped by gc
+    def __init__(
+        self,
+        store_dir: str = DEFAULT_BLOB_STORE_DIR,
+        max_bytes: int | None = DEFAULT_MAX_BYTES,
+    ):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Opened on first use; shared by download threads under `_lock`
+        if self._db is None:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(self.store_dir, STORE_FILE),
+                timeout=30,
+                check_same_thread=False,
+                isolation_level=None,
+            )
+            # Set before the first table is created; gc hands space back
+            self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def read(self, sha256: str) -> memoryview:
+        # By content hash; doesn't mark it used, so usable from any process
+        with self._lock:
+            row = self.db.execute(
+                "SELECT data FROM objects WHERE sha256=?", (sha256,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"Blob {sha256} not in store {self.store_dir!r}")
+        return memoryview(row[0])
+
+    def _pin(self, sha256: str):
+        # Under `_lock`
+        self.db.execute(
+            "INSERT INTO pins VALUES (?, ?, 1) "
+            "ON CONFLICT (sha256, pid) DO UPDATE SET count = count + 1",
+            (sha256, os.getpid()),
+        )
+
+    def lookup(
+        self,
+        kind: str,
+        key: str | int,
+        name: str = "",
+        max_age_days: float | None = None,
+        pin: bool = False,
+    ) -> str | None:
+        # -> sha256 of the content stored for (kind, key, name), marking it used
+        now = time.time()
+        with self._lock:
+            row = self.db.execute(
+                "SELECT sha256, created FROM entries WHERE kind=? AND id=? AND name=?",
+                (kind, str(key), name),
+            ).fetchone()
+            if row is None:
+                return None
+            sha256, created = row
+            if max_age_days is not None and now - created > max_age_days * 86400:
+                return None
+            self.db.execute(
+                "UPDATE entries SET last_used=? WHERE kind=? AND id=? AND name=?",
+                (now, kind, str(key), name),
+            )
+            if pin:
+                self._pin(sha256)
+        return sha256
+
+    def get(
+        self,
+        kind: str,
+        key: str | int,
+        name: str = "",
+        max_age_days: float | None = None,
+    ) -> memoryview | None:
+        sha256 = self.lookup(kind, key, name, max_age_days)
+        return None if sha256 is None else self.read(sha256)
+
+    def put(
+        self, kind: str, key: str | int, name: str, data: bytes, pin: bool = False
+    ) -> str:
+        sha256 = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            db = self.db
+            # One transaction, so gc elsewhere can't drop the content between
+            #  storing it and adding its entry
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "INSERT OR IGNORE INTO objects VALUES (?, ?, ?)",
+                    (sha256, len(data), data),
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (kind, str(key), name, sha256, now, now),
+                )
+                if pin:
+                    self._pin(sha256)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        if self.max_bytes is not None and self.total_bytes() > self.max_bytes:
+            self.gc(self.max_bytes)
+        return sha256
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            (total,) = self.db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM objects"
+            ).fetchone()
+        return total
+
+    def unpin(self, sha256: str):
+        with self._lock:
+            self.db.execute(
+                "UPDATE pins SET count = count - 1 WHERE sha256=? AND pid=?",
+                (sha256, os.getpid()),
+            )
+            self.db.execute("DELETE FROM pins WHERE count <= 0")
+
+    def gc(self, max_bytes: int | None = None) -> int:
+        # Remove unreferenced objects, then least recently used entries (and
+        #  their objects once unreferenced) until at most `max_bytes` remain.
+        #  Content pinned by a live process is skipped. -> number of bytes freed
+        freed = 0
+        with self._lock:
+            db = self.db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for (pid,) in db.execute("SELECT DISTINCT pid FROM pins").fetchall():
+                    if not _pid_alive(pid):
+                        db.execute("DELETE FROM pins WHERE pid=?", (pid,))
+                pinned = {sha256 for (sha256,) in db.execute("SELECT sha256 FROM pins")}
+                (total,) = db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM objects"
+                ).fetchone()
+                for sha256, size in db.execute(
+                    "SELECT sha256, size FROM objects "
+                    "WHERE sha256 NOT IN (SELECT sha256 FROM entries)"
+                ).fetchall():
+                    if sha256 not in pinned:
+                        db.execute("DELETE FROM objects WHERE sha256=?", (sha256,))
+                        freed += size
+                if max_bytes is not None and total - freed > max_bytes:
+                    for kind, key, name, sha256 in db.execute(
+                        "SELECT kind, id, name, sha256 FROM entries ORDER BY last_used"
+                    ).fetchall():
+                        if total - freed <= max_bytes:
+                            break
+                        if sha256 in pinned:
+                            continue
+                        db.execute(
+                            "DELETE FROM entries WHERE kind=? AND id=? AND name=?",
+                            (kind, key, name),
+                        )
+                        row = db.execute(
+                            "SELECT size FROM objects WHERE sha256=? AND NOT EXISTS "
+                            "(SELECT 1 FROM entries WHERE sha256=?)",
+                            (sha256, sha256),
+                        ).fetchone()
+                        if row is not None:
+                            db.execute("DELETE FROM objects WHERE sha256=?", (sha256,))
+                            freed += row[0]
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            if freed:
+                db.execute("PRAGMA incremental_vacuum")
+        if freed:
+            logger.info(f"Evicted {freed} bytes from blob store {self.store_dir!r}")
+        return freed
+
+    def stats(self) -> pl.DataFrame:
+        # Per kind: entries, distinct blobs and their bytes
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT kind, COUNT(*), COUNT(DISTINCT sha256), "
+                "(SELECT SUM(size) FROM objects WHERE sha256 IN "
+                "(SELECT sha256 FROM entries AS e WHERE e.kind = entries.kind)), "
+                "MAX(last_used) FROM entries GROUP BY kind ORDER BY kind"
+            ).fetchall()
+        return pl.DataFrame(
+            rows,
+            schema={
+                "kind": pl.String,
+                "entries": pl.Int64,
+                "blobs": pl.Int64,
+                "bytes": pl.Int64,
+                "last_used": pl.Float64,
+            },
+            orient="row",
+        ).with_columns(pl.from_epoch("last_used", time_unit="s"))
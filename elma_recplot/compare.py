@@ -0,0 +1,74 @@
+import logging
+import typing
+
+import numpy as np
+import polars as pl
+
+from elma_recplot.elma_loader import Rec
+
+logger = logging.getLogger(__name__)
+
+# Points of the common progress grid used for delta times
+DELTA_POINTS = 2000
+
+# Recs of one level are compared by progress along their own kuski path:
+#  cumulative arc length, normalised to [0, 1]. Every rec starts at 0 and
+#  finishes at 1, so the final delta is the difference in finish times.
+#  Resampling is one `np.interp` per rec and column, never per frame.
+
+
+def arc_length(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    # Cumulative path length at each point, starting at 0
+    steps = np.hypot(np.diff(x), np.diff(y))
+    return np.concatenate([[0.0], np.cumsum(steps, dtype=np.float64)])
+
+
+def progress(frames: pl.DataFrame) -> np.ndarray:
+    # Normalised arc length of the kuski path, per frame
+    s = arc_length(frames["x"].to_numpy(), frames["y"].to_numpy())
+    return s / s[-1] if len(s) and s[-1] > 0 else np.zeros(len(s))
+
+
+def resample_progress(
+    frames: pl.DataFrame,
+    p: np.ndarray,
+    columns: typing.Sequence[str] = ("x", "y", "t"),
+) -> pl.DataFrame:
+    # `columns` at progress values `p` (see `progress`)
+    p_frames = progress(frames)
+    return pl.DataFrame(
+        {"progress": p}
+        | {name: np.interp(p, p_frames, frames[name].to_numpy()) for name in columns}
+    )
+
+
+def time_deltas(
+    recs: typing.Sequence[Rec], reference: int = 0, n_points: int = DELTA_POINTS
+) -> pl.DataFrame:
+    # -> `rec` (position in `recs`), `t` (reference time) and `delta`: how much
+    #  later (positive) than the reference each rec got to the same progress
+    p = np.linspace(0.0, 1.0, n_points)
+    times = {
+        rec_id: resample_progress(rec.frames, p, columns=("t",))["t"].to_numpy()
+        for rec_id, rec in enumerate(recs)
+        if len(rec.frames)
+    }
+    if reference not in times:
+        raise ValueError(f"Reference rec {reference!r} has no frames")
+    t_ref = times[reference]
+    deltas = [
+        pl.DataFrame(
+            {
+                "rec": np.full(n_points, rec_id, dtype=np.uint32),
+                "t": t_ref,
+                "delta": t_rec - t_ref,
+            }
+        )
+        for rec_id, t_rec in times.items()
+        if rec_id != reference
+    ]
+    if not deltas:
+        return pl.DataFrame(
+            schema={"rec": pl.UInt32, "t": pl.Float64, "delta": pl.Float64}
+        )
+    return pl.concat(deltas)
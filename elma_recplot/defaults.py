@@ -0,0 +1,10 @@
+# Settings shared by the CLI and the modules implementing it. Kept free of
+#  heavy imports so that the CLI can build its options without loading them
+DEFAULT_BLOB_STORE_DIR = ".eol_blobs"
+DEFAULT_MAX_BYTES = 2 * 1024**3
+DEFAULT_LAYER_CACHE_DIR = ".lev_layer_cache"
+LOD_METHODS = ("lttb", "rdp", "grid")
+# Max concurrent connections per host; sized for threaded downloads
+POOL_MAXSIZE = 16
+HEATMAP_LAYERS = ("position", "wheels", "head", "gas", "volt", "crash")
+DEFAULT_HEATMAP_CELL_SIZE = 0.5  # world units
@@ -1,25 +1,100 @@
+import functools
+import hashlib
 import logging
+import multiprocessing
+import os
 import struct
+import threading
 import typing
-from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from enum import Enum
 
 import numpy as np
 import polars as pl
 
+from elma_recplot import profiling
+
+if typing.TYPE_CHECKING:
+    from elma_recplot.spatial import PolygonIndex
+
 logger = logging.getLogger(__name__)
 
 #  TODO: verify these constants
 MAGIC_TIME_SCALER = 0.001 / (0.182 * 0.0024)
 REL_POS_SCALER = 1000
+FRAME_RATE = 30  # frames per second of rec frame data
 REC_HEADER_SIZE = 36
 REC_HEADER_FORMAT_STR = "I 12x I 12s 4x"
+REC_CHECKSUM_OFFSET = struct.calcsize("I 12x")
+REC_LEV_NAME_OFFSET = struct.calcsize("I 12x I")
+# Format version at offset 4 of the header, 0x83 in recs Elma writes (and in
+#  elma-rust's writer). Only used for recs not read from a file
+REC_VERSION = 0x83
+REC_END_MARKER = 0x00492F75
+REC_EVENT_DTYPE = np.dtype(
+    [
+        ("timestamp", np.float64),
+        ("event_info", np.uint16),
+        ("event_type", np.uint8),
+        ("unknown_1", np.uint8),
+        ("event_info_2", np.float32),
+    ]
+)
 
 LEV_HEADER_FORMAT_STR = "<5s 2x I 32x 51s 16s 10s 10s d"
 LEV_HEADER_SIZE = 138
+LEV_VERSION = b"POT14"
+LEV_LINK_OFFSET = struct.calcsize("<5s 2x")
+# Four sums over the level's coordinates, each stored with a random offset
+LEV_INTEGRITY_OFFSET = struct.calcsize("<5s 2x I")
+LEV_INTEGRITY_FORMAT_STR = "<4d"
+# (offset, size) of the header's name fields, and offset of the polygon count
+LEV_HEADER_STR_FIELDS = {
+    "name": (struct.calcsize("<5s 2x I 32x"), 51),
+    "lgr": (struct.calcsize("<5s 2x I 32x 51s"), 16),
+    "ground": (struct.calcsize("<5s 2x I 32x 51s 16s"), 10),
+    "sky": (struct.calcsize("<5s 2x I 32x 51s 16s 10s"), 10),
+}
+LEV_POLYGON_COUNT_OFFSET = struct.calcsize("<5s 2x I 32x 51s 16s 10s 10s")
+LEV_OBJECT_DTYPE = np.dtype(
+    [
+        ("x", np.float64),
+        ("y", np.float64),
+        ("object_type", np.int32),
+        ("gravity", np.int32),
+        ("animation", np.int32),
+    ]
+)
 LEV_ITEM_COUNT_SUBTRAHEND = 0.464_364_3  # from elma-rust; what is this?
 assert struct.calcsize(REC_HEADER_FORMAT_STR) == REC_HEADER_SIZE
+# Frame data is stored column-major, one column after another
+REC_FRAME_COLUMNS = (
+    ("x", "f4"),
+    ("y", "f4"),
+    ("l_wheel_x_rel", "i2"),
+    ("l_wheel_y_rel", "i2"),
+    ("r_wheel_x_rel", "i2"),
+    ("r_wheel_y_rel", "i2"),
+    ("head_x_rel", "i2"),
+    ("head_y_rel", "i2"),
+    ("rot", "i2"),
+    ("left_wheel_rot", "i1"),
+    ("right_wheel_rot", "i1"),
+    ("dir_and_throttle", "i1"),
+    ("back_wheel", "i1"),
+    ("collision_strength", "i1"),
+)
+REC_FRAME_SIZE = sum(np.dtype(dtype).itemsize for _, dtype in REC_FRAME_COLUMNS)
+# `rot` units per revolution: bike rotation is stored in 0..10000 for a full
+#  turn, as documented by elma-rust
+ROT_FULL_TURN = 10_000
+POLY_HEADER_FORMAT_STR = "<I I"
+POLY_HEADER_SIZE = 8
+POLY_VERTEX_SIZE = 16
 assert struct.calcsize(LEV_HEADER_FORMAT_STR) == LEV_HEADER_SIZE
+assert struct.calcsize(POLY_HEADER_FORMAT_STR) == POLY_HEADER_SIZE
 
 
 # Two enums defined, but not actually stored in polars df.
@@ -47,6 +122,15 @@ class Rec:
     lev_name: str
     frames: pl.DataFrame  # TODO: pandera
     events: pl.DataFrame  # TODO: pandera
+    # Bytes `load_rec` doesn't interpret (version/multiplayer fields, end
+    #  marker, a multiplayer rec's second part), kept for `dump_rec`
+    raw_header: bytes | None = None
+    trailer: bytes = struct.pack("I", REC_END_MARKER)
+    # Event timestamps as stored in the file, sorted by the `timestamp` they
+    #  scale to (see `_raw_timestamp_lookup`); scaling isn't exactly invertible
+    _raw_timestamps: tuple[np.ndarray, np.ndarray] | None = field(
+        default=None, repr=False
+    )
 
 
 @dataclass
@@ -58,75 +142,320 @@ class Lev:
     polygons: pl.DataFrame  # TODO: pandera
     polygons_coords: pl.DataFrame  # TODO: pandera
     objects: pl.DataFrame  # TODO: pandera
+    sha256: str | None = None  # of the lev file; identifies its content
+    # Bytes `load_lev` doesn't interpret (integrity sums, pictures, top10
+    #  lists...), kept for `dump_lev`. A new Lev is written without them
+    raw_header: bytes | None = None
+    trailer: bytes = b""
+
+    @property
+    def link(self) -> int | None:
+        # Random id the lev was saved with; recs store it as `Rec.checksum`
+        if self.raw_header is None:
+            return None
+        return struct.unpack_from("<I", self.raw_header, LEV_LINK_OFFSET)[0]
+
+    @property
+    def integrity(self) -> tuple[float, float, float, float] | None:
+        if self.raw_header is None:
+            return None
+        return struct.unpack_from(
+            LEV_INTEGRITY_FORMAT_STR, self.raw_header, LEV_INTEGRITY_OFFSET
+        )
+
+    @functools.cached_property
+    def spatial_index(self) -> "PolygonIndex":
+        # Built on first use, then kept with the (LevCache'd) Lev
+        from elma_recplot.spatial import PolygonIndex
+
+        return PolygonIndex.from_lev(self)
+
+
+Source = str | os.PathLike | typing.BinaryIO
+T = typing.TypeVar("T")
+
+
+@dataclass
+class LoadResult(typing.Generic[T]):
+    # One entry of a batch load; exactly one of `value`/`error` is set
+    source: str
+    value: T | None = None
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class BufferReader:
+    # Seekable reader over a bytes-like object, e.g. an mmap'd blob. `read`
+    #  returns views into it, so frames/polygons are decoded without copies
+    def __init__(self, data: bytes | memoryview, name: str = "<buffer>"):
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+        self.name = name
+
+    def read(self, size: int = -1) -> memoryview:
+        stop = len(self._view) if size < 0 else min(self._pos + size, len(self._view))
+        view = self._view[self._pos : stop]
+        self._pos = max(self._pos, stop)
+        return view
+
+    def readinto(self, buffer) -> int:
+        view = self.read(len(buffer))
+        buffer[: len(view)] = view
+        return len(view)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: len(self._view)}
+        self._pos = max(0, base[whence] + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seekable(self) -> bool:
+        return True
+
+
+def _read_block(buffer, size: int) -> bytearray | memoryview:
+    if isinstance(buffer, BufferReader):
+        view = buffer.read(size)
+        if len(view) < size:
+            raise EOFError(f"Expected {size} bytes, got {len(view)}")
+        return view
+    # Single preallocated read; avoids the intermediate `bytes` of `read()`
+    block = bytearray(size)
+    view = memoryview(block)
+    n_read = 0
+    while n_read < size:
+        n = buffer.readinto(view[n_read:])
+        if not n:
+            raise EOFError(f"Expected {size} bytes, got {n_read}")
+        n_read += n
+    return block
+
+
+def frame_columns_from_block(block, number_of_frames: int) -> dict[str, np.ndarray]:
+    # Raw frame columns of a rec's frame block, as numpy views (no copies).
+    #  Column-major layout: each column is an offset view into the same block
+    columns = {}
+    offset = 0
+    for name, dtype in REC_FRAME_COLUMNS:
+        columns[name] = np.frombuffer(
+            block, dtype=dtype, count=number_of_frames, offset=offset
+        )
+        offset += np.dtype(dtype).itemsize * number_of_frames
+    return columns
+
+
+def _read_frame_columns(
+    rec_data: typing.BinaryIO,
+    number_of_frames: int,
+    names: typing.Collection[str],
+    start: int = 0,
+    stop: int | None = None,
+) -> dict[str, np.ndarray]:
+    # Seek to frames [start, stop) of each wanted column; stream must be seekable.
+    #  Leaves the stream at the start of the frame block.
+    stop = number_of_frames if stop is None else stop
+    block_start = rec_data.tell()
+    columns = {}
+    offset = 0
+    for name, dtype in REC_FRAME_COLUMNS:
+        itemsize = np.dtype(dtype).itemsize
+        if name in names:
+            rec_data.seek(block_start + offset + start * itemsize)
+            block = _read_block(rec_data, (stop - start) * itemsize)
+            columns[name] = np.frombuffer(block, dtype=dtype)
+        offset += itemsize * number_of_frames
+    rec_data.seek(block_start)
+    return columns
+
+
+def _complete_frames(
+    rec_data: typing.BinaryIO, number_of_frames: int, names: typing.Collection[str]
+) -> int:
+    # Frames from the start whose `names` columns are all within the stream, for
+    #  a stream at the start of the frame block. Columns are stored one after
+    #  another, so a truncated file cuts the last ones short
+    block_start = rec_data.tell()
+    available = rec_data.seek(0, os.SEEK_END) - block_start
+    rec_data.seek(block_start)
+    n_complete = number_of_frames
+    offset = 0
+    for name, dtype in REC_FRAME_COLUMNS:
+        itemsize = np.dtype(dtype).itemsize
+        if name in names:
+            n_complete = min(n_complete, max(0, available - offset) // itemsize)
+        offset += itemsize * number_of_frames
+    return n_complete
+
+
+def _derived_frame_columns(
+    first_frame: int = 0,
+    float_dtype: type[pl.DataType] = pl.Float64,
+    by: str | None = None,
+) -> dict[str, pl.Expr]:
+    # `t` counts rows, so on concatenated recs it restarts per `by` group
+    t = pl.int_range(first_frame, first_frame + pl.len()).cast(pl.Float32) / FRAME_RATE
+
+    def absolute(name: str, rel_name: str) -> pl.Expr:
+        return (
+            pl.col(name).cast(float_dtype)
+            + pl.col(rel_name).cast(float_dtype) / REL_POS_SCALER
+        )
+
+    return {
+        "t": t if by is None else t.over(by),
+        "l_wheel_x": absolute("x", "l_wheel_x_rel"),
+        "l_wheel_y": absolute("y", "l_wheel_y_rel"),
+        "r_wheel_x": absolute("x", "r_wheel_x_rel"),
+        "r_wheel_y": absolute("y", "r_wheel_y_rel"),
+        "head_x": absolute("x", "head_x_rel"),
+        "head_y": absolute("y", "head_y_rel"),
+        # TODO: validate the following interpretation of "dir_and_throttle"
+        "is_gasing": (pl.col("dir_and_throttle") & 0b1) == 0b1,
+        "is_right": (pl.col("dir_and_throttle") & 0b10) == 0b10,
+        "is_gasing_right": (pl.col("dir_and_throttle") & 0b11) == 0b11,
+        "is_gasing_left": (pl.col("dir_and_throttle") & 0b11) == 0b01,
+    }
+
+
+FRAME_COLUMNS = tuple(name for name, _ in REC_FRAME_COLUMNS) + tuple(
+    _derived_frame_columns()
+)
+
+
+def frame_expr(name: str, first_frame: int = 0, by: str | None = None) -> pl.Expr:
+    # Any of FRAME_COLUMNS as an expression that also works on compact frames
+    #  (`load_rec(compact=True)`): positions as Float32, `t` from the row
+    #  index, per `by` group (e.g. "rec_id") for concatenated recs
+    if name in FRAME_COLUMNS[: len(REC_FRAME_COLUMNS)]:
+        return pl.col(name)
+    derived = _derived_frame_columns(first_frame, pl.Float32, by)
+    if name not in derived:
+        raise ValueError(f"Unknown frame column {name!r}")
+    return derived[name].alias(name)
+
+
+def expand_frames(
+    frames: pl.DataFrame, first_frame: int = 0, by: str | None = None
+) -> pl.DataFrame:
+    # Compact frames -> the wide frames `load_rec` returns by default; extra
+    #  columns (e.g. `rec_id`) are kept after them. Concatenated recs need
+    #  `by="rec_id"`, or `t` runs on across recs
+    derived = _derived_frame_columns(first_frame, by=by)
+    frames = frames.with_columns(
+        expr.alias(name) for name, expr in derived.items() if name not in frames.columns
+    )
+    return frames.select(
+        *FRAME_COLUMNS, *(name for name in frames.columns if name not in FRAME_COLUMNS)
+    )
+
 
+def compact_frames(frames: pl.DataFrame) -> pl.DataFrame:
+    # Inverse of `expand_frames`: drops the derived columns
+    return frames.drop(
+        name for name in _derived_frame_columns() if name in frames.columns
+    )
+
+
+def _resolve_frame_columns(
+    columns: typing.Collection[str] | None,
+) -> tuple[list[str], list[str]]:
+    # -> (raw columns to decode, derived columns to compute)
+    raw_names = [name for name, _ in REC_FRAME_COLUMNS]
+    derived = _derived_frame_columns()
+    if columns is None:
+        return raw_names, list(derived)
+    unknown = set(columns) - set(FRAME_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown frame columns: {sorted(unknown)!r}")
+    derived_names = [name for name in derived if name in columns]
+    needed = set(columns).union(
+        *(derived[name].meta.root_names() for name in derived_names)
+    )
+    return [name for name in raw_names if name in needed], derived_names
+
+
+def _build_frames(
+    raw_columns: dict[str, np.ndarray],
+    derived_names: list[str],
+    columns: typing.Collection[str] | None,
+    first_frame: int = 0,
+) -> pl.DataFrame:
+    derived = _derived_frame_columns(first_frame)
+    frames = pl.DataFrame(data=raw_columns).with_columns(
+        [derived[name].alias(name) for name in derived_names]
+    )
+    if columns is not None:
+        frames = frames.select(name for name in FRAME_COLUMNS if name in columns)
+    return frames
+
+
+def _build_events(events: np.ndarray) -> pl.DataFrame:
+    return pl.DataFrame(events).with_columns(pl.col("timestamp") * MAGIC_TIME_SCALER)
+
+
+def _raw_timestamp_lookup(raw: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # (scaled, raw) sorted by scaled, for `_raw_event_timestamps`
+    scaled = raw * MAGIC_TIME_SCALER
+    order = np.argsort(scaled, kind="stable")
+    return scaled[order], raw[order]
 
-def _col_from_buffer(buffer, size, dtype):
-    # Works with simple or composite dtypes
-    return np.frombuffer(buffer.read((np.dtype(dtype).itemsize) * size), dtype=dtype)
 
+def decode_rec_lev_name(raw: bytes) -> str:
+    # The rec header's 12-byte lev name field -> "<name>.lev"
+    return raw.decode("latin1").split(".")[0] + ".lev"
 
-def load_rec(rec_data: typing.BinaryIO) -> Rec:
+
+def _read_rec_header(rec_data: typing.BinaryIO) -> tuple[int, int, str, bytes]:
+    header = bytes(_read_block(rec_data, REC_HEADER_SIZE))
     number_of_frames, crc_checksum, level_name = struct.unpack(
-        REC_HEADER_FORMAT_STR, rec_data.read(struct.calcsize(REC_HEADER_FORMAT_STR))
+        REC_HEADER_FORMAT_STR, header
     )
-    level_name = level_name.decode("latin1").split(".")[0] + ".lev"
+    level_name = decode_rec_lev_name(level_name)
     logger.info(f"Loaded rec. Frames: {number_of_frames!r}; checksum: {crc_checksum!r}")
+    return number_of_frames, crc_checksum, level_name, header
+
+
+@profiling.timed("load_rec")
+def load_rec(
+    rec_data: typing.BinaryIO,
+    columns: typing.Collection[str] | None = None,
+    compact: bool = False,
+) -> Rec:
+    # `columns` limits `Rec.frames` to those raw/derived columns (see FRAME_COLUMNS).
+    #  `compact` keeps only the raw columns (and those derived ones depend on),
+    #  about a third of the memory; see `frame_expr` and `expand_frames`
+    number_of_frames, crc_checksum, level_name, header = _read_rec_header(rec_data)
 
-    # TODO: possible to load column-major data directly as composite dtype?
-    frames = pl.DataFrame(
-        data={
-            "x": _col_from_buffer(rec_data, number_of_frames, "f4"),
-            "y": _col_from_buffer(rec_data, number_of_frames, "f4"),
-            "l_wheel_x_rel": _col_from_buffer(rec_data, number_of_frames, "i2"),
-            "l_wheel_y_rel": _col_from_buffer(rec_data, number_of_frames, "i2"),
-            "r_wheel_x_rel": _col_from_buffer(rec_data, number_of_frames, "i2"),
-            "r_wheel_y_rel": _col_from_buffer(rec_data, number_of_frames, "i2"),
-            "head_x_rel": _col_from_buffer(rec_data, number_of_frames, "i2"),
-            "head_y_rel": _col_from_buffer(rec_data, number_of_frames, "i2"),
-            "rot": _col_from_buffer(rec_data, number_of_frames, "i2"),
-            "left_wheel_rot": _col_from_buffer(rec_data, number_of_frames, "i1"),
-            "right_wheel_rot": _col_from_buffer(rec_data, number_of_frames, "i1"),
-            "dir_and_throttle": _col_from_buffer(rec_data, number_of_frames, "i1"),
-            "back_wheel": _col_from_buffer(rec_data, number_of_frames, "i1"),
-            "collision_strength": _col_from_buffer(rec_data, number_of_frames, "i1"),
+    raw_names, derived_names = _resolve_frame_columns(columns)
+    if compact:
+        derived_names, columns = [], None
+    if len(raw_names) < len(REC_FRAME_COLUMNS) and rec_data.seekable():
+        # Only read the wanted columns; don't keep the whole block alive
+        raw_columns = _read_frame_columns(rec_data, number_of_frames, raw_names)
+        rec_data.seek(REC_FRAME_SIZE * number_of_frames, 1)
+    else:
+        frame_block = _read_block(rec_data, REC_FRAME_SIZE * number_of_frames)
+        raw_columns = {
+            name: col
+            for name, col in frame_columns_from_block(
+                frame_block, number_of_frames
+            ).items()
+            if name in raw_names
         }
-    ).with_columns(
-        [
-            (pl.int_range(pl.len()).cast(pl.Float32) / 30).alias("t"),
-            (pl.col("x") + pl.col("l_wheel_x_rel") / REL_POS_SCALER).alias("l_wheel_x"),
-            (pl.col("y") + pl.col("l_wheel_y_rel") / REL_POS_SCALER).alias("l_wheel_y"),
-            (pl.col("x") + pl.col("r_wheel_x_rel") / REL_POS_SCALER).alias("r_wheel_x"),
-            (pl.col("y") + pl.col("r_wheel_y_rel") / REL_POS_SCALER).alias("r_wheel_y"),
-            (pl.col("x") + pl.col("head_x_rel") / REL_POS_SCALER).alias("head_x"),
-            (pl.col("y") + pl.col("head_y_rel") / REL_POS_SCALER).alias("head_y"),
-            # TODO: validate the following interpretation of "dir_and_throttle"
-            ((pl.col("dir_and_throttle") & 0b1) == 0b1).alias("is_gasing"),
-            ((pl.col("dir_and_throttle") & 0b10) == 0b10).alias("is_right"),
-            ((pl.col("dir_and_throttle") & 0b11) == 0b11).alias("is_gasing_right"),
-            ((pl.col("dir_and_throttle") & 0b11) == 0b01).alias("is_gasing_left"),
-        ]
-    )
+    frames = _build_frames(raw_columns, derived_names, columns)
     logger.info(f"Loaded {len(frames)} frames")
 
-    (number_of_events,) = struct.unpack("I", rec_data.read(struct.calcsize("I")))
+    # Short reads raise EOFError rather than decoding a truncated file
+    (number_of_events,) = struct.unpack("I", _read_block(rec_data, 4))
     logger.info(f"Number of events: {number_of_events}")
-    events_df = pl.DataFrame(
-        _col_from_buffer(
-            rec_data,
-            number_of_events,
-            np.dtype(
-                [
-                    ("timestamp", np.float64),
-                    ("event_info", np.uint16),
-                    ("event_type", np.uint8),
-                    ("unknown_1", np.uint8),
-                    ("event_info_2", np.float32),
-                ]
-            ),
-        )
-    ).with_columns(
-        pl.col("timestamp") * MAGIC_TIME_SCALER,
-    )
+    events_block = _read_block(rec_data, REC_EVENT_DTYPE.itemsize * number_of_events)
+    events = np.frombuffer(events_block, dtype=REC_EVENT_DTYPE)
+    events_df = _build_events(events)
     logger.info(f"Loaded {len(events_df)} events")
 
     return Rec(
@@ -134,22 +463,118 @@ def load_rec(rec_data: typing.BinaryIO) -> Rec:
         lev_name=level_name,
         frames=frames,
         events=events_df,
+        raw_header=header,
+        trailer=bytes(rec_data.read()),
+        _raw_timestamps=_raw_timestamp_lookup(events["timestamp"]),
+    )
+
+
+def iter_rec_frames(
+    rec_data: typing.BinaryIO,
+    chunk_size: int = 30 * 60,
+    columns: typing.Collection[str] | None = None,
+) -> typing.Iterator[pl.DataFrame]:
+    # Yield `Rec.frames` in windows of `chunk_size` frames, without events.
+    #  Only one window of the requested columns is held in memory at a time;
+    #  needs a seekable stream. A truncated rec yields the frames whose
+    #  requested columns are all in the file, then logs a warning and stops
+    if chunk_size <= 0:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size!r}")
+    number_of_frames, _, _, _ = _read_rec_header(rec_data)
+    raw_names, derived_names = _resolve_frame_columns(columns)
+    n_complete = _complete_frames(rec_data, number_of_frames, raw_names)
+    for start in range(0, n_complete, chunk_size):
+        stop = min(start + chunk_size, n_complete)
+        raw_columns = _read_frame_columns(
+            rec_data, number_of_frames, raw_names, start, stop
+        )
+        yield _build_frames(raw_columns, derived_names, columns, first_frame=start)
+    if n_complete < number_of_frames:
+        logger.warning(
+            f"Rec truncated: stopped after {n_complete} of {number_of_frames} frames"
+        )
+
+
+def _poly_areas(
+    x: np.ndarray, y: np.ndarray, starts: np.ndarray, n_vertices: np.ndarray
+) -> np.ndarray:
+    # Shoelace formula per polygon; `prev` is a per-polygon np.roll(..., 1).
+    #  Summed in another order than a per-polygon np.dot, so the last bits can
+    #  differ from such a sum (within 1e-10 relative)
+    prev = np.arange(len(x)) - 1
+    prev[starts[n_vertices > 0]] = (starts + n_vertices - 1)[n_vertices > 0]
+    if len(x) == 0:
+        return np.zeros(len(starts))
+    _starts = np.minimum(starts, len(x) - 1)
+    area = 0.5 * (
+        np.add.reduceat(x * y[prev], _starts) - np.add.reduceat(y * x[prev], _starts)
+    )
+    return np.where(n_vertices > 0, area, 0.0)
+
+
+def scan_polygon_headers(buffer, num_polygons: int) -> tuple[np.ndarray, np.ndarray]:
+    # -> byte offset of each polygon header in `buffer` (the lev body), and the
+    #  (is_grass, n_vertices) headers; raises struct.error if truncated.
+    #  Each header's offset follows from the previous one's vertex count, so
+    #  the chain is followed by pointer doubling, log2(num_polygons) steps
+    n_slots = len(buffer) // 8
+    words = np.frombuffer(buffer, dtype="<u4", count=2 * n_slots).reshape(-1, 2)
+    # Were each 8-byte slot a header, the slot after its polygon. Real headers
+    #  are among the slots whose polygon would fit in the buffer
+    after = np.arange(1, n_slots + 1) + 2 * words[:, 1].astype(np.int64)
+    candidates = np.flatnonzero(after <= n_slots)
+    after = after[candidates]
+    # Jumps between candidates, or to len(candidates) when landing elsewhere
+    pos = np.minimum(np.searchsorted(candidates, after), max(len(candidates) - 1, 0))
+    end = len(candidates)
+    jump = np.append(np.where(candidates[pos] == after, pos, end), end)
+    chain = np.zeros(min(num_polygons, 1), dtype=np.int64)
+    while len(chain) < num_polygons:
+        chain = np.concatenate([chain, jump[chain]])
+        jump = jump[jump]
+    chain = chain[:num_polygons]
+    if num_polygons and (not end or candidates[0] != 0 or chain[-1] == end):
+        raise struct.error(f"Polygons truncated: {num_polygons} in {len(buffer)} B")
+    slots = candidates[chain]
+    return slots * 8, words[slots].astype(np.int64)
+
+
+def _build_polygons(
+    x: np.ndarray, y: np.ndarray, headers: np.ndarray
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    # -> (polygons, polygons_coords); `headers` are (is_grass, n_vertices) rows
+    num_polygons = len(headers)
+    n_vertices = headers[:, 1]
+    starts = np.cumsum(n_vertices) - n_vertices
+    polygons_coords = pl.DataFrame(
+        {
+            "x": x,
+            "y": y,
+            "index": np.repeat(np.arange(num_polygons, dtype=np.int32), n_vertices),
+        }
+    )
+    polygons = pl.DataFrame(
+        {
+            "index": np.arange(num_polygons, dtype=np.int64),
+            "is_grass": headers[:, 0].astype(bool),
+            "n_vertices": n_vertices,
+            "area": _poly_areas(x, y, starts, n_vertices),
+        }
     )
+    return polygons, polygons_coords
 
 
-def _poly_area(x: pl.Series, y: pl.Series) -> float:
-    # TODO: can this be done with polars series directly?
-    _x = x.to_numpy()
-    _y = y.to_numpy()
-    area = 0.5 * (np.dot(_x, np.roll(_y, 1)) - np.dot(_y, np.roll(_x, 1)))
-    return area
+def _build_objects(objects: np.ndarray) -> pl.DataFrame:
+    return pl.DataFrame(objects).with_columns(
+        pl.col("y") * -1.0,
+    )
 
 
+@profiling.timed("load_lev")
 def load_lev(lev_data: typing.BinaryIO) -> Lev:
+    lev_header = lev_data.read(struct.calcsize(LEV_HEADER_FORMAT_STR))
     (version, link, level_name, lgr_name, ground_name, sky_name, num_polygons) = (
-        struct.unpack(
-            LEV_HEADER_FORMAT_STR, lev_data.read(struct.calcsize(LEV_HEADER_FORMAT_STR))
-        )
+        struct.unpack(LEV_HEADER_FORMAT_STR, lev_header)
     )
     level_name, lgr_name, ground_name, sky_name = map(
         lambda el: el.split(b"\0")[0].decode("latin-1"),
@@ -166,63 +591,38 @@ def load_lev(lev_data: typing.BinaryIO) -> Lev:
         f"Polygons: {num_polygons!r} "
     )
 
-    # Load polys
-    summary_rows = []
-    poly_coords_dfs = []
-    poly_header_format_str = "<I I"
-    for p_idx in range(num_polygons):
-        grass, num_vertices = struct.unpack(
-            poly_header_format_str,
-            lev_data.read(struct.calcsize(poly_header_format_str)),
-        )
-        grass = bool(grass)
-        poly_coords_df = pl.DataFrame(
-            _col_from_buffer(
-                lev_data,
-                num_vertices,
-                np.dtype([("x", np.float64), ("y", np.float64)]),
-            )
-        )
-        poly_coords_df = poly_coords_df.with_columns(
-            pl.lit(p_idx).alias("index"),
-            pl.col("y") * -1.0,  # TODO: why negative?
-        )
-        poly_coords_dfs.append(poly_coords_df)
-
-        summary_rows.append(
-            {
-                "index": p_idx,
-                "is_grass": grass,
-                "n_vertices": num_vertices,
-                "area": _poly_area(poly_coords_df["x"], poly_coords_df["y"]),
-            }
-        )
+    # Polygons and objects are variable length; decode from the remaining bytes
+    lev_body = lev_data.read()
+    sha256 = hashlib.sha256(lev_header)
+    sha256.update(lev_body)
 
-    polygons = pl.DataFrame(summary_rows)
-    polygons_coords = pl.concat(poly_coords_dfs)
+    # Load polys
+    header_offsets, headers = scan_polygon_headers(lev_body, num_polygons)
+    n_vertices = headers[:, 1]
+    polys_end = (
+        int(header_offsets[-1] + POLY_HEADER_SIZE + POLY_VERTEX_SIZE * n_vertices[-1])
+        if num_polygons
+        else 0
+    )
+    # Headers and vertices are both multiples of 8 bytes: drop the header slots
+    slots = np.frombuffer(lev_body, dtype=np.float64, count=polys_end // 8)
+    is_vertex = np.ones(len(slots), dtype=bool)
+    is_vertex[header_offsets // 8] = False
+    coords = slots[is_vertex].reshape(-1, 2)
+    y = coords[:, 1] * -1.0  # TODO: why negative?
+    polygons, polygons_coords = _build_polygons(coords[:, 0], y, headers)
     logger.info(f"Loaded {len(polygons)} polygons")
 
     # Load objects
     # object_count = (remaining.read_f64::<LE>()? - 0.464_364_3).round() as usize;
-    (n_objects,) = struct.unpack("d", lev_data.read(struct.calcsize("d")))
+    (n_objects,) = struct.unpack_from("d", lev_body, polys_end)
     n_objects = round(n_objects - LEV_ITEM_COUNT_SUBTRAHEND)
     logger.info(f"Number of objects: {n_objects}")
-    objects_df = pl.DataFrame(
-        _col_from_buffer(
-            lev_data,
-            n_objects,
-            np.dtype(
-                [
-                    ("x", np.float64),
-                    ("y", np.float64),
-                    ("object_type", np.int32),
-                    ("gravity", np.int32),
-                    ("animation", np.int32),
-                ]
-            ),
+    objects_start = polys_end + struct.calcsize("d")
+    objects_df = _build_objects(
+        np.frombuffer(
+            lev_body, dtype=LEV_OBJECT_DTYPE, count=n_objects, offset=objects_start
         )
-    ).with_columns(
-        pl.col("y") * -1.0,
     )
 
     return Lev(
@@ -233,4 +633,411 @@ def load_lev(lev_data: typing.BinaryIO) -> Lev:
         polygons=polygons,
         polygons_coords=polygons_coords,
         objects=objects_df,
+        sha256=sha256.hexdigest(),
+        raw_header=bytes(lev_header),
+        trailer=bytes(
+            lev_body[objects_start + LEV_OBJECT_DTYPE.itemsize * n_objects :]
+        ),
+    )
+
+
+def empty_rec() -> Rec:
+    # No frames or events; with the columns and dtypes `load_rec` gives by default
+    _, derived_names = _resolve_frame_columns(None)
+    raw_columns = {name: np.empty(0, dtype) for name, dtype in REC_FRAME_COLUMNS}
+    return Rec(
+        checksum=0,
+        lev_name="",
+        frames=_build_frames(raw_columns, derived_names, None),
+        events=_build_events(np.empty(0, dtype=REC_EVENT_DTYPE)),
+    )
+
+
+def empty_lev() -> Lev:
+    # No polygons or objects; tables as `load_lev` gives them
+    empty = np.empty(0, dtype=np.float64)
+    polygons, polygons_coords = _build_polygons(
+        empty, empty, np.empty((0, 2), dtype=np.int64)
+    )
+    return Lev(
+        name="",
+        lgr="",
+        ground="",
+        sky="",
+        polygons=polygons,
+        polygons_coords=polygons_coords,
+        objects=_build_objects(np.empty(0, dtype=LEV_OBJECT_DTYPE)),
+    )
+
+
+def _raw_event_timestamps(rec: Rec, events: pl.DataFrame | None = None) -> np.ndarray:
+    # Inverse of the scaling in `load_rec`: the loaded raw value that scales
+    #  to each `timestamp`, so unedited events are written back bit-exact
+    #  however the events were filtered or reordered
+    timestamp = (rec.events if events is None else events)["timestamp"].to_numpy()
+    raw = timestamp / MAGIC_TIME_SCALER
+    if rec._raw_timestamps is not None and len(rec._raw_timestamps[0]):
+        scaled, loaded = rec._raw_timestamps
+        pos = np.minimum(np.searchsorted(scaled, timestamp), len(scaled) - 1)
+        raw = np.where(scaled[pos] == timestamp, loaded[pos], raw)
+    return raw
+
+
+def _rec_header(rec: Rec, number_of_frames: int) -> bytes:
+    # The loaded header, with the fields `Rec` holds patched in where changed
+    if rec.raw_header is None:
+        header = bytearray(
+            struct.pack("I I I I I 12s 4x", 0, REC_VERSION, 0, 0, 0, b"")
+        )
+    else:
+        header = bytearray(rec.raw_header)
+    struct.pack_into("I", header, 0, number_of_frames)
+    struct.pack_into("I", header, REC_CHECKSUM_OFFSET, rec.checksum)
+    name = slice(REC_LEV_NAME_OFFSET, REC_LEV_NAME_OFFSET + 12)
+    if decode_rec_lev_name(bytes(header[name])) != rec.lev_name:
+        encoded = rec.lev_name.encode("latin1")
+        if len(encoded) > 12:
+            raise ValueError(f"Level file name too long: {rec.lev_name!r}")
+        header[name] = encoded.ljust(12, b"\0")
+    return bytes(header)
+
+
+def dump_rec(rec: Rec) -> bytes:
+    # Inverse of `load_rec`; needs all raw frame columns (see REC_FRAME_COLUMNS).
+    #  A loaded, unmodified rec is reproduced byte for byte
+    missing = [name for name, _ in REC_FRAME_COLUMNS if name not in rec.frames.columns]
+    if missing:
+        raise ValueError(f"Frames lack raw columns needed to write a rec: {missing!r}")
+    number_of_frames = len(rec.frames)
+    frame_block = bytearray(REC_FRAME_SIZE * number_of_frames)
+    for name, column in frame_columns_from_block(frame_block, number_of_frames).items():
+        column[:] = rec.frames[name].to_numpy()
+
+    events = np.zeros(len(rec.events), dtype=REC_EVENT_DTYPE)
+    for name in REC_EVENT_DTYPE.names:
+        if name == "timestamp":
+            events[name] = _raw_event_timestamps(rec)
+        elif name in rec.events.columns:
+            events[name] = rec.events[name].to_numpy()
+    return b"".join(
+        [
+            _rec_header(rec, number_of_frames),
+            frame_block,
+            struct.pack("I", len(events)),
+            events.tobytes(),
+            rec.trailer,
+        ]
+    )
+
+
+def _lev_header(lev: Lev, num_polygons: int) -> bytes:
+    if lev.raw_header is None:
+        header = bytearray(
+            struct.pack(LEV_HEADER_FORMAT_STR, LEV_VERSION, 0, b"", b"", b"", b"", 0.0)
+        )
+    else:
+        header = bytearray(lev.raw_header)
+    for field, (offset, size) in LEV_HEADER_STR_FIELDS.items():
+        value = getattr(lev, field)
+        raw = bytes(header[offset : offset + size])
+        if raw.split(b"\0")[0].decode("latin-1") != value:
+            encoded = value.encode("latin-1")
+            if len(encoded) >= size:
+                raise ValueError(f"Lev {field} too long: {value!r}")
+            header[offset : offset + size] = encoded.ljust(size, b"\0")
+    (count,) = struct.unpack_from("<d", header, LEV_POLYGON_COUNT_OFFSET)
+    if round(count - LEV_ITEM_COUNT_SUBTRAHEND) != num_polygons:
+        struct.pack_into(
+            "<d",
+            header,
+            LEV_POLYGON_COUNT_OFFSET,
+            num_polygons + LEV_ITEM_COUNT_SUBTRAHEND,
+        )
+    return bytes(header)
+
+
+def dump_lev(lev: Lev) -> bytes:
+    # Inverse of `load_lev`. Polygons are written in `index` order, with the
+    #  vertices of `polygons_coords`; `n_vertices`/`area` are not read
+    polygons = lev.polygons.sort("index")
+    coords = lev.polygons_coords.sort("index", maintain_order=True)
+    poly_pos = np.searchsorted(polygons["index"].to_numpy(), coords["index"].to_numpy())
+    n_vertices = np.bincount(poly_pos, minlength=len(polygons))
+
+    # 8-byte slots, as in `load_lev`: one header slot, then 2 per vertex
+    slot_counts = 1 + 2 * n_vertices
+    header_slots = np.cumsum(slot_counts) - slot_counts
+    slots = np.empty(int(slot_counts.sum()), dtype=np.float64)
+    is_vertex = np.ones(len(slots), dtype=bool)
+    is_vertex[header_slots] = False
+    slots[is_vertex] = np.column_stack(
+        [coords["x"].to_numpy(), coords["y"].to_numpy() * -1.0]
+    ).ravel()
+    header_words = slots.view(np.uint32)
+    header_words[2 * header_slots] = polygons["is_grass"].to_numpy()
+    header_words[2 * header_slots + 1] = n_vertices
+
+    objects = np.zeros(len(lev.objects), dtype=LEV_OBJECT_DTYPE)
+    for name in LEV_OBJECT_DTYPE.names:
+        objects[name] = lev.objects[name].to_numpy()
+    objects["y"] *= -1.0
+    return b"".join(
+        [
+            _lev_header(lev, len(polygons)),
+            slots.tobytes(),
+            struct.pack("d", len(objects) + LEV_ITEM_COUNT_SUBTRAHEND),
+            objects.tobytes(),
+            lev.trailer,
+        ]
+    )
+
+
+def first_roundtrip_mismatch(
+    data: bytes, kind: typing.Literal["rec", "lev"]
+) -> int | None:
+    # Offset of the first byte that differs after load + dump, or None
+    loader, dumper = (load_rec, dump_rec) if kind == "rec" else (load_lev, dump_lev)
+    dumped = dumper(loader(BufferReader(data)))
+    if dumped == data:
+        return None
+    size = min(len(dumped), len(data))
+    diff = np.flatnonzero(
+        np.frombuffer(dumped, np.uint8, size) != np.frombuffer(data, np.uint8, size)
+    )
+    return int(diff[0]) if len(diff) else size
+
+
+def _shift_events(
+    rec: Rec, events: pl.DataFrame, seconds: float
+) -> tuple[pl.DataFrame, np.ndarray]:
+    # `events` of `rec` moved by `seconds`, in the file's raw time units so
+    #  `timestamp` stays what the shifted file would load as; also the raw values
+    raw = _raw_event_timestamps(rec, events) + seconds / MAGIC_TIME_SCALER
+    return events.with_columns(pl.Series("timestamp", raw * MAGIC_TIME_SCALER)), raw
+
+
+def _rebase_frames(frames: pl.DataFrame) -> pl.DataFrame:
+    if "t" not in frames.columns:
+        return frames
+    return frames.with_columns(_derived_frame_columns()["t"].alias("t"))
+
+
+def slice_rec(rec: Rec, start: int = 0, stop: int | None = None) -> Rec:
+    # Frames [start, stop) as their own rec: `t` restarts at 0, and only the
+    #  events in that time span are kept, moved by the same amount
+    start, stop, _ = slice(start, stop).indices(len(rec.frames))
+    stop = max(start, stop)
+    frames = _rebase_frames(rec.frames.slice(start, stop - start))
+    t_start = start / FRAME_RATE
+    in_span = pl.col("timestamp") >= t_start
+    if stop < len(rec.frames):
+        # The events of the last frame are kept past the end of a full rec
+        in_span &= pl.col("timestamp") < stop / FRAME_RATE
+    events, raw = _shift_events(rec, rec.events.filter(in_span), -t_start)
+    return Rec(
+        checksum=rec.checksum,
+        lev_name=rec.lev_name,
+        frames=frames,
+        events=events,
+        raw_header=rec.raw_header,
+        trailer=rec.trailer,
+        _raw_timestamps=_raw_timestamp_lookup(raw),
+    )
+
+
+def splice_recs(recs: typing.Sequence[Rec]) -> Rec:
+    # Parts of one run back to back: each part's frames and events follow
+    #  the previous part's last frame
+    if not recs:
+        raise ValueError("Nothing to splice")
+    first = recs[0]
+    for rec in recs[1:]:
+        if (rec.lev_name, rec.checksum) != (first.lev_name, first.checksum):
+            raise ValueError(
+                f"Can't splice recs of different levels: "
+                f"{first.lev_name!r} and {rec.lev_name!r}"
+            )
+    starts = np.cumsum([0] + [len(rec.frames) for rec in recs[:-1]])
+    events, raw = zip(
+        *(
+            _shift_events(rec, rec.events, start / FRAME_RATE)
+            for rec, start in zip(recs, starts)
+        )
+    )
+    return Rec(
+        checksum=first.checksum,
+        lev_name=first.lev_name,
+        frames=_rebase_frames(pl.concat([rec.frames for rec in recs])),
+        events=pl.concat(events),
+        raw_header=first.raw_header,
+        trailer=recs[-1].trailer,
+        _raw_timestamps=_raw_timestamp_lookup(np.concatenate(raw)),
+    )
+
+
+IDLE_PREFIX_COLUMNS = ("x", "y", "dir_and_throttle")
+
+
+def idle_prefix_length(frames: pl.DataFrame) -> int:
+    # Number of frames at the start before the bike moves or gas is applied;
+    #  needs IDLE_PREFIX_COLUMNS
+    missing = [name for name in IDLE_PREFIX_COLUMNS if name not in frames.columns]
+    if missing:
+        raise ValueError(f"Frames lack columns needed to find idle frames: {missing!r}")
+    active = (
+        (pl.col("x") != pl.col("x").first())
+        | (pl.col("y") != pl.col("y").first())
+        | ((pl.col("dir_and_throttle") & 0b1) == 0b1)
+    )
+    first_active = frames.select(active.arg_max()).item() if len(frames) else None
+    if first_active is None or not frames.select(active.any()).item():
+        return len(frames)
+    return first_active
+
+
+def trim_idle_prefix(rec: Rec) -> Rec:
+    return slice_rec(rec, idle_prefix_length(rec.frames))
+
+
+class LevCache:
+    # LRU of parsed levels keyed by (level ID, sha256 of the lev file), so a
+    #  re-uploaded level with the same ID is never served stale
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._levs: OrderedDict[tuple[typing.Hashable, str], Lev] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, lev_id: typing.Hashable, lev_data: bytes | memoryview) -> Lev:
+        key = (lev_id, hashlib.sha256(lev_data).hexdigest())
+        with self._lock:
+            lev = self._levs.get(key)
+            if lev is not None:
+                self._levs.move_to_end(key)
+                self.hits += 1
+                profiling.count("lev_cache_hit")
+                return lev
+            self.misses += 1
+            profiling.count("lev_cache_miss")
+        lev = load_lev(BufferReader(lev_data))
+        with self._lock:
+            self._levs[key] = lev
+            while len(self._levs) > self.maxsize:
+                self._levs.popitem(last=False)
+        return lev
+
+
+# Process-wide; each render worker process gets its own
+lev_cache = LevCache()
+
+
+def _source_name(source: Source) -> str:
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, "name", repr(source))
+
+
+def load_one(loader: typing.Callable[[typing.BinaryIO], T], source) -> LoadResult[T]:
+    # `loader` (e.g. `load_rec`) on a path or file-like object. Errors are
+    #  returned rather than raised, so that one bad file doesn't abort a batch
+    name = _source_name(source)
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                value = loader(f)
+        else:
+            value = loader(source)
+    except Exception as e:
+        logger.warning(f"Failed to load {name!r}: {e!r}")
+        return LoadResult(source=name, error=e)
+    return LoadResult(source=name, value=value)
+
+
+def _load_one_task(
+    loader: typing.Callable[[typing.BinaryIO], T], source
+) -> tuple[LoadResult[T], dict]:
+    # In a worker process: also hand back its profile stats to `merge`
+    return load_one(loader, source), profiling.drain()
+
+
+def load_many(
+    loader: typing.Callable[[typing.BinaryIO], T],
+    sources: typing.Sequence[Source],
+    workers: int | None,
+    executor: typing.Literal["process", "thread"],
+) -> list[LoadResult[T]]:
+    # `load_one` over `sources` in a pool; results are in input order. In a
+    #  process pool, `loader` must be picklable (module-level or a partial)
+    workers = workers or os.cpu_count() or 1
+    # Batch small files per task to amortise IPC overhead
+    chunksize = max(1, len(sources) // (workers * 4))
+    if workers == 1 or len(sources) <= 1:
+        results = [load_one(loader, source) for source in sources]
+    elif executor == "process":
+        # polars' thread pool deadlocks in forked children
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results = []
+            for result, stats in pool.map(
+                _load_one_task, [loader] * len(sources), sources, chunksize=chunksize
+            ):
+                profiling.merge(stats)
+                results.append(result)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(
+                    load_one, [loader] * len(sources), sources, chunksize=chunksize
+                )
+            )
+    n_failed = sum(not result.ok for result in results)
+    logger.info(f"Loaded {len(results) - n_failed}/{len(results)} files")
+    return results
+
+
+def load_recs_many(
+    sources: typing.Sequence[Source],
+    workers: int | None = None,
+    executor: typing.Literal["process", "thread"] = "process",
+    compact: bool = False,
+) -> list[LoadResult[Rec]]:
+    # Paths or file-like objects; results are in input order.
+    #  File objects can't cross process boundaries: use paths, BytesIO or threads
+    loader = functools.partial(load_rec, compact=True) if compact else load_rec
+    return load_many(loader, sources, workers, executor)
+
+
+def load_levs_many(
+    sources: typing.Sequence[Source],
+    workers: int | None = None,
+    executor: typing.Literal["process", "thread"] = "process",
+) -> list[LoadResult[Lev]]:
+    return load_many(load_lev, sources, workers, executor)
+
+
+def _concat_rec_tables(
+    results: typing.Sequence[LoadResult[Rec]], table: str
+) -> pl.DataFrame:
+    tables = [
+        (getattr(result.value, table), rec_id)
+        for rec_id, result in enumerate(results)
+        if result.ok
+    ] or [(getattr(empty_rec(), table), 0)]
+    return pl.concat(
+        [
+            table_df.with_columns(pl.lit(rec_id, pl.UInt32).alias("rec_id"))
+            for table_df, rec_id in tables
+        ]
     )
+
+
+def concat_rec_frames(results: typing.Sequence[LoadResult[Rec]]) -> pl.DataFrame:
+    # All successfully loaded frames, tagged with `rec_id` = position in `results`
+    return _concat_rec_tables(results, "frames")
+
+
+def concat_rec_events(results: typing.Sequence[LoadResult[Rec]]) -> pl.DataFrame:
+    # Same for events; `rec_id` matches `concat_rec_frames`
+    return _concat_rec_tables(results, "events")
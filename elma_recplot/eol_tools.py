@@ -1,39 +1,143 @@
-from io import BytesIO
+import itertools
+import logging
+import os
+import shutil
+import threading
+import time
+import typing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+import polars as pl
 import requests
-from cachecontrol import CacheControl
-from cachecontrol.caches import SeparateBodyFileCache
-from cachecontrol.heuristics import ExpiresAfter
-
-# Cache response content for files; valid rec/lev files but obfuscated names...
-sess = CacheControl(
-    requests.Session(),
-    cache=SeparateBodyFileCache(".eol_cache"),
-    heuristic=ExpiresAfter(days=30),
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from elma_recplot import profiling
+from elma_recplot.blob_store import BlobStore
+from elma_recplot.defaults import DEFAULT_BLOB_STORE_DIR, POOL_MAXSIZE
+from elma_recplot.elma_loader import BufferReader
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.elma.online"
+SPACE_URL = "https://space.elma.online"
+
+
+class RateLimiter:
+    # At most `per_second` calls to `wait` return per second, across threads
+    def __init__(self, per_second: float):
+        self.interval = 1 / per_second if per_second > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class _LimitedRetry(Retry):
+    # Also waits for `limiter` before each retry, so retries count against
+    #  the rate limit like first attempts
+    limiter: RateLimiter | None = None
+
+    def new(self, **kw) -> "_LimitedRetry":
+        retry = super().new(**kw)
+        retry.limiter = self.limiter
+        return retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.limiter is not None:
+            self.limiter.wait()
+
+
+# Backoff on rate limiting / server errors; Retry-After is honoured
+RETRY = _LimitedRetry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    raise_on_status=False,
 )
 
+# Downloaded files are kept this long before being fetched again
+MAX_AGE_DAYS = 30
+
+
+def make_api_session(limiter: RateLimiter | None = None) -> requests.Session:
+    # Pooled keep-alive session with retries, paced by `limiter` if given
+    retry = RETRY.new()
+    retry.limiter = limiter
+    api_sess = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    api_sess.mount("http://", adapter)
+    api_sess.mount("https://", adapter)
+    return api_sess
+
+
+api_sess = make_api_session()
+# Rec/lev files; valid rec/lev files but obfuscated names...
+blob_store = BlobStore(DEFAULT_BLOB_STORE_DIR)
+
+
+def _fetch_blob(kind: str, key: str | int, name: str, url: str, pin: bool) -> str:
+    sha256 = blob_store.lookup(kind, key, name, max_age_days=MAX_AGE_DAYS, pin=pin)
+    if sha256 is None:
+        with profiling.timer(f"fetch_{kind}"):
+            response = api_sess.get(url)
+            response.raise_for_status()
+        profiling.count(f"fetch_{kind}_bytes", len(response.content))
+        sha256 = blob_store.put(kind, key, name, response.content, pin=pin)
+    else:
+        profiling.count("blob_store_hit")
+    return sha256
+
 
-def get_lev_by_id(lev_id: int) -> BytesIO:
-    response = sess.get(
-        "https://api.elma.online/dl/level/{lev_id}".format(lev_id=lev_id)
+# fetch_*: download if needed -> sha256 of the file, see `blob_store.read`.
+#  With `pin`, the file is kept from eviction until `blob_store.unpin`
+def fetch_lev_by_id(lev_id: int, pin: bool = False) -> str:
+    return _fetch_blob(
+        "lev",
+        lev_id,
+        "",
+        "{url}/dl/level/{lev_id}".format(url=API_URL, lev_id=lev_id),
+        pin,
     )
-    response.raise_for_status()
-    return BytesIO(response.content)
 
 
-def get_rec_by_id_and_name(rec_id: str, rec_name: str) -> BytesIO:
-    response = sess.get(
-        "https://space.elma.online/replays/{rec_id}/{rec_name}".format(
-            rec_id=rec_id, rec_name=rec_name
-        )
+def fetch_rec_by_id_and_name(rec_id: str, rec_name: str, pin: bool = False) -> str:
+    return _fetch_blob(
+        "rec",
+        rec_id,
+        rec_name,
+        "{url}/replays/{rec_id}/{rec_name}".format(
+            url=SPACE_URL, rec_id=rec_id, rec_name=rec_name
+        ),
+        pin,
     )
-    response.raise_for_status()
-    return BytesIO(response.content)
 
 
-def get_latest_replays(page=0, num=20) -> dict:
-    response = requests.get(
-        "https://api.elma.online/api/replay",
+# get_*: the stored file, read from the blob store
+def get_lev_by_id(lev_id: int) -> BufferReader:
+    return BufferReader(blob_store.read(fetch_lev_by_id(lev_id)), name=f"{lev_id}.lev")
+
+
+def get_rec_by_id_and_name(rec_id: str, rec_name: str) -> BufferReader:
+    return BufferReader(
+        blob_store.read(fetch_rec_by_id_and_name(rec_id, rec_name)), name=rec_name
+    )
+
+
+@profiling.timed("fetch_replays")
+def get_latest_replays(
+    page=0, num=20, session: requests.Session | None = None, base_url: str = API_URL
+) -> dict:
+    response = (session or api_sess).get(
+        f"{base_url}/api/replay",
         params={
             "page": page,
             "pageSize": num,
@@ -44,3 +148,87 @@ def get_latest_replays(page=0, num=20) -> dict:
     )
     response.raise_for_status()
     return response.json()
+
+
+def crawl_replays(
+    pages: typing.Iterable[int],
+    page_size: int = 100,
+    workers: int = 8,
+    requests_per_second: float = 5.0,
+    base_url: str = API_URL,
+) -> typing.Iterator[pl.DataFrame]:
+    # Replay metadata pages fetched concurrently, yielded in page order.
+    #  Stops at the first empty page. Retries share the rate limit
+    limiter = RateLimiter(requests_per_second)
+    session = make_api_session(limiter)
+
+    def _fetch(page: int) -> pl.DataFrame:
+        limiter.wait()
+        replays = get_latest_replays(
+            page=page, num=page_size, session=session, base_url=base_url
+        )
+        logger.debug(f"Fetched replay page {page}: {len(replays)} replays")
+        if not replays:
+            return pl.DataFrame()
+        return pl.json_normalize(replays).with_columns(pl.lit(page).alias("page"))
+
+    # Bounded look-ahead, so few requests are wasted past the last page
+    pages = iter(pages)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque(
+            pool.submit(_fetch, page) for page in itertools.islice(pages, workers)
+        )
+        try:
+            while in_flight:
+                df = in_flight.popleft().result()
+                if df.is_empty():
+                    break
+                for page in itertools.islice(pages, 1):
+                    in_flight.append(pool.submit(_fetch, page))
+                yield df
+        finally:
+            # Also on early exit by the consumer
+            pool.shutdown(cancel_futures=True)
+
+
+def crawl_replays_to_parquet(
+    pages: typing.Iterable[int], outfile: str, **kwargs
+) -> int:
+    # `crawl_replays` into one parquet file; columns missing on a page are
+    #  null. Each page is written out as it arrives, then the parts are
+    #  streamed into `outfile`. If the crawl fails the parts are kept, and
+    #  a rerun for the same `outfile` skips the leading pages it already
+    #  has. -> number of replays
+    head, tail = os.path.split(outfile)
+    parts_dir = os.path.join(head, f".{tail}.parts")
+    os.makedirs(parts_dir, exist_ok=True)
+
+    def part_path(page: int) -> str:
+        return os.path.join(parts_dir, f"page-{page:06d}.parquet")
+
+    parts = []
+    pages = iter(pages)
+    for page in pages:
+        if not os.path.exists(part_path(page)):
+            pages = itertools.chain([page], pages)
+            break
+        parts.append(part_path(page))
+    if parts:
+        logger.info(f"Resuming crawl after {len(parts)} pages in {parts_dir!r}")
+    for df in crawl_replays(pages, **kwargs):
+        parts.append(part_path(df["page"][0]))
+        # Renamed into place, so a part that exists is complete
+        df.write_parquet(parts[-1] + ".tmp")
+        os.replace(parts[-1] + ".tmp", parts[-1])
+
+    tmp_path = os.path.join(parts_dir, "replays.parquet")
+    if parts:
+        pl.concat(
+            [pl.scan_parquet(part) for part in parts], how="diagonal_relaxed"
+        ).sink_parquet(tmp_path)
+    else:
+        pl.DataFrame().write_parquet(tmp_path)
+    n_replays = pl.scan_parquet(tmp_path).select(pl.len()).collect().item()
+    os.replace(tmp_path, outfile)
+    shutil.rmtree(parts_dir)
+    return n_replays
@@ -0,0 +1,209 @@
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import typing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import numpy as np
+import polars as pl
+
+from elma_recplot import profiling
+from elma_recplot.defaults import DEFAULT_HEATMAP_CELL_SIZE, HEATMAP_LAYERS
+from elma_recplot.elma_loader import (
+    EventType,
+    Lev,
+    Rec,
+    Source,
+    load_one,
+    load_rec,
+)
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on bins per layer; the cell size grows for huge levels instead
+MAX_BINS = 1 << 20
+# Room around the level polygons, in world units
+BOUNDS_MARGIN = 2.0
+# Frames with a collision at least this strong count as crash locations
+MIN_CRASH_STRENGTH = 1
+HEATMAP_FRAME_COLUMNS = (
+    "x",
+    "y",
+    "t",
+    "l_wheel_x",
+    "l_wheel_y",
+    "r_wheel_x",
+    "r_wheel_y",
+    "head_x",
+    "head_y",
+    "is_gasing",
+    "collision_strength",
+)
+VOLT_EVENT_TYPES = (EventType.VOLT_LEFT.value, EventType.VOLT_RIGHT.value)
+
+
+def _layer_points(rec: Rec) -> dict[str, list[tuple[np.ndarray, np.ndarray]]]:
+    # -> per layer, the (x, y) arrays to count
+    frames = rec.frames
+
+    def xy(df: pl.DataFrame, x: str = "x", y: str = "y"):
+        return df[x].to_numpy(), df[y].to_numpy()
+
+    volt_times = rec.events.filter(pl.col("event_type").is_in(VOLT_EVENT_TYPES))[
+        "timestamp"
+    ]
+    # Events past the last frame are counted at the last frame
+    volt_frames = (
+        frames["t"].search_sorted(volt_times).clip(upper_bound=len(frames) - 1)
+        if len(frames)
+        else []
+    )
+    return {
+        "position": [xy(frames)],
+        "wheels": [
+            xy(frames, "l_wheel_x", "l_wheel_y"),
+            xy(frames, "r_wheel_x", "r_wheel_y"),
+        ],
+        "head": [xy(frames, "head_x", "head_y")],
+        "gas": [xy(frames.filter(pl.col("is_gasing")))],
+        "volt": [xy(frames[volt_frames])],
+        "crash": [
+            xy(frames.filter(pl.col("collision_strength") >= MIN_CRASH_STRENGTH))
+        ],
+    }
+
+
+@dataclass
+class Heatmap:
+    # Fixed-size 2D histograms of one level, one per HEATMAP_LAYERS entry.
+    #  Memory depends only on the bin counts, never on the number of recs;
+    #  partial heatmaps over the same bins add up with `merge`
+    x_edges: np.ndarray
+    y_edges: np.ndarray
+    counts: dict[str, np.ndarray] = field(default_factory=dict)  # (n_x, n_y)
+    n_recs: int = 0
+
+    def __post_init__(self):
+        shape = (len(self.x_edges) - 1, len(self.y_edges) - 1)
+        for layer in HEATMAP_LAYERS:
+            self.counts.setdefault(layer, np.zeros(shape, dtype=np.int64))
+
+    @classmethod
+    def for_lev(
+        cls, lev: Lev, cell_size: float = DEFAULT_HEATMAP_CELL_SIZE
+    ) -> "Heatmap":
+        coords = lev.polygons_coords
+        x_min, x_max = coords["x"].min(), coords["x"].max()
+        y_min, y_max = coords["y"].min(), coords["y"].max()
+        if x_min is None:
+            x_min = x_max = y_min = y_max = 0.0
+        x_min, y_min = x_min - BOUNDS_MARGIN, y_min - BOUNDS_MARGIN
+        x_max, y_max = x_max + BOUNDS_MARGIN, y_max + BOUNDS_MARGIN
+        area = (x_max - x_min) * (y_max - y_min)
+        cell_size = max(cell_size, np.sqrt(area / MAX_BINS))
+        return cls(
+            x_edges=np.arange(x_min, x_max + cell_size, cell_size),
+            y_edges=np.arange(y_min, y_max + cell_size, cell_size),
+        )
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.x_edges) - 1, len(self.y_edges) - 1
+
+    def empty_like(self) -> "Heatmap":
+        return Heatmap(x_edges=self.x_edges, y_edges=self.y_edges)
+
+    def _add_points(self, layer: str, x: np.ndarray, y: np.ndarray):
+        # Uniform bins: index arithmetic instead of np.histogram2d, counted
+        #  in place so nothing of the full bin grid size is allocated
+        n_x, n_y = self.shape
+        cell_x = self.x_edges[1] - self.x_edges[0]
+        cell_y = self.y_edges[1] - self.y_edges[0]
+        ix = np.floor((x - self.x_edges[0]) / cell_x).astype(np.int64)
+        iy = np.floor((y - self.y_edges[0]) / cell_y).astype(np.int64)
+        inside = (ix >= 0) & (ix < n_x) & (iy >= 0) & (iy < n_y)
+        np.add.at(self.counts[layer].reshape(-1), ix[inside] * n_y + iy[inside], 1)
+
+    def add(self, rec: Rec) -> "Heatmap":
+        # Needs the HEATMAP_FRAME_COLUMNS of `rec.frames`
+        for layer, points in _layer_points(rec).items():
+            for x, y in points:
+                self._add_points(layer, x, y)
+        self.n_recs += 1
+        return self
+
+    def update(self, recs: typing.Iterable[Rec]) -> "Heatmap":
+        # Streams `recs`: each is dropped as soon as it has been counted
+        for rec in recs:
+            self.add(rec)
+        return self
+
+    def merge(self, other: "Heatmap") -> "Heatmap":
+        if not (
+            np.array_equal(self.x_edges, other.x_edges)
+            and np.array_equal(self.y_edges, other.y_edges)
+        ):
+            raise ValueError("Can only merge heatmaps with the same bins")
+        for layer in HEATMAP_LAYERS:
+            self.counts[layer] += other.counts[layer]
+        self.n_recs += other.n_recs
+        return self
+
+
+def _heatmap_of_files(
+    x_edges: np.ndarray, y_edges: np.ndarray, sources: typing.Sequence[Source]
+) -> Heatmap:
+    # Runs in the worker: one partial heatmap per batch, one rec in memory.
+    #  Only the bin edges are sent over; the zero counts are made here
+    heatmap = Heatmap(x_edges=x_edges, y_edges=y_edges)
+    loader = functools.partial(load_rec, columns=HEATMAP_FRAME_COLUMNS)
+    for source in sources:
+        result = load_one(loader, source)
+        if result.ok:
+            heatmap.add(result.value)
+    return heatmap
+
+
+def _heatmap_task(*args) -> tuple[Heatmap, dict]:
+    # In a worker process: also hand back its profile stats to `merge`
+    return _heatmap_of_files(*args), profiling.drain()
+
+
+def heatmap_many(
+    heatmap: Heatmap,
+    sources: typing.Sequence[Source],
+    workers: int | None = None,
+    batch_size: int = 64,
+) -> Heatmap:
+    # Adds the recs at `sources` (paths or BytesIO) into `heatmap`, in place.
+    #  At most `workers` batches are in flight: the next one is submitted when
+    #  one finishes, whose partial heatmap is merged and dropped right away
+    workers = workers or os.cpu_count() or 1
+    edges = heatmap.x_edges, heatmap.y_edges
+    batches = [sources[i : i + batch_size] for i in range(0, len(sources), batch_size)]
+    if workers == 1 or len(batches) <= 1:
+        for batch in batches:
+            heatmap.merge(_heatmap_of_files(*edges, batch))
+    else:
+        # polars' thread pool deadlocks in forked children
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            pending = iter(batches)
+            in_flight = {
+                pool.submit(_heatmap_task, *edges, batch)
+                for batch in itertools.islice(pending, workers)
+            }
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for batch in itertools.islice(pending, len(done)):
+                    in_flight.add(pool.submit(_heatmap_task, *edges, batch))
+                while done:
+                    partial, stats = done.pop().result()
+                    heatmap.merge(partial)
+                    profiling.merge(stats)
+    logger.info(f"Heatmap of {heatmap.n_recs}/{len(sources)} recs")
+    return heatmap
@@ -0,0 +1,127 @@
+import glob
+import logging
+import os
+import tempfile
+import time
+
+import plotly.graph_objects as go
+import polars as pl
+from plotly.io.json import to_json_plotly
+
+from elma_recplot import profiling
+from elma_recplot.defaults import DEFAULT_LAYER_CACHE_DIR
+from elma_recplot.elma_loader import Lev
+from elma_recplot.plot import (
+    LAYER_VERSION,
+    LayerJson,
+    add_lev_to_fig,
+    compact_figure,
+    set_layer_json,
+)
+
+logger = logging.getLogger(__name__)
+
+# One JSON list per line, in LayerJson field order
+LAYER_FILE_SUFFIX = ".jsonl"
+
+
+def _render_layer(lev: Lev) -> LayerJson:
+    fig = go.Figure()
+    add_lev_to_fig(lev, fig)
+    layer = fig.to_plotly_json()
+    data = to_json_plotly(layer["data"])
+    shapes = to_json_plotly(layer["layout"].get("shapes", []))
+    compact_data = to_json_plotly(compact_figure(fig).to_plotly_json()["data"])
+    return LayerJson(data=data, compact_data=compact_data, shapes=shapes)
+
+
+class LevLayerCache:
+    # Serialized `add_lev_to_fig` output (traces + shapes) on disk, keyed by
+    #  the lev file's sha256 under a directory per LAYER_VERSION:
+    #  <cache_dir>/v<LAYER_VERSION>/<sha256>.jsonl
+    #  Pages get the JSON spliced in as is (see `write_figures_html`)
+    def __init__(self, cache_dir: str = DEFAULT_LAYER_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, lev_sha256: str) -> str:
+        return os.path.join(
+            self.cache_dir, f"v{LAYER_VERSION}", lev_sha256 + LAYER_FILE_SUFFIX
+        )
+
+    def get(self, lev_sha256: str) -> LayerJson | None:
+        path = self._path(lev_sha256)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data, compact_data, shapes = f.read().splitlines()
+        except FileNotFoundError:
+            return None
+        # Last use, for `prune --max-age-days`
+        os.utime(path)
+        return LayerJson(data=data, compact_data=compact_data, shapes=shapes)
+
+    def put(self, lev_sha256: str, layer: LayerJson):
+        path = self._path(lev_sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Atomic, as render workers may write the same level concurrently
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            # Compact JSON has no raw newlines
+            f.write(f"{layer.data}\n{layer.compact_data}\n{layer.shapes}\n")
+        os.replace(tmp_path, path)
+
+    def add_lev_to_fig(self, lev: Lev, fig: go.Figure):
+        if lev.sha256 is None:
+            add_lev_to_fig(lev, fig)
+            return
+        layer = self.get(lev.sha256)
+        if layer is None:
+            logger.info(f"Rendering level layer {lev.sha256[:12]}")
+            profiling.count("layer_cache_miss")
+            layer = _render_layer(lev)
+            self.put(lev.sha256, layer)
+        else:
+            logger.info(f"Using cached level layer {lev.sha256[:12]}")
+            profiling.count("layer_cache_hit")
+        set_layer_json(fig, layer)
+
+    def stats(self) -> pl.DataFrame:
+        rows = []
+        pattern = os.path.join(self.cache_dir, "v*", "*" + LAYER_FILE_SUFFIX)
+        for path in glob.glob(pattern):
+            stat = os.stat(path)
+            rows.append(
+                {
+                    "version": os.path.basename(os.path.dirname(path)),
+                    "sha256": os.path.basename(path).removesuffix(LAYER_FILE_SUFFIX),
+                    "bytes": stat.st_size,
+                    "last_used": stat.st_mtime,
+                }
+            )
+        return pl.DataFrame(
+            rows,
+            schema={
+                "version": pl.String,
+                "sha256": pl.String,
+                "bytes": pl.Int64,
+                "last_used": pl.Float64,
+            },
+        ).with_columns(pl.from_epoch("last_used", time_unit="s"))
+
+    def prune(self, max_age_days: float | None = None) -> int:
+        # Drop layers of other layer versions or file formats, and unused ones
+        #  if max_age_days
+        current = os.path.join(self.cache_dir, f"v{LAYER_VERSION}")
+        cutoff = None if max_age_days is None else time.time() - max_age_days * 86400
+        n_removed = 0
+        for path in glob.glob(os.path.join(self.cache_dir, "v*", "*")):
+            # Layers cached as one JSON object, before LAYER_FILE_SUFFIX
+            old_format = path.endswith(".json")
+            stale = os.path.dirname(path) != current or old_format
+            if stale or (cutoff is not None and os.path.getmtime(path) < cutoff):
+                os.remove(path)
+                n_removed += 1
+        for version_dir in glob.glob(os.path.join(self.cache_dir, "v*")):
+            if version_dir != current and not os.listdir(version_dir):
+                os.rmdir(version_dir)
+        logger.info(f"Removed {n_removed} cached level layers")
+        return n_removed
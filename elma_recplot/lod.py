@@ -0,0 +1,173 @@
+import logging
+
+import numpy as np
+import polars as pl
+
+from elma_recplot.defaults import LOD_METHODS
+
+logger = logging.getLogger(__name__)
+
+# Drawn trajectories; simplified together so all traces share the same frames
+TRAJECTORIES = (
+    ("x", "y"),
+    ("head_x", "head_y"),
+    ("l_wheel_x", "l_wheel_y"),
+    ("r_wheel_x", "r_wheel_y"),
+)
+GAS_COLUMNS = ("is_gasing_left", "is_gasing_right")
+TOLERANCE_SEARCH_STEPS = 20
+
+
+def _lttb_mask(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    # Largest-triangle-three-buckets over frame order, with areas in x/y space
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n_out >= n or n < 3:
+        keep[:] = True
+        return keep
+    keep[[0, -1]] = True
+    if n_out < 3:
+        return keep
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if hi <= lo:
+            continue
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        keep[a] = True
+    return keep
+
+
+def _rdp_mask(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    # Ramer-Douglas-Peucker; explicit stack, distances vectorized per segment
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1 : end] - x[start], y[start + 1 : end] - y[start]
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(dx * py - dy * px) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return keep
+
+
+def _grid_mask(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    # Keep a frame whenever it enters a new `tolerance`-sized grid cell. The
+    #  grid starts at the path's corner, so a tolerance beyond its extent
+    #  keeps just the endpoints
+    keep = np.ones(len(x), dtype=bool)
+    if len(x) < 3 or tolerance <= 0:
+        return keep
+    cell_x = np.floor((x - x.min()) / tolerance)
+    cell_y = np.floor((y - y.min()) / tolerance)
+    keep[1:-1] = (cell_x[1:-1] != cell_x[:-2]) | (cell_y[1:-1] != cell_y[:-2])
+    return keep
+
+
+_TOLERANCE_MASKS = {"rdp": _rdp_mask, "grid": _grid_mask}
+
+
+def simplify(
+    x: np.ndarray,
+    y: np.ndarray,
+    method: str = "lttb",
+    max_points: int | None = None,
+    tolerance: float | None = None,
+) -> np.ndarray:
+    # -> boolean mask of points to keep.
+    #  lttb needs `max_points`; rdp/grid take a world-unit `tolerance`, or search
+    #  for the smallest tolerance that fits in `max_points`
+    if method not in LOD_METHODS:
+        raise ValueError(
+            f"Unknown LOD method {method!r}; expected one of {LOD_METHODS}"
+        )
+    if method == "lttb":
+        if max_points is None:
+            raise ValueError("lttb needs max_points")
+        return _lttb_mask(x, y, max_points)
+    mask_fn = _TOLERANCE_MASKS[method]
+    if tolerance is not None:
+        return mask_fn(x, y, tolerance)
+    if max_points is None:
+        raise ValueError(f"{method} needs max_points or tolerance")
+    if len(x) <= max_points:
+        return np.ones(len(x), dtype=bool)
+    # Above the path's extent both methods keep only the endpoints
+    lo, hi = 0.0, 2 * float(np.hypot(np.ptp(x), np.ptp(y))) or 1.0
+    keep = mask_fn(x, y, hi)
+    for _ in range(TOLERANCE_SEARCH_STEPS):
+        mid = (lo + hi) / 2
+        mid_keep = mask_fn(x, y, mid)
+        if mid_keep.sum() <= max_points:
+            hi, keep = mid, mid_keep
+        else:
+            lo = mid
+    return keep
+
+
+def downsample_frames(
+    frames: pl.DataFrame,
+    max_points: int | None = None,
+    method: str = "lttb",
+    tolerance: float | None = None,
+) -> pl.DataFrame:
+    # Subset of `frames` to draw: union of the simplified kuski/head/wheel paths,
+    #  plus both sides of every gas on/off switch so gas overlays stay aligned
+    gas_edges = pl.any_horizontal(
+        (pl.col(c) != pl.col(c).shift(1)) | (pl.col(c) != pl.col(c).shift(-1))
+        for c in GAS_COLUMNS
+    ).fill_null(True)
+    keep = frames.select(gas_edges).to_series().to_numpy().copy()
+    per_trajectory = None
+    if max_points is not None:
+        # Gas edges get what the trajectories' endpoints leave; beyond that,
+        #  evenly spaced edges are kept and the rest of the switches drawn off
+        edges = np.flatnonzero(keep)
+        edge_budget = max(max_points - 2 * len(TRAJECTORIES), 2)
+        if len(edges) > edge_budget:
+            logger.warning(
+                f"LOD: {len(edges)} gas switch frames exceed the budget of "
+                f"{max_points}; keeping {edge_budget}"
+            )
+            thinned = np.linspace(0, len(edges) - 1, edge_budget).astype(np.int64)
+            keep[:] = False
+            keep[edges[thinned]] = True
+        # Budget left after the gas edges, shared between the trajectories
+        per_trajectory = max((max_points - int(keep.sum())) // len(TRAJECTORIES), 2)
+    for x_col, y_col in TRAJECTORIES:
+        keep |= simplify(
+            frames[x_col].to_numpy(),
+            frames[y_col].to_numpy(),
+            method=method,
+            max_points=per_trajectory,
+            tolerance=tolerance,
+        )
+    n_kept = int(keep.sum())
+    if max_points is not None and n_kept > max_points:
+        # Budgets below the 2 points every trajectory keeps, or a fixed tolerance
+        logger.warning(f"LOD: {n_kept} frames kept, over the budget of {max_points}")
+    logger.info(f"LOD ({method}): {len(frames)} -> {n_kept} frames")
+    return frames.filter(pl.Series(keep))
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+
+import polars as pl
+
+from elma_recplot.plot import LAYER_VERSION, PAGE_VERSION
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.jsonl"
+# API replay fields kept per entry; enough to re-render without the API
+ROW_SCHEMA = {
+    "UUID": pl.String,
+    "RecFileName": pl.String,
+    "LevelIndex": pl.Int64,
+    "Uploaded": pl.Int64,
+    "ReplayTime": pl.Int64,
+    "DrivenByData.Kuski": pl.String,
+    "LevelData.LevelName": pl.String,
+    "rec_base": pl.String,
+}
+ROW_FIELDS = tuple(ROW_SCHEMA)
+# Wait before retrying a failed replay; doubles with each failed attempt
+RETRY_BACKOFF_S = 15 * 60
+RETRY_BACKOFF_MAX_S = 7 * 24 * 3600
+
+
+class Manifest:
+    # Rendered replays, as append-only JSON lines in the rec dir; the last line
+    #  per replay UUID wins. Entry keys: uuid, row, outfile, lev_sha256,
+    #  rec_sha256, page_version, layer_version, rendered_at, error (None, or why
+    #  the last attempt failed), attempts (failed attempts in a row) and
+    #  retry_at (epoch seconds before which a failed replay isn't retried)
+    def __init__(self, rec_dir: str):
+        self.path = os.path.join(rec_dir, MANIFEST_FILE)
+        self.entries: dict[str, dict] = {}
+        self._n_lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["uuid"]] = entry
+                        self._n_lines += 1
+        logger.info(f"Manifest {self.path!r}: {len(self.entries)} replays")
+
+    def __contains__(self, uuid: str) -> bool:
+        return uuid in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _is_rendered(entry: dict) -> bool:
+        # Its file exists and was rendered by this version
+        return (
+            entry.get("error") is None
+            and entry.get("page_version") == PAGE_VERSION
+            and entry.get("layer_version") == LAYER_VERSION
+            and os.path.exists(entry["outfile"])
+        )
+
+    @staticmethod
+    def _is_due(entry: dict, now: float) -> bool:
+        # Not rendered, and not a failure still backing off
+        if entry.get("error") is None:
+            return True
+        return (entry.get("retry_at") or 0) <= now
+
+    def needs_render(self, row: dict) -> bool:
+        # By replay UUID, so known replays aren't downloaded again: new, due for
+        #  a retry, rendered by an older version, or listed with changed fields
+        entry = self.entries.get(row["UUID"])
+        if entry is None:
+            return True
+        if self._is_rendered(entry):
+            return entry["row"] != {field: row[field] for field in ROW_FIELDS}
+        return self._is_due(entry, time.time())
+
+    def outdated(self) -> list[dict]:
+        # Failed and due for a retry, or rendered by an older version
+        now = time.time()
+        return [
+            e
+            for e in self.entries.values()
+            if not self._is_rendered(e) and self._is_due(e, now)
+        ]
+
+    def rendered(self) -> list[dict]:
+        return [e for e in self.entries.values() if self._is_rendered(e)]
+
+    def record(
+        self,
+        row: dict,
+        outfile: str,
+        lev_sha256: str | None,
+        rec_sha256: str | None,
+        error: str | None = None,
+    ):
+        now = time.time()
+        attempts, retry_at = 0, None
+        if error is not None:
+            previous = self.entries.get(row["UUID"], {})
+            attempts = 1
+            if previous.get("error") is not None:
+                # Entries from before attempts were counted had at least one
+                attempts += previous.get("attempts") or 1
+            backoff = RETRY_BACKOFF_S * 2 ** (attempts - 1)
+            retry_at = now + min(backoff, RETRY_BACKOFF_MAX_S)
+        entry = {
+            "uuid": row["UUID"],
+            "row": {field: row[field] for field in ROW_FIELDS},
+            "outfile": outfile,
+            "lev_sha256": lev_sha256,
+            "rec_sha256": rec_sha256,
+            "page_version": PAGE_VERSION,
+            "layer_version": LAYER_VERSION,
+            "rendered_at": now,
+            "error": error,
+            "attempts": attempts,
+            "retry_at": retry_at,
+        }
+        self.entries[entry["uuid"]] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        self._n_lines += 1
+
+    def compact(self):
+        # Drop superseded lines once they outnumber the live entries
+        if self._n_lines <= 2 * len(self.entries):
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+        self._n_lines = len(self.entries)
@@ -1,62 +1,268 @@
 import logging
+import multiprocessing
 import os
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 
-import plotly.io as pio
 import polars as pl
-from rich.progress import track
+from rich.progress import Progress
 
-from elma_recplot.elma_loader import load_lev, load_rec
+from elma_recplot import profiling
+from elma_recplot.blob_store import BlobStore
+from elma_recplot.defaults import DEFAULT_LAYER_CACHE_DIR, POOL_MAXSIZE
+from elma_recplot.elma_loader import BufferReader, lev_cache, load_rec
 from elma_recplot.eol_tools import (
+    blob_store,
+    fetch_lev_by_id,
+    fetch_rec_by_id_and_name,
     get_latest_replays,
-    get_lev_by_id,
-    get_rec_by_id_and_name,
 )
-from elma_recplot.plot import draw_event_timeline, draw_rec
+from elma_recplot.layer_cache import LevLayerCache
+from elma_recplot.manifest import ROW_FIELDS, ROW_SCHEMA, Manifest
+from elma_recplot.plot import draw_event_timeline, draw_rec, write_figures_html
+from elma_recplot.util import init_logging
 
 logger = logging.getLogger(__name__)
 
 
-def make_recent_replay_page(index_page="index.md", rec_dir=".", num: int = 20):
+# Network bound; run in the download thread pool. Only the sha256 of the
+#  stored file is handed on, render workers map the file themselves. Pinned,
+#  so later downloads can't evict it from the blob store before it's read
+def _fetch_lev(lev_id: int) -> str:
+    return fetch_lev_by_id(lev_id, pin=True)
+
+
+def _fetch_rec(row: dict) -> str:
+    return fetch_rec_by_id_and_name(row["UUID"], row["RecFileName"], pin=True)
+
+
+def _render_replay(
+    row: dict,
+    lev_sha256: str,
+    rec_sha256: str,
+    store_dir: str,
+    outfile: str,
+    max_points: int | None,
+    lod_method: str,
+    lod_tolerance: float | None,
+    compact: bool,
+    layer_cache_dir: str | None,
+) -> dict:
+    # CPU bound; runs in the render process pool and writes its own output.
+    #  Returns source hashes and whether the parsed lev came from the cache
+    store = BlobStore(store_dir)
+    hits = lev_cache.hits
+    lev = lev_cache.load(row["LevelIndex"], store.read(lev_sha256))
+    rec = load_rec(BufferReader(store.read(rec_sha256)))
+    fig_map = draw_rec(
+        rec,
+        lev,
+        max_points=max_points,
+        lod_method=lod_method,
+        layer_cache=LevLayerCache(layer_cache_dir) if layer_cache_dir else None,
+        lod_tolerance=lod_tolerance,
+    )
+    title = "{lev} - {kuski} ({time:.2f}s)".format(
+        kuski=row["DrivenByData.Kuski"],
+        lev=row["LevelData.LevelName"],
+        time=row["ReplayTime"] / 1000,
+    )
+    fig_map.update_layout(title_text=title)
+    fig_events = draw_event_timeline(rec)
+    logger.info(f"Saving file {outfile!r}")
+    with open(outfile, "w", encoding="utf-8") as f:
+        write_figures_html([fig_map, fig_events], f, compact=compact)
+    return {
+        "lev_sha256": lev_sha256,
+        "rec_sha256": rec_sha256,
+        "lev_cache_hit": lev_cache.hits > hits,
+    }
+
+
+def _render_task(*args) -> dict:
+    with profiling.timer("render_replay"):
+        result = _render_replay(*args)
+    # Render worker processes hand back their timings; a thread shares ours
+    if multiprocessing.parent_process() is not None:
+        result["profile"] = profiling.drain()
+    return result
+
+
+def _fetch_new_replays(manifest: Manifest, num: int, max_pages: int) -> pl.DataFrame:
+    # Newest first, page by page, until reaching replays already in the
+    #  manifest. A fresh manifest only gets the first page. -> ROW_FIELDS
+    pages = []
+    for page in range(max_pages):
+        replays = get_latest_replays(page=page, num=num)
+        if not replays:
+            break
+        pages.append(pl.json_normalize(replays))
+        if (
+            not len(manifest)
+            or len(replays) < num
+            or any(replay["UUID"] in manifest for replay in replays)
+        ):
+            break
+    logger.info(f"Fetched {len(pages)} page(s) of replays")
+    if not pages:
+        return pl.DataFrame(schema=ROW_SCHEMA)
     # For fun, use polars here
-    latest_replays = pl.json_normalize(get_latest_replays(num=num)).with_columns(
-        (pl.col("RecFileName").str.strip_suffix(".rec") + ".html").alias("rec_base"),
+    return (
+        pl.concat(pages, how="diagonal_relaxed")
+        .with_columns(
+            (pl.col("RecFileName").str.strip_suffix(".rec") + ".html").alias(
+                "rec_base"
+            ),
+        )
+        .select(ROW_FIELDS)
     )
-    for row in track(
-        latest_replays.iter_rows(named=True),
-        description="Processing recent recs",
-        total=len(latest_replays),
-    ):
-        outfile = os.path.join(rec_dir, row["rec_base"])
-        if os.path.exists(outfile):
-            logger.info(f"Skipping existing file {outfile!r}")
+
+
+def _render_pool(render_workers: int | None) -> Executor:
+    if render_workers == 1:
+        # Skip process startup for small runs
+        return ThreadPoolExecutor(max_workers=1)
+    # polars' thread pool deadlocks in forked children. Spawned workers start
+    #  without our log handlers, so set them up again
+    return ProcessPoolExecutor(
+        max_workers=render_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_logging,
+    )
+
+
+def make_recent_replay_page(
+    index_page="index.md",
+    rec_dir=".",
+    num: int = 20,
+    max_points: int | None = None,
+    lod_method: str = "lttb",
+    lod_tolerance: float | None = None,
+    compact: bool = True,
+    download_workers: int = POOL_MAXSIZE,
+    render_workers: int | None = None,
+    layer_cache_dir: str | None = DEFAULT_LAYER_CACHE_DIR,
+    max_pages: int = 50,
+):
+    # Incremental: what has been rendered is tracked in a manifest in rec_dir.
+    #  New replays, ones rendered by an older PAGE_VERSION or LAYER_VERSION and
+    #  failed ones (after a backoff) are rendered. Others are skipped by replay
+    #  UUID before downloading anything
+    manifest = Manifest(rec_dir)
+    latest_replays = _fetch_new_replays(manifest, num, max_pages)
+
+    todo = {}
+    n_skipped = 0
+    for row in latest_replays.iter_rows(named=True):
+        if not manifest.needs_render(row):
+            logger.debug(f"Skipping up-to-date replay {row['UUID']!r}")
+            n_skipped += 1
             continue
-        logger.info(f"Attempting to create {outfile!r}")
-        lev = load_lev(get_lev_by_id(row["LevelIndex"]))
-        rec = load_rec(get_rec_by_id_and_name(row["UUID"], row["RecFileName"]))
-        fig_map = draw_rec(rec, lev)
-        title = "{lev} - {kuski} ({time:.2f}s)".format(
-            kuski=row["DrivenByData.Kuski"],
-            lev=row["LevelData.LevelName"],
-            time=row["ReplayTime"] / 1000,
-        )
-        fig_map.update_layout(title_text=title)
-        fig_events = draw_event_timeline(rec)
-        logger.info(f"Saving file {outfile!r}")
-        with open(outfile, "w", encoding="utf-8") as f:
-            pio.write_html(fig_map, file=f, include_plotlyjs="cdn")
-            pio.write_html(fig_events, file=f, include_plotlyjs=False)
+        todo[row["UUID"]] = (row, os.path.join(rec_dir, row["rec_base"]))
+    for entry in manifest.outdated():
+        if entry["uuid"] not in todo:
+            logger.info(f"Retrying failed or outdated file {entry['outfile']!r}")
+            todo[entry["uuid"]] = (entry["row"], entry["outfile"])
+    todo = list(todo.values())
+
+    # Downloads and renders overlap: each finished download is handed to the
+    #  render pool straight away, renders write their file as they finish
+    with (
+        Progress() as progress,
+        ThreadPoolExecutor(max_workers=download_workers) as downloads,
+        _render_pool(render_workers) as renders,
+    ):
+        task = progress.add_task("Processing recent recs", total=len(todo))
+        # Group by level: each level is downloaded once per run, and rows of
+        #  the same level are queued together so workers hit their lev cache.
+        #  Files already in the blob store aren't downloaded again
+        todo.sort(key=lambda el: el[0]["LevelIndex"])
+        lev_fetches: dict[int, Future] = {}
+        rec_fetches: dict[Future, tuple[dict, str]] = {}
+        for row, outfile in todo:
+            if row["LevelIndex"] not in lev_fetches:
+                lev_fetches[row["LevelIndex"]] = downloads.submit(
+                    _fetch_lev, row["LevelIndex"]
+                )
+            rec_fetches[downloads.submit(_fetch_rec, row)] = (row, outfile)
+
+        rendering: dict[Future, tuple[dict, str, str, str]] = {}
+        for rec_fetch in as_completed(rec_fetches):
+            row, outfile = rec_fetches[rec_fetch]
+            try:
+                rec_sha256 = rec_fetch.result()
+                lev_sha256 = lev_fetches[row["LevelIndex"]].result()
+            except Exception as e:
+                logger.exception(f"Failed to download replay for {outfile!r}")
+                manifest.record(row, outfile, None, None, error=repr(e))
+                progress.advance(task)
+                continue
+            logger.info(f"Attempting to create {outfile!r}")
+            render = renders.submit(
+                _render_task,
+                row,
+                lev_sha256,
+                rec_sha256,
+                blob_store.store_dir,
+                outfile,
+                max_points,
+                lod_method,
+                lod_tolerance,
+                compact,
+                layer_cache_dir,
+            )
+            render.add_done_callback(lambda _: progress.advance(task))
+            rendering[render] = (row, outfile, lev_sha256, rec_sha256)
+
+        lev_hits = lev_misses = 0
+        for render in as_completed(rendering):
+            row, outfile, lev_sha256, rec_sha256 = rendering[render]
+            try:
+                result = render.result()
+            except Exception as e:
+                logger.exception(f"Failed to render {outfile!r}")
+                manifest.record(row, outfile, lev_sha256, rec_sha256, error=repr(e))
+                continue
+            manifest.record(row, outfile, result["lev_sha256"], result["rec_sha256"])
+            profiling.merge(result.get("profile", {}))
+            if result["lev_cache_hit"]:
+                lev_hits += 1
+            else:
+                lev_misses += 1
+    for fetch in [*lev_fetches.values(), *rec_fetches]:
+        if fetch.exception() is None:
+            blob_store.unpin(fetch.result())
+    manifest.compact()
+    logger.info(
+        f"Fetched {len(lev_fetches)} levels for {len(todo)} replays, "
+        f"{n_skipped} up to date; "
+        f"parsed lev cache: {lev_hits} hits, {lev_misses} misses"
+    )
 
     def _rec_link(rec):
         return f"[{rec}](recs/{rec})"
 
-    page_df = latest_replays.select(
-        [
-            pl.from_epoch("Uploaded", time_unit="s").alias("Date"),
-            pl.col("LevelData.LevelName").alias("Lev"),
-            pl.col("DrivenByData.Kuski").alias("Kuski"),
-            (pl.col("ReplayTime") / 1000).alias("Time (s)"),
-            pl.col("rec_base").alias("Static rec").map_elements(_rec_link),
-        ]
+    # The newest `num` replays with a rendered file, from earlier runs too
+    rendered = pl.DataFrame(
+        [entry["row"] for entry in manifest.rendered()], schema=ROW_SCHEMA
+    )
+    page_df = (
+        rendered.sort("Uploaded", descending=True)
+        .head(num)
+        .select(
+            [
+                pl.from_epoch("Uploaded", time_unit="s").alias("Date"),
+                pl.col("LevelData.LevelName").alias("Lev"),
+                pl.col("DrivenByData.Kuski").alias("Kuski"),
+                (pl.col("ReplayTime") / 1000).alias("Time (s)"),
+                pl.col("rec_base").alias("Static rec").map_elements(_rec_link),
+            ]
+        )
     )
     logger.info(f"Saving file {index_page!r}")
     with open(index_page, "w", encoding="utf-8") as f:
@@ -1,11 +1,22 @@
+import json
 import logging
+import typing
+from dataclasses import dataclass
 
 import numpy as np
+import plotly.colors
 import plotly.graph_objects as go
+import plotly.io as pio
 import polars as pl
 from rich.progress import track
 
+from elma_recplot import profiling
 from elma_recplot.elma_loader import EventType, Lev, ObjType, Rec
+from elma_recplot.lod import downsample_frames, simplify
+
+if typing.TYPE_CHECKING:
+    from elma_recplot.heatmap import Heatmap
+    from elma_recplot.layer_cache import LevLayerCache
 
 KUSKI_COLOR = "#1f77b4"
 HEAD_COLOR = "#ff7f0e"
@@ -32,16 +43,64 @@ BIKE_COLOR = {
     "wheel": "#000000",
     "head": "#a0fdf5",
 }
-MAX_DRAW_EVENTS = 500
+BIKE_MARKER_SIZE = 10
+OBJ_MARKER_SIZE = 16
+# One color per rec in `draw_recs`, cycled
+REC_COLORS = plotly.colors.qualitative.Plotly
+HEATMAP_COLORSCALE = "Inferno"
+HEATMAP_OPACITY = 0.8
+# Bump when `add_lev_to_fig` output changes; invalidates cached level layers
+#  and, as pages embed the level, rendered pages
+LAYER_VERSION = 1
+# Bump when rec pages (`draw_rec`, `draw_event_timeline`, `write_figures_html`)
+#  change otherwise; pages rendered by an older version are redone
+PAGE_VERSION = 1
 
 logger = logging.getLogger(__name__)
 
 
-def draw_rec(rec: Rec, lev: Lev) -> go.Figure:
+@dataclass
+class LayerJson:
+    # Traces and layout shapes drawn under a figure's own, as serialized JSON
+    #  lists; `write_figures_html` splices them into the page text as they are
+    data: str
+    compact_data: str  # `data` with `compact_figure`'s float32 coordinates
+    shapes: str
+
+
+def set_layer_json(fig: go.Figure, layer: LayerJson):
+    # Only pages written by `write_figures_html` show the layer
+    fig._layer_json = layer
+
+
+def draw_rec(
+    rec: Rec,
+    lev: Lev,
+    max_points: int | None = None,
+    lod_method: str = "lttb",
+    layer_cache: "LevLayerCache | None" = None,
+    lod_tolerance: float | None = None,
+) -> go.Figure:
+    # layer_cache: to reuse the rendered level layer from
+    fig = _lev_figure(lev, layer_cache)
+    add_rec_to_fig(
+        rec,
+        fig,
+        max_points=max_points,
+        lod_method=lod_method,
+        lod_tolerance=lod_tolerance,
+    )
+    return fig
+
+
+def _lev_figure(lev: Lev, layer_cache: "LevLayerCache | None" = None) -> go.Figure:
+    # The level and map layout that recs are drawn on top of
     fig = go.Figure()
 
-    add_lev_to_fig(lev, fig)
-    add_rec_to_fig(rec, fig)
+    if layer_cache is not None:
+        layer_cache.add_lev_to_fig(lev, fig)
+    else:
+        add_lev_to_fig(lev, fig)
 
     fig.update_layout(
         # X/Y scaled equal; no labels
@@ -55,11 +114,92 @@ def draw_rec(rec: Rec, lev: Lev) -> go.Figure:
     return fig
 
 
-def add_rec_to_fig(rec, fig):
+def draw_recs(
+    recs: list[Rec],
+    lev: Lev,
+    names: list[str] | None = None,
+    max_points: int | None = None,
+    lod_method: str = "lttb",
+    layer_cache: "LevLayerCache | None" = None,
+    lod_tolerance: float | None = None,
+) -> go.Figure:
+    # Kuski paths of several recs of `lev` overlaid, one trace per rec;
+    #  `max_points` is the point budget per rec
+    fig = _lev_figure(lev, layer_cache)
+    names = names or [f"Rec {i}" for i in range(len(recs))]
+    for i, (rec, name) in enumerate(zip(recs, names)):
+        x = rec.frames["x"].to_numpy()
+        y = rec.frames["y"].to_numpy()
+        t = rec.frames["t"].to_numpy()
+        if max_points is not None or lod_tolerance is not None:
+            keep = simplify(
+                x,
+                y,
+                method=lod_method,
+                max_points=max_points,
+                tolerance=lod_tolerance,
+            )
+            x, y, t = x[keep], y[keep], t[keep]
+        fig.add_trace(
+            go.Scatter(
+                x=x,
+                y=y,
+                customdata=t,
+                hovertemplate="t=%{customdata:.2f} s",
+                mode="lines",
+                name=name,
+                line=dict(color=REC_COLORS[i % len(REC_COLORS)]),
+            )
+        )
+    return fig
+
+
+def draw_heatmap(
+    heatmap: "Heatmap",
+    lev: Lev,
+    layer: str = "position",
+    layer_cache: "LevLayerCache | None" = None,
+) -> go.Figure:
+    fig = _lev_figure(lev, layer_cache)
+    add_heatmap_to_fig(heatmap, fig, layer=layer)
+    return fig
+
+
+@profiling.timed("add_heatmap_to_fig")
+def add_heatmap_to_fig(heatmap: "Heatmap", fig, layer: str = "position"):
+    # One heatmap trace on top of the level; log-scaled counts, empty bins
+    #  transparent
+    counts = heatmap.counts[layer]
+    z = np.where(counts > 0, np.log10(np.maximum(counts, 1)), np.nan)
+    fig.add_trace(
+        go.Heatmap(
+            x=(heatmap.x_edges[:-1] + heatmap.x_edges[1:]) / 2,
+            y=(heatmap.y_edges[:-1] + heatmap.y_edges[1:]) / 2,
+            z=z.T,
+            customdata=counts.T,
+            hovertemplate="%{customdata}<extra></extra>",
+            colorscale=HEATMAP_COLORSCALE,
+            colorbar=dict(title=f"log10 {layer}"),
+            opacity=HEATMAP_OPACITY,
+            hoverongaps=False,
+            name=f"{layer.capitalize()} heatmap",
+        )
+    )
+
+
+@profiling.timed("add_rec_to_fig")
+def add_rec_to_fig(rec, fig, max_points=None, lod_method="lttb", lod_tolerance=None):
+    # Trajectories are reduced to ~max_points frames, or by `lod_tolerance`
+    #  world units for rdp/grid; volts use all frames
+    frames = rec.frames
+    if max_points is not None or lod_tolerance is not None:
+        frames = downsample_frames(
+            frames, max_points=max_points, method=lod_method, tolerance=lod_tolerance
+        )
     fig.add_trace(
         go.Scatter(
-            x=rec.frames["x"],
-            y=rec.frames["y"],
+            x=frames["x"],
+            y=frames["y"],
             mode="lines",
             name="Kuski",
             line=dict(color=KUSKI_COLOR),
@@ -67,8 +207,8 @@ def add_rec_to_fig(rec, fig):
     )
     fig.add_trace(
         go.Scatter(
-            x=rec.frames["head_x"],
-            y=rec.frames["head_y"],
+            x=frames["head_x"],
+            y=frames["head_y"],
             mode="lines",
             name="Head",
             line=dict(color=HEAD_COLOR),
@@ -76,20 +216,20 @@ def add_rec_to_fig(rec, fig):
     )
     fig.add_trace(
         go.Scatter(
-            x=rec.frames["l_wheel_x"],
-            y=rec.frames["l_wheel_y"],
+            x=frames["l_wheel_x"],
+            y=frames["l_wheel_y"],
             line=dict(color=L_WHEEL_COLOR),
             mode="lines",
             name="Left wheel",
         )
     )
-    _xx = rec.frames["l_wheel_x"].clone()
+    _xx = frames["l_wheel_x"].clone()
     # Set NaN for non-gasing frames; right gas -> left wheel gas
-    _xx = _xx.set(~rec.frames["is_gasing_right"], None)
+    _xx = _xx.set(~frames["is_gasing_right"], None)
     fig.add_trace(
         go.Scatter(
             x=_xx,
-            y=rec.frames["l_wheel_y"],
+            y=frames["l_wheel_y"],
             line=dict(color=L_WHEEL_COLOR, width=6),
             mode="lines",
             name="Left wheel gas",
@@ -98,20 +238,20 @@ def add_rec_to_fig(rec, fig):
     )
     fig.add_trace(
         go.Scatter(
-            x=rec.frames["r_wheel_x"],
-            y=rec.frames["r_wheel_y"],
+            x=frames["r_wheel_x"],
+            y=frames["r_wheel_y"],
             line=dict(color=R_WHEEL_COLOR),
             mode="lines",
             name="Right wheel",
         )
     )
-    _xx = rec.frames["r_wheel_x"].clone()
+    _xx = frames["r_wheel_x"].clone()
     # Set NaN for non-gasing frames; left gas -> right wheel gas
-    _xx = _xx.set(~rec.frames["is_gasing_left"], None)
+    _xx = _xx.set(~frames["is_gasing_left"], None)
     fig.add_trace(
         go.Scatter(
             x=_xx,
-            y=rec.frames["r_wheel_y"],
+            y=frames["r_wheel_y"],
             line=dict(color=R_WHEEL_COLOR, width=6),
             mode="lines",
             name="Right wheel gas",
@@ -119,100 +259,111 @@ def add_rec_to_fig(rec, fig):
         )
     )
 
-    events_to_draw = rec.events.filter(
-        pl.col("event_type").is_in(
-            {EventType.VOLT_LEFT.value, EventType.VOLT_RIGHT.value}
-        )
-    ).sort("timestamp")
-    if len(events_to_draw) > MAX_DRAW_EVENTS:
-        logger.warning(
-            f"Too many volt events ({len(events_to_draw)}); skipping drawing"
-        )
-        # Slow AF with too many events added as individual traces/circles\
-        # TODO: draw as a single trace per event type
-    else:
-        logger.info(f"Drawing {len(events_to_draw)} volt events")
-        for row in events_to_draw.iter_rows(named=True):
-            timestamp = row["timestamp"]
-            event_type = EventType(row["event_type"])
-            if event_type not in {EventType.VOLT_LEFT, EventType.VOLT_RIGHT}:
-                continue
-            idx = rec.frames["t"].search_sorted(timestamp)
-            if idx >= len(rec.frames["t"]):
-                idx -= 1
-            if idx >= len(rec.frames["t"]):
-                logger.warning(f"Skipping event at t={timestamp}; out of bounds")
-                continue
-
-            logger.debug(
-                f"Drawing volt at t={timestamp} at frame t={rec.frames['t'][idx]}"
-            )
-            _x = rec.frames.select(["l_wheel_x", "head_x", "r_wheel_x"]).row(idx)
-            _y = rec.frames.select(["l_wheel_y", "head_y", "r_wheel_y"]).row(idx)
-            color = VOLT_COLOR[event_type]
-            width = VOLT_WIDTH[event_type]
-            # Trust that left volts are drawn after
-            fig.add_trace(
-                go.Scatter(
-                    x=_x,
-                    y=_y,
-                    mode="lines",
-                    line=dict(color=color, width=width),
-                    showlegend=False,
-                    name=f"event {idx}",
-                    legendgroup="Volts",
-                )
+    volts = _volt_positions(rec)
+    logger.info(f"Drawing {len(volts)} volt events")
+    # Left volts drawn last, on top of the wider right volt lines
+    for event_type, name in (
+        (EventType.VOLT_RIGHT, "Right volt"),
+        (EventType.VOLT_LEFT, "Left volt"),
+    ):
+        _volts = volts.filter(pl.col("event_type") == event_type.value)
+        fig.add_trace(
+            go.Scatter(
+                x=_segments(_volts["l_wheel_x"], _volts["head_x"], _volts["r_wheel_x"]),
+                y=_segments(_volts["l_wheel_y"], _volts["head_y"], _volts["r_wheel_y"]),
+                mode="lines",
+                line=dict(color=VOLT_COLOR[event_type], width=VOLT_WIDTH[event_type]),
+                name=name,
+                legendgroup="Volts",
             )
-            _lx, _ly, _rx, _ry, _hx, _hy = rec.frames.select(
-                "l_wheel_x", "l_wheel_y", "r_wheel_x", "r_wheel_y", "head_x", "head_y"
-            ).row(idx)
-            _add_circle(fig, _lx, _ly, BIKE_COLOR["wheel"], radius=ITEM_RADIUS)
-            _add_circle(fig, _rx, _ry, BIKE_COLOR["wheel"], radius=ITEM_RADIUS)
-            # TODO: too large for head?
-            _add_circle(fig, _hx, _hy, BIKE_COLOR["head"], radius=ITEM_RADIUS)
-
-    # dummy entries for legend
+        )
+    # Wheels and head at each volt; marker size is in pixels, not world units
     fig.add_trace(
         go.Scatter(
-            x=[None],
-            y=[None],
-            mode="lines",
-            line=dict(color=VOLT_COLOR[EventType.VOLT_LEFT], width=2),
-            name="Left volt",
+            x=pl.concat([volts["l_wheel_x"], volts["r_wheel_x"], volts["head_x"]]),
+            y=pl.concat([volts["l_wheel_y"], volts["r_wheel_y"], volts["head_y"]]),
+            mode="markers",
+            marker=dict(
+                color=[BIKE_COLOR["wheel"]] * (2 * len(volts))
+                + [BIKE_COLOR["head"]] * len(volts),
+                size=BIKE_MARKER_SIZE,
+                opacity=0.2,
+            ),
+            showlegend=False,
+            name="Bike at volt",
             legendgroup="Volts",
         )
     )
-    fig.add_trace(
-        go.Scatter(
-            x=[None],
-            y=[None],
-            mode="lines",
-            line=dict(color=VOLT_COLOR[EventType.VOLT_RIGHT], width=4),
-            name="Right volt",
-            legendgroup="Volts",
+
+
+def _volt_positions(rec: Rec) -> pl.DataFrame:
+    # Bike positions at the frame of every volt event, in timestamp order
+    events = rec.events.filter(
+        pl.col("event_type").is_in(
+            {EventType.VOLT_LEFT.value, EventType.VOLT_RIGHT.value}
         )
+    ).sort("timestamp")
+    if rec.frames.is_empty():
+        events = events.clear()
+    # Events past the last frame are drawn at the last frame
+    frame_idx = (
+        rec.frames["t"]
+        .search_sorted(events["timestamp"])
+        .clip(upper_bound=max(len(rec.frames) - 1, 0))
     )
+    return rec.frames.select(
+        "l_wheel_x", "l_wheel_y", "r_wheel_x", "r_wheel_y", "head_x", "head_y"
+    )[frame_idx].with_columns(events["event_type"])
 
 
-def add_lev_to_fig(lev, fig):
+def _segments(*points: pl.Series) -> np.ndarray:
+    # Polylines through `points` per row, separated by NaN (gaps in plotly)
+    if len(points[0]) == 0:
+        # Keep a legend entry for empty traces
+        return np.array([np.nan])
+    nan = np.full(len(points[0]), np.nan)
+    return np.column_stack([p.to_numpy() for p in points] + [nan]).ravel()
+
+
+@profiling.timed("add_lev_to_fig")
+def add_lev_to_fig(lev, fig, batched=True):
+    # batched: all filled polygons in one trace, objects as one marker trace
+    #  per type; otherwise one trace per polygon and one shape per object
     poly_data = lev.polygons_coords.join(lev.polygons, on="index", how="inner")
+    filled_polys = poly_data.filter((~pl.col("is_grass")) & (pl.col("area") < 0))
     # TODO: if largest poly is filled, we should invert all
-    for (idx,), group in poly_data.filter(
-        (~pl.col("is_grass")) & (pl.col("area") < 0)
-    ).rename({"index": "poly_index"}).group_by("poly_index"):
+    if batched:
+        poly_x, poly_y = _poly_segments(filled_polys)
         fig.add_trace(
             go.Scatter(
-                x=group["x"],
-                y=group["y"],
+                x=poly_x,
+                y=poly_y,
                 mode="lines",
                 fill="toself",
                 line=dict(color="rgba(0, 0, 0, 0)"),
                 showlegend=False,
                 fillcolor=POLY_FILL_COLOR,
-                name=f"Polygon {idx}",
+                name="Filled polygons",
                 legendgroup="Polygons",
             )
         )
+    else:
+        for (idx,), group in filled_polys.rename({"index": "poly_index"}).group_by(
+            "poly_index"
+        ):
+            fig.add_trace(
+                go.Scatter(
+                    x=group["x"],
+                    y=group["y"],
+                    mode="lines",
+                    fill="toself",
+                    line=dict(color="rgba(0, 0, 0, 0)"),
+                    showlegend=False,
+                    fillcolor=POLY_FILL_COLOR,
+                    name=f"Polygon {idx}",
+                    legendgroup="Polygons",
+                )
+            )
     largest_poly_idx = (
         lev.polygons.with_columns(pl.col("area").abs().alias("abs_area"))
         .sort("abs_area", descending=True)
@@ -232,15 +383,46 @@ def add_lev_to_fig(lev, fig):
             name="Polygons",
         )
     )
-    objs_df = lev.objects.with_columns(
-        pl.col("object_type")
-        .map_elements(OBJ_COLORS.get, return_dtype=str)
-        .alias("color")
-    )
-    for row in objs_df.iter_rows(named=True):
-        _add_circle(
-            fig, row["x"], row["y"], row["color"], radius=ITEM_RADIUS, opacity=0.2
+    if batched:
+        for obj_type in ObjType:
+            objs = lev.objects.filter(pl.col("object_type") == obj_type.value)
+            fig.add_trace(
+                go.Scatter(
+                    x=objs["x"],
+                    y=objs["y"],
+                    mode="markers",
+                    marker=dict(
+                        color=OBJ_COLORS[obj_type], size=OBJ_MARKER_SIZE, opacity=0.2
+                    ),
+                    name=obj_type.name.capitalize(),
+                    legendgroup="Objects",
+                )
+            )
+    else:
+        # `object_type` holds ObjType values, not members
+        objs_df = lev.objects.with_columns(
+            pl.col("object_type")
+            .replace_strict(
+                {obj_type.value: color for obj_type, color in OBJ_COLORS.items()},
+                return_dtype=pl.String,
+            )
+            .alias("color")
         )
+        for row in objs_df.iter_rows(named=True):
+            _add_circle(
+                fig, row["x"], row["y"], row["color"], radius=ITEM_RADIUS, opacity=0.2
+            )
+
+
+def _poly_segments(poly_data: pl.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    # Polygons (rows grouped by "index") as one NaN-separated x/y pair;
+    #  fill="toself" fills each NaN-delimited part separately
+    poly_data = poly_data.sort("index", maintain_order=True)
+    breaks = np.flatnonzero(np.diff(poly_data["index"].to_numpy())) + 1
+    return (
+        np.insert(poly_data["x"].to_numpy(), breaks, np.nan),
+        np.insert(poly_data["y"].to_numpy(), breaks, np.nan),
+    )
 
 
 def _add_circle(fig, x, y, color, radius=ITEM_RADIUS, opacity=0.2):
@@ -259,7 +441,12 @@ def _add_circle(fig, x, y, color, radius=ITEM_RADIUS, opacity=0.2):
     )
 
 
-def draw_event_timeline(rec: Rec) -> go.Figure:
+@profiling.timed("draw_event_timeline")
+def draw_event_timeline(
+    rec: Rec, deltas: pl.DataFrame | None = None, names: list[str] | None = None
+) -> go.Figure:
+    # deltas: from `compare.time_deltas` with `rec` as the reference; drawn
+    #  against a secondary y axis, one line per compared rec
     df_events = rec.events.with_columns(
         pl.col("event_type")
         .map_elements(lambda el: EventType(el).name, return_dtype=str)
@@ -305,4 +492,87 @@ def draw_event_timeline(rec: Rec) -> go.Figure:
         ],
     )
     fig.update_layout(xaxis_title="Time")
+    if deltas is not None:
+        _add_time_deltas(fig, deltas, names)
+    return fig
+
+
+def _add_time_deltas(fig, deltas: pl.DataFrame, names: list[str] | None = None):
+    for (rec_id,), group in deltas.group_by("rec", maintain_order=True):
+        fig.add_trace(
+            go.Scatter(
+                x=group["t"].to_numpy(),
+                y=group["delta"].to_numpy(),
+                mode="lines",
+                name=f"Δt {names[rec_id] if names else rec_id}",
+                line=dict(color=REC_COLORS[rec_id % len(REC_COLORS)], dash="dot"),
+                yaxis="y2",
+            )
+        )
+    fig.update_layout(
+        yaxis2=dict(
+            title="Δt vs reference (s)",
+            overlaying="y",
+            side="right",
+            zeroline=True,
+            showgrid=False,
+        )
+    )
+
+
+def compact_figure(fig: go.Figure) -> go.Figure:
+    # Downcast float64 trace coordinates to float32, in place. plotly embeds
+    #  numpy arrays as base64 typed arrays, so this halves their size; rec
+    #  positions are float32 at the source anyway
+    for trace in fig.data:
+        for attr in ("x", "y"):
+            values = getattr(trace, attr, None)
+            if isinstance(values, np.ndarray) and values.dtype == np.float64:
+                trace[attr] = values.astype(np.float32)
     return fig
+
+
+# Stand-ins for a `LayerJson`'s lists in the page's figure JSON
+_LAYER_MARKS = {
+    "data": "elma-recplot-layer-data",
+    "shapes": "elma-recplot-layer-shapes",
+}
+
+
+def _layered_figure_html(
+    fig: go.Figure, layer: LayerJson, compact: bool, **kwargs
+) -> str:
+    # The layer's JSON goes in as text, without building plotly objects from it
+    fig_dict = fig.to_dict()
+    layout = fig_dict.setdefault("layout", {})
+    spliced = {}
+    data = layer.compact_data if compact else layer.data
+    if data != "[]":
+        fig_dict["data"].insert(0, _LAYER_MARKS["data"])
+        spliced[_LAYER_MARKS["data"]] = data
+    if layer.shapes != "[]":
+        layout["shapes"] = [_LAYER_MARKS["shapes"], *layout.get("shapes", [])]
+        spliced[_LAYER_MARKS["shapes"]] = layer.shapes
+    # Not valid plotly until the marks are replaced by the lists' items
+    html = pio.to_html(fig_dict, validate=False, **kwargs)
+    for mark, items in spliced.items():
+        html = html.replace(json.dumps(mark), items[1:-1], 1)
+    return html
+
+
+@profiling.timed("write_figures_html")
+def write_figures_html(figs: list[go.Figure], file, compact: bool = True):
+    # All figures into one page; only the first pulls in plotly.js
+    for i, fig in enumerate(figs):
+        if compact:
+            fig = compact_figure(fig)
+        include_plotlyjs = "cdn" if i == 0 else False
+        layer = getattr(fig, "_layer_json", None)
+        if layer is None:
+            pio.write_html(fig, file=file, include_plotlyjs=include_plotlyjs)
+        else:
+            file.write(
+                _layered_figure_html(
+                    fig, layer, compact, include_plotlyjs=include_plotlyjs
+                )
+            )
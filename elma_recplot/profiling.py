@@ -0,0 +1,173 @@
+import contextlib
+import csv
+import functools
+import json
+import os
+import threading
+import time
+import typing
+
+# Stdlib only: imported by the CLI before any heavy module.
+#  When disabled, `timed` functions cost one flag check per call and `timer`/
+#  `count` return immediately. Enabling sets PROFILE_ENV_VAR, so spawned
+#  worker processes start enabled too; each task hands its `drain()` back to
+#  be `merge`d (see `page_creation`, `elma_loader.load_many`, `heatmap_many`)
+PROFILE_ENV_VAR = "ELMA_RECPLOT_PROFILE"
+# Timers fill the *_s fields, counters `value` (the sum of their `n`)
+STAT_FIELDS = ("name", "kind", "count", "total_s", "mean_s", "max_s", "value")
+
+_enabled = os.environ.get(PROFILE_ENV_VAR) == "1"
+_lock = threading.Lock()
+# name -> [count, total seconds, max seconds]
+_timers: dict[str, list] = {}
+# name -> [count, value]
+_counters: dict[str, list] = {}
+
+F = typing.TypeVar("F", bound=typing.Callable)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+    os.environ[PROFILE_ENV_VAR] = "1"
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _record(name: str, elapsed: float):
+    with _lock:
+        stat = _timers.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+
+
+def count(name: str, n: int = 1):
+    if _enabled:
+        with _lock:
+            stat = _counters.setdefault(name, [0, 0])
+            stat[0] += 1
+            stat[1] += n
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        _record(self.name, time.perf_counter() - self.start)
+
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def timer(name: str) -> typing.ContextManager:
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name: str) -> typing.Callable[[F], F]:
+    # Decorator: time each call of the function under `name`
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+
+        return typing.cast(F, wrapper)
+
+    return decorator
+
+
+def _copy() -> dict[str, dict[str, list]]:
+    return {
+        "timers": {name: list(stat) for name, stat in _timers.items()},
+        "counters": {name: list(stat) for name, stat in _counters.items()},
+    }
+
+
+def snapshot() -> dict[str, dict[str, list]]:
+    # -> {"timers": {name: [count, total, max]}, "counters": {name: [count, value]}}
+    with _lock:
+        return _copy()
+
+
+def merge(stats: dict[str, dict[str, list]]):
+    with _lock:
+        for name, (n, total, max_) in stats.get("timers", {}).items():
+            stat = _timers.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += n
+            stat[1] += total
+            stat[2] = max(stat[2], max_)
+        for name, (n, value) in stats.get("counters", {}).items():
+            stat = _counters.setdefault(name, [0, 0])
+            stat[0] += n
+            stat[1] += value
+
+
+def drain() -> dict[str, dict[str, list]]:
+    # Snapshot and reset, e.g. at the end of a task in a worker process
+    with _lock:
+        stats = _copy()
+        _timers.clear()
+        _counters.clear()
+    return stats
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def summary() -> list[dict]:
+    # One row per timer, slowest total first, then one per counter
+    stats = snapshot()
+    timers = [
+        {
+            "name": name,
+            "kind": "timer",
+            "count": n,
+            "total_s": total,
+            "mean_s": total / n if n else 0.0,
+            "max_s": max_,
+            "value": None,
+        }
+        for name, (n, total, max_) in stats["timers"].items()
+    ]
+    counters = [
+        {
+            "name": name,
+            "kind": "counter",
+            "count": n,
+            "total_s": None,
+            "mean_s": None,
+            "max_s": None,
+            "value": value,
+        }
+        for name, (n, value) in sorted(stats["counters"].items())
+    ]
+    return sorted(timers, key=lambda row: row["total_s"], reverse=True) + counters
+
+
+def write_summary(path: str):
+    # CSV for a .csv path, JSON otherwise
+    rows = summary()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=STAT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, f, indent=2)
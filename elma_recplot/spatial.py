@@ -0,0 +1,477 @@
+import logging
+import typing
+
+import numpy as np
+import polars as pl
+
+from elma_recplot.elma_loader import Lev
+
+logger = logging.getLogger(__name__)
+
+# Aim for about this many edges per grid cell when no cell size is given
+EDGES_PER_CELL = 2
+MAX_GRID_CELLS = 1 << 22
+# Queries run on this many points/segments at a time, and expand into (query,
+#  edge) pairs in batches of about MAX_BATCH_PAIRS, so memory doesn't grow
+#  with the number of queries
+QUERY_CHUNK = 1 << 14
+MAX_BATCH_PAIRS = 1 << 20
+# `nearest_edge` searches discs of growing radius around a point; until it
+#  finds an edge, the radius grows by at most this many cells per step, since
+#  every edge in the first disc that has one gets its distance computed
+MAX_RADIUS_STEP = 1
+# Where each cell's reference point for `containing_polygon` sits, in cells from
+#  its corner: off-centre and off-diagonal, so grid-aligned levels are unlikely
+#  to put edges through them
+REFERENCE_OFFSET = (0.41421356, 0.73205081)
+
+# Queries take whole coordinate arrays and return one result per point/segment.
+#  Only ground (non-grass) polygons are indexed; polygon ids are
+#  `Lev.polygons["index"]`, with -1 for "none".
+
+
+def _cell_rects(
+    cx0: np.ndarray, cy0: np.ndarray, cx1: np.ndarray, cy1: np.ndarray, n_x: int
+) -> tuple[np.ndarray, np.ndarray]:
+    # Expand inclusive cell rectangles -> (rectangle index, flat cell id) pairs;
+    #  empty rectangles (cx1 < cx0 or cy1 < cy0) expand to nothing
+    w = np.maximum(cx1 - cx0 + 1, 0)
+    n_cells = w * np.maximum(cy1 - cy0 + 1, 0)
+    owner = np.repeat(np.arange(len(n_cells)), n_cells)
+    k = np.arange(int(n_cells.sum())) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+    cx = cx0[owner] + k % w[owner]
+    cy = cy0[owner] + k // w[owner]
+    return owner, cy * n_x + cx
+
+
+def _first_per_group(keys: np.ndarray) -> np.ndarray:
+    # Mask of the first element of each run of equal (sorted) keys
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return first
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Expand [start, stop) ranges -> (range index, position) pairs
+    counts = np.maximum(stops - starts, 0)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    k = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + k
+
+
+def _batches(weights: np.ndarray) -> list[slice]:
+    # Consecutive slices of `weights` summing to about MAX_BATCH_PAIRS each
+    batch = np.cumsum(weights) // MAX_BATCH_PAIRS
+    bounds = [0, *(np.flatnonzero(np.diff(batch)) + 1), len(weights)]
+    return [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _in_chunks(query: typing.Callable, *arrays: np.ndarray):
+    # `query` over QUERY_CHUNK long slices of `arrays`, results concatenated
+    parts = [
+        query(*(a[i : i + QUERY_CHUNK] for a in arrays))
+        for i in range(0, max(len(arrays[0]), 1), QUERY_CHUNK)
+    ]
+    if isinstance(parts[0], tuple):
+        return tuple(np.concatenate(part) for part in zip(*parts))
+    return np.concatenate(parts)
+
+
+def _point_segment_distance(px, py, x0, y0, x1, y1) -> np.ndarray:
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s = np.clip(((px - x0) * dx + (py - y0) * dy) / length2, 0.0, 1.0)
+    s = np.where(length2 > 0, s, 0.0)
+    return np.hypot(px - (x0 + s * dx), py - (y0 + s * dy))
+
+
+def _orientation(ax, ay, bx, by, cx, cy) -> np.ndarray:
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+def _segments_intersect(ax, ay, bx, by, cx, cy, dx, dy) -> np.ndarray:
+    # Proper crossings plus touching; collinear overlaps count via the bbox test
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+    bbox_overlap = (
+        (np.minimum(ax, bx) <= np.maximum(cx, dx))
+        & (np.minimum(cx, dx) <= np.maximum(ax, bx))
+        & (np.minimum(ay, by) <= np.maximum(cy, dy))
+        & (np.minimum(cy, dy) <= np.maximum(ay, by))
+    )
+    return bbox_overlap & (o1 * o2 <= 0) & (o3 * o4 <= 0)
+
+
+class PolygonIndex:
+    # Uniform grid over the edges of a level's ground polygons. Each cell lists
+    #  the edges passing through it (CSR layout: `_cell_edges` sliced by
+    #  `_cell_starts`), and the polygons containing its reference point
+    #  (`_cell_inside`, sliced by `_inside_starts`). Queries gather candidate
+    #  edges from runs of cells along a grid row, which are contiguous in
+    #  `_cell_edges`, so empty cells cost nothing
+    def __init__(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        polygon: np.ndarray,
+        polygon_area: dict[int, float] | None = None,
+        cell_size: float | None = None,
+    ):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        polygon = np.asarray(polygon, dtype=np.int64)
+        # Vertices of a polygon are contiguous; close each ring
+        is_first = _first_per_group(polygon)
+        is_last = np.roll(is_first, -1)
+        nxt = np.arange(1, len(polygon) + 1)
+        nxt[is_last] = np.flatnonzero(is_first)
+        self.x0, self.y0 = x, y
+        self.x1, self.y1 = x[nxt], y[nxt]
+        self.edge_polygon = polygon
+        self.n_edges = len(polygon)
+        # Smaller |area| = more deeply nested, see `containing_polygon`
+        area = polygon_area or {}
+        self._polygon_ids = np.unique(polygon)
+        self._polygon_area = np.array(
+            [abs(area.get(int(p), 0.0)) for p in self._polygon_ids]
+        )
+
+        if self.n_edges == 0:
+            self.origin = (0.0, 0.0)
+            self.cell_size = cell_size or 1.0
+            self.n_x = self.n_y = 1
+        else:
+            min_x = float(x.min())
+            min_y = float(y.min())
+            width = float(x.max()) - min_x
+            height = float(y.max()) - min_y
+            if cell_size is None:
+                cell_size = np.sqrt(
+                    max(width * height, 1.0) * EDGES_PER_CELL / self.n_edges
+                )
+            cell_size = max(
+                cell_size, np.sqrt(max(width * height, 1.0) / MAX_GRID_CELLS)
+            )
+            self.origin = (min_x, min_y)
+            self.cell_size = float(cell_size)
+            self.n_x = int(width // cell_size) + 1
+            self.n_y = int(height // cell_size) + 1
+
+        owner, row, col0, col1 = self._segment_rows(self.x0, self.y0, self.x1, self.y1)
+        edge, cell = _cell_rects(col0, row, col1, row, self.n_x)
+        edge = owner[edge]
+        self._cell_edges = edge[np.argsort(cell, kind="stable")]
+        self._cell_starts = np.concatenate(
+            [[0], np.cumsum(np.bincount(cell, minlength=self.n_x * self.n_y))]
+        )
+        self._index_reference_points(owner, row)
+        logger.info(
+            f"Indexed {self.n_edges} edges in a {self.n_x}x{self.n_y} grid "
+            f"(cell size {self.cell_size:.3g}, {len(edge)} cell entries)"
+        )
+
+    @classmethod
+    def from_lev(cls, lev: Lev, cell_size: float | None = None) -> "PolygonIndex":
+        ground = lev.polygons.filter(~pl.col("is_grass"))
+        coords = lev.polygons_coords.join(
+            ground.select("index"), on="index", how="semi"
+        )
+        return cls(
+            coords["x"].to_numpy(),
+            coords["y"].to_numpy(),
+            coords["index"].to_numpy(),
+            polygon_area=dict(zip(ground["index"], ground["area"])),
+            cell_size=cell_size,
+        )
+
+    def _col(self, x) -> np.ndarray:
+        cx = np.floor((np.asarray(x) - self.origin[0]) / self.cell_size)
+        return np.clip(cx, 0, self.n_x - 1).astype(np.int64)
+
+    def _row(self, y) -> np.ndarray:
+        cy = np.floor((np.asarray(y) - self.origin[1]) / self.cell_size)
+        return np.clip(cy, 0, self.n_y - 1).astype(np.int64)
+
+    def _cell(self, x, y) -> tuple[np.ndarray, np.ndarray]:
+        return self._col(x), self._row(y)
+
+    def _reference(self, cx, cy) -> tuple[np.ndarray, np.ndarray]:
+        return (
+            self.origin[0] + (cx + REFERENCE_OFFSET[0]) * self.cell_size,
+            self.origin[1] + (cy + REFERENCE_OFFSET[1]) * self.cell_size,
+        )
+
+    def _index_reference_points(self, edge: np.ndarray, row: np.ndarray):
+        # Even-odd ray cast from -x along each grid row's reference height: an
+        #  edge crossing it toggles its polygon for the reference points to its
+        #  right. `edge`, `row`: the grid rows each edge spans
+        _, ref_y = self._reference(0, row)
+        x0, y0, x1, y1 = self.x0[edge], self.y0[edge], self.x1[edge], self.y1[edge]
+        spans = (y0 > ref_y) != (y1 > ref_y)
+        edge, row, ref_y = edge[spans], row[spans], ref_y[spans]
+        x0, y0, x1, y1 = x0[spans], y0[spans], x1[spans], y1[spans]
+        x_cross = x0 + (ref_y - y0) * (x1 - x0) / (y1 - y0)
+        # First column whose reference point is right of the crossing, with
+        #  the float rounding of `_reference` settled by comparing against it
+        first = np.floor(
+            (x_cross - self.origin[0]) / self.cell_size - REFERENCE_OFFSET[0] + 1
+        )
+        first = np.clip(first, 0, self.n_x).astype(np.int64)
+        ref_x, _ = self._reference(first - 1, 0)
+        first -= (first > 0) & (ref_x > x_cross)
+        ref_x, _ = self._reference(first, 0)
+        first += (first < self.n_x) & (ref_x <= x_cross)
+        # A closed polygon crosses a row an even number of times: its inside
+        #  runs from each odd crossing to the next
+        polygon_pos = np.searchsorted(self._polygon_ids, self.edge_polygon[edge])
+        order = np.lexsort((first, polygon_pos, row))
+        first, polygon_pos, row = first[order], polygon_pos[order], row[order]
+        run, cell = _cell_rects(
+            first[::2], row[::2], first[1::2] - 1, row[::2], self.n_x
+        )
+        self._cell_inside = polygon_pos[::2][run][np.argsort(cell, kind="stable")]
+        self._inside_starts = np.concatenate(
+            [[0], np.cumsum(np.bincount(cell, minlength=self.n_x * self.n_y))]
+        )
+
+    def _segment_rows(
+        self, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Cells each segment passes through, as one run of columns per grid
+        #  row: -> (segment index, row, first column, last column). Rows at the
+        #  grid's edges extend to infinity, like the clamped cells of `_cell`
+        row0 = self._row(np.minimum(y0, y1))
+        n_rows = self._row(np.maximum(y0, y1)) - row0 + 1
+        owner = np.repeat(np.arange(len(n_rows)), n_rows)
+        row = row0[owner] + (
+            np.arange(int(n_rows.sum())) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+        )
+        sx0, sy0, sx1, sy1 = x0[owner], y0[owner], x1[owner], y1[owner]
+        # Slack for rounding, so cells a segment only just touches aren't missed
+        slack = 1e-9 * self.cell_size
+        band_lo = self.origin[1] + row * self.cell_size - slack
+        band_hi = band_lo + self.cell_size + 2 * slack
+        lo = np.where(row == 0, -np.inf, band_lo).clip(np.minimum(sy0, sy1))
+        hi = np.where(row == self.n_y - 1, np.inf, band_hi).clip(
+            None, np.maximum(sy0, sy1)
+        )
+        dy = sy1 - sy0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x_lo = np.where(dy != 0, sx0 + (lo - sy0) * (sx1 - sx0) / dy, sx0)
+            x_hi = np.where(dy != 0, sx0 + (hi - sy0) * (sx1 - sx0) / dy, sx1)
+        col0 = self._col(np.minimum(x_lo, x_hi) - slack)
+        col1 = self._col(np.maximum(x_lo, x_hi) + slack)
+        return owner, row, col0, col1
+
+    def _run_entries(self, row, col0, col1) -> tuple[np.ndarray, np.ndarray]:
+        # Runs of cells col0..col1 (inclusive, may be empty) of a grid row ->
+        #  their [start, stop) range in `_cell_edges`
+        base = row * self.n_x
+        start = self._cell_starts[base + np.clip(col0, 0, self.n_x)]
+        stop = self._cell_starts[base + np.clip(col1 + 1, 0, self.n_x)]
+        return start, np.where(col1 >= col0, stop, start)
+
+    def _candidates(self, owner, row, col0, col1) -> tuple[np.ndarray, np.ndarray]:
+        # -> unique (query, edge) pairs for edges in the runs of cells, sorted
+        #  by query; `owner` is the query of each run
+        run, entry = _ranges(*self._run_entries(row, col0, col1))
+        # An edge passing through several of a query's cells is tested once
+        key = np.sort(owner[run] * self.n_edges + self._cell_edges[entry])
+        key = key[_first_per_group(key)]
+        return key // self.n_edges, key % self.n_edges
+
+    def _batched_candidates(
+        self, owner, row, col0, col1
+    ) -> typing.Iterator[tuple[np.ndarray, np.ndarray]]:
+        # `_candidates` in batches of about MAX_BATCH_PAIRS; `owner` must be
+        #  sorted, so all runs of a query land in the same batch
+        if not len(owner):
+            return
+        start, stop = self._run_entries(row, col0, col1)
+        weights = np.bincount(owner, 1 + stop - start)
+        run_starts = np.searchsorted(owner, np.arange(len(weights) + 1))
+        for part in _batches(weights):
+            runs = slice(run_starts[part.start], run_starts[part.stop])
+            yield self._candidates(owner[runs], row[runs], col0[runs], col1[runs])
+
+    def _disc_rows(
+        self, x: np.ndarray, y: np.ndarray, inner: np.ndarray, outer: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Cells whose distance from (x, y) is in (inner, outer], as up to two
+        #  runs per grid row: -> (point, row, first column, last column)
+        row0 = self._row(y - outer)
+        n_rows = self._row(y + outer) - row0 + 1
+        point = np.repeat(np.arange(len(x)), n_rows)
+        row = row0[point] + (
+            np.arange(int(n_rows.sum())) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+        )
+        px, inner, outer = x[point], inner[point], outer[point]
+        row_lo = self.origin[1] + row * self.cell_size
+        gap = np.maximum(
+            0, np.maximum(row_lo - y[point], y[point] - row_lo - self.cell_size)
+        )
+
+        def columns(radius):
+            # Columns within `radius` of the point on this row; empty if none
+            half = np.sqrt(np.maximum(radius**2 - gap**2, 0))
+            reached = gap <= radius
+            return (
+                np.where(reached, self._col(px - half), 0),
+                np.where(reached, self._col(px + half), -1),
+            )
+
+        out0, out1 = columns(outer)
+        in0, in1 = columns(inner)
+        hollow = in1 >= in0
+        # Left of the inner run (or the whole outer run), then right of it
+        col0 = np.column_stack([out0, np.where(hollow, in1 + 1, 0)]).ravel()
+        col1 = np.column_stack(
+            [np.where(hollow, in0 - 1, out1), np.where(hollow, out1, -1)]
+        ).ravel()
+        return np.repeat(point, 2), np.repeat(row, 2), col0, col1
+
+    def nearest_edge(
+        self, x: np.ndarray, y: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # -> (distance, edge index, polygon id) of the closest edge per point.
+        #  Searches discs of cells of growing radius around each point; once
+        #  it has found an edge, one more disc of that edge's distance settles it
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        return _in_chunks(self._nearest_edge, x, y)
+
+    def _nearest_edge(
+        self, x: np.ndarray, y: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        distance = np.full(len(x), np.inf)
+        edge = np.full(len(x), -1, dtype=np.int64)
+        if self.n_edges == 0:
+            return distance, edge, edge.copy()
+        # Discs start where they reach the grid, and cover it all past `cover`
+        max_x = self.origin[0] + self.n_x * self.cell_size
+        max_y = self.origin[1] + self.n_y * self.cell_size
+        outside = np.hypot(
+            np.maximum(0, np.maximum(self.origin[0] - x, x - max_x)),
+            np.maximum(0, np.maximum(self.origin[1] - y, y - max_y)),
+        )
+        cover = np.hypot(
+            np.maximum(x - self.origin[0], max_x - x),
+            np.maximum(y - self.origin[1], max_y - y),
+        )
+        todo = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        inner = np.full(len(x), -1.0)
+        outer = outside + self.cell_size
+        while len(todo):
+            for query, cand in self._batched_candidates(
+                *self._disc_rows(x[todo], y[todo], inner[todo], outer[todo])
+            ):
+                point = todo[query]
+                d = _point_segment_distance(
+                    x[point], y[point],
+                    self.x0[cand], self.y0[cand], self.x1[cand], self.y1[cand],
+                )  # fmt: skip
+                # Per point minimum; pairs come grouped by point
+                first = _first_per_group(point)
+                group = np.cumsum(first) - 1
+                is_min = d == np.minimum.reduceat(d, np.flatnonzero(first))[group]
+                best = np.flatnonzero(is_min)
+                best = best[_first_per_group(group[best])]
+                better = d[best] < distance[point[best]]
+                distance[point[best][better]] = d[best][better]
+                edge[point[best][better]] = cand[best][better]
+            # Every edge within `outer` of a point has been tried
+            done = (distance[todo] <= outer[todo]) | (outer[todo] >= cover[todo])
+            todo = todo[~done]
+            radius = outer[todo]
+            inner[todo] = radius
+            outer[todo] = np.where(
+                np.isinf(distance[todo]),
+                radius + np.minimum(radius, MAX_RADIUS_STEP * self.cell_size),
+                distance[todo],
+            )
+        return distance, edge, self.edge_polygon[edge]
+
+    def containing_polygon(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # -> innermost polygon id that contains each point, or -1. Even-odd:
+        #  the polygons containing the point's cell reference point, toggled by
+        #  each edge crossed on the way from it to the point (vertically to the
+        #  point's height, then horizontally), which all lie in that cell
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        return _in_chunks(self._containing_polygon, x, y)
+
+    def _containing_polygon(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        result = np.full(len(x), -1, dtype=np.int64)
+        if self.n_edges == 0:
+            return result
+        cx, cy = self._cell(x, y)
+        ref_x, ref_y = self._reference(cx, cy)
+        n_polygons = len(self._polygon_ids)
+        cell = cy * self.n_x + cx
+        point, entry = _ranges(self._inside_starts[cell], self._inside_starts[cell + 1])
+        toggles = [point * n_polygons + self._cell_inside[entry]]
+        for point, cand in self._batched_candidates(np.arange(len(x)), cy, cx, cx):
+            px, py = x[point], y[point]
+            rx, ry = ref_x[point], ref_y[point]
+            x0, y0 = self.x0[cand], self.y0[cand]
+            x1, y1 = self.x1[cand], self.y1[cand]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+                y_cross = y0 + (rx - x0) * (y1 - y0) / (x1 - x0)
+            vertical = ((x0 > rx) != (x1 > rx)) & ((y_cross < py) != (y_cross < ry))
+            horizontal = ((y0 > py) != (y1 > py)) & ((x_cross < px) != (x_cross < rx))
+            crossed = vertical != horizontal
+            polygon_pos = np.searchsorted(self._polygon_ids, self.edge_polygon[cand])
+            toggles.append(point[crossed] * n_polygons + polygon_pos[crossed])
+        keys = np.sort(np.concatenate(toggles))
+        starts = np.flatnonzero(_first_per_group(keys))
+        n_toggles = np.diff(np.append(starts, len(keys)))
+        inside = keys[starts[n_toggles % 2 == 1]]
+        inside_point = inside // n_polygons
+        inside_polygon = inside % n_polygons
+        order = np.lexsort((self._polygon_area[inside_polygon], inside_point))
+        innermost = order[_first_per_group(inside_point[order])]
+        result[inside_point[innermost]] = self._polygon_ids[inside_polygon[innermost]]
+        return result
+
+    def intersects(
+        self, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray
+    ) -> np.ndarray:
+        # -> id of a polygon each segment (x0, y0)-(x1, y1) touches, or -1.
+        #  For a trajectory: `intersects(x[:-1], y[:-1], x[1:], y[1:])`
+        x0, y0, x1, y1 = (np.asarray(a, dtype=np.float64) for a in (x0, y0, x1, y1))
+        return _in_chunks(self._intersects, x0, y0, x1, y1)
+
+    def _intersects(
+        self, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray
+    ) -> np.ndarray:
+        result = np.full(len(x0), -1, dtype=np.int64)
+        if self.n_edges == 0:
+            return result
+        for segment, cand in self._batched_candidates(
+            *self._segment_rows(x0, y0, x1, y1)
+        ):
+            hit = _segments_intersect(
+                x0[segment], y0[segment], x1[segment], y1[segment],
+                self.x0[cand], self.y0[cand], self.x1[cand], self.y1[cand],
+            )  # fmt: skip
+            result[segment[hit]] = self.edge_polygon[cand[hit]]
+        return result
+
+
+def with_polygon_distances(frames: pl.DataFrame, lev: Lev) -> pl.DataFrame:
+    # Adds, per frame of the kuski position: `wall_distance` and
+    #  `nearest_polygon` (closest ground edge) and `inside_polygon`
+    x = frames["x"].to_numpy()
+    y = frames["y"].to_numpy()
+    distance, _, nearest = lev.spatial_index.nearest_edge(x, y)
+    return frames.with_columns(
+        pl.Series("wall_distance", distance, dtype=pl.Float32),
+        pl.Series("nearest_polygon", nearest, dtype=pl.Int32),
+        pl.Series(
+            "inside_polygon", lev.spatial_index.containing_polygon(x, y), pl.Int32
+        ),
+    )
@@ -0,0 +1,240 @@
+import glob
+import hashlib
+import logging
+import os
+
+import polars as pl
+
+from elma_recplot.elma_loader import (
+    Lev,
+    Rec,
+    empty_lev,
+    empty_rec,
+    load_levs_many,
+    load_recs_many,
+)
+
+logger = logging.getLogger(__name__)
+
+# Store layout: parquet parts per table (one per ingest batch), plus a small index
+#  <store_dir>/index.parquet
+#  <store_dir>/<table>/part-00000.parquet
+REC_TABLES = ("frames", "events")
+LEV_TABLES = ("polygons", "polygons_coords", "objects")
+INDEX_FILE = "index.parquet"
+# Files loaded and written per part by `ingest`; bounds its peak memory
+INGEST_FILES_PER_PART = 256
+INDEX_SCHEMA = {
+    "file_id": pl.String,  # sha256 of the file contents
+    "filename": pl.String,
+    "kind": pl.String,  # "rec" / "lev"
+    "checksum": pl.Int64,  # rec only
+    "level_name": pl.String,  # lev filename a rec was driven on, or the lev's own
+    "title": pl.String,  # lev only
+    "lgr": pl.String,
+    "ground": pl.String,
+    "sky": pl.String,
+    # Set for files that failed to load: they have no table rows, and aren't
+    #  retried since their content (file_id) is the same
+    "error": pl.String,
+}
+
+
+def _sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def read_index(store_dir: str) -> pl.DataFrame:
+    path = os.path.join(store_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return pl.DataFrame(schema=INDEX_SCHEMA)
+    index = pl.read_parquet(path)
+    # Stores written before a column was added lack it
+    return index.with_columns(
+        pl.lit(None, dtype).alias(name)
+        for name, dtype in INDEX_SCHEMA.items()
+        if name not in index.columns
+    ).select(list(INDEX_SCHEMA))
+
+
+def _empty_table(table: str) -> pl.DataFrame:
+    if table in REC_TABLES:
+        empty = getattr(empty_rec(), table)
+    else:
+        empty = getattr(empty_lev(), table)
+    return empty.with_columns(pl.lit(None, pl.String).alias("file_id"))
+
+
+def scan_table(store_dir: str, table: str) -> pl.LazyFrame:
+    # All rows of a table, tagged with `file_id`; join with `read_index` for names
+    if table not in REC_TABLES + LEV_TABLES:
+        raise ValueError(f"Unknown table {table!r}")
+    pattern = os.path.join(store_dir, table, "*.parquet")
+    if not glob.glob(pattern):
+        return _empty_table(table).lazy()
+    return pl.scan_parquet(pattern)
+
+
+def _write_part(store_dir: str, table: str, frames: list[pl.DataFrame]):
+    if not frames:
+        return
+    table_dir = os.path.join(store_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+    part = len(glob.glob(os.path.join(table_dir, "part-*.parquet")))
+    path = os.path.join(table_dir, f"part-{part:05d}.parquet")
+    logger.info(f"Writing {path!r}")
+    pl.concat(frames).write_parquet(path)
+
+
+def _ingest_batch(
+    kind: str,
+    paths: list[str],
+    file_ids: list[str],
+    store_dir: str,
+    workers: int | None,
+) -> list[dict]:
+    # Loads one batch and writes its table parts; -> its new index rows
+    loader = load_recs_many if kind == "rec" else load_levs_many
+    table_names = REC_TABLES if kind == "rec" else LEV_TABLES
+    tables = {table: [] for table in table_names}
+    rows = []
+    for file_id, result in zip(file_ids, loader(paths, workers=workers)):
+        filename = os.path.basename(result.source)
+        if not result.ok:
+            rows.append(
+                {
+                    "file_id": file_id,
+                    "filename": filename,
+                    "kind": kind,
+                    "error": repr(result.error),
+                }
+            )
+            continue
+        tag = pl.lit(file_id).alias("file_id")
+        for table in table_names:
+            tables[table].append(getattr(result.value, table).with_columns(tag))
+        if kind == "rec":
+            rec = result.value
+            rows.append(
+                {
+                    "file_id": file_id,
+                    "filename": filename,
+                    "kind": kind,
+                    "checksum": rec.checksum,
+                    "level_name": rec.lev_name,
+                }
+            )
+        else:
+            lev = result.value
+            rows.append(
+                {
+                    "file_id": file_id,
+                    "filename": filename,
+                    "kind": kind,
+                    "level_name": filename,
+                    "title": lev.name,
+                    "lgr": lev.lgr,
+                    "ground": lev.ground,
+                    "sky": lev.sky,
+                }
+            )
+    for table, frames in tables.items():
+        _write_part(store_dir, table, frames)
+    return rows
+
+
+def ingest(
+    src_dir: str,
+    store_dir: str,
+    workers: int | None = None,
+    files_per_part: int = INGEST_FILES_PER_PART,
+) -> pl.DataFrame:
+    # Add recs/levs under `src_dir` that aren't in the store yet; returns new index
+    #  rows. Files are loaded and written `files_per_part` at a time, so memory
+    #  stays bounded by one batch however many files there are
+    os.makedirs(store_dir, exist_ok=True)
+    index = read_index(store_dir)
+    known = set(index["file_id"])
+
+    paths = {"rec": [], "lev": []}
+    file_ids = {"rec": [], "lev": []}
+    for kind in paths:
+        for path in sorted(glob.glob(os.path.join(src_dir, f"*.{kind}"))):
+            file_id = _sha256(path)
+            if file_id in known:
+                logger.debug(f"Skipping already ingested {path!r}")
+                continue
+            known.add(file_id)
+            paths[kind].append(path)
+            file_ids[kind].append(file_id)
+    logger.info(f"Ingesting {len(paths['rec'])} recs, {len(paths['lev'])} levs")
+
+    new_rows = []
+    for kind in paths:
+        for start in range(0, len(paths[kind]), files_per_part):
+            batch = slice(start, start + files_per_part)
+            new_rows += _ingest_batch(
+                kind, paths[kind][batch], file_ids[kind][batch], store_dir, workers
+            )
+            # Index rewritten after each batch's parts, so an interrupted run
+            #  keeps the batches it finished and never references missing parts
+            new_index = pl.DataFrame(new_rows, schema=INDEX_SCHEMA)
+            pl.concat([index, new_index]).write_parquet(
+                os.path.join(store_dir, INDEX_FILE)
+            )
+
+    new_index = pl.DataFrame(new_rows, schema=INDEX_SCHEMA)
+    failed = new_index.filter(pl.col("error").is_not_null())["filename"].to_list()
+    if failed:
+        shown = ", ".join(failed[:10]) + (", ..." if len(failed) > 10 else "")
+        logger.warning(
+            f"{len(failed)} files failed to load and are recorded with their error "
+            f"in the index: {shown}"
+        )
+    return new_index
+
+
+def _lookup(store_dir: str, kind: str, filename: str) -> dict:
+    matches = read_index(store_dir).filter(
+        (pl.col("kind") == kind)
+        & (pl.col("filename") == filename)
+        & pl.col("error").is_null()
+    )
+    if matches.is_empty():
+        raise KeyError(f"{kind} {filename!r} not in store {store_dir!r}")
+    # Same name ingested twice with different contents: take the latest
+    return matches.row(-1, named=True)
+
+
+def _read_table(store_dir: str, table: str, file_id: str) -> pl.DataFrame:
+    return (
+        scan_table(store_dir, table)
+        .filter(pl.col("file_id") == file_id)
+        .drop("file_id")
+        .collect()
+    )
+
+
+def load_rec_from_store(store_dir: str, filename: str) -> Rec:
+    row = _lookup(store_dir, "rec", filename)
+    return Rec(
+        checksum=row["checksum"],
+        lev_name=row["level_name"],
+        frames=_read_table(store_dir, "frames", row["file_id"]),
+        events=_read_table(store_dir, "events", row["file_id"]),
+    )
+
+
+def load_lev_from_store(store_dir: str, filename: str) -> Lev:
+    row = _lookup(store_dir, "lev", filename)
+    return Lev(
+        name=row["title"],
+        lgr=row["lgr"],
+        ground=row["ground"],
+        sky=row["sky"],
+        polygons=_read_table(store_dir, "polygons", row["file_id"]),
+        polygons_coords=_read_table(store_dir, "polygons_coords", row["file_id"]),
+        objects=_read_table(store_dir, "objects", row["file_id"]),
+        sha256=row["file_id"],
+    )
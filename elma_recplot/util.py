@@ -1,30 +1,33 @@
-import logging.config
+import logging
+import sys
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class _ConsoleHandler(logging.Handler):
+    # stderr; rich on a terminal. The real handler is made on the first
+    #  record, so runs that don't log (`--help`) never import rich
+    def __init__(self):
+        super().__init__()
+        self._handler: logging.Handler | None = None
+
+    def emit(self, record: logging.LogRecord):
+        if self._handler is None:
+            if sys.stderr.isatty():
+                from rich.logging import RichHandler
+
+                self._handler = RichHandler()
+            else:
+                self._handler = logging.StreamHandler()
+                self._handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self._handler.handle(record)
 
 
 def init_logging():
-    logging.config.dictConfig(
-        {
-            "version": 1,
-            "disable_existing_loggers": False,
-            "formatters": {
-                "standard": {
-                    "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-                },
-            },
-            "handlers": {
-                "file_handler": {
-                    "class": "logging.FileHandler",
-                    "formatter": "standard",
-                    "filename": "elma_recplot.log",
-                },
-                "console_handler": {
-                    "class": "rich.logging.RichHandler",
-                    "level": "DEBUG",
-                },
-            },
-            "root": {
-                "handlers": ["file_handler", "console_handler"],
-                "level": "DEBUG",
-            },
-        }
+    # Plain `logging` rather than dictConfig, which imports logging.handlers and
+    #  socket. The log file is opened on first use, the console handler too
+    file_handler = logging.FileHandler("elma_recplot.log", delay=True)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.basicConfig(
+        level=logging.DEBUG, handlers=[file_handler, _ConsoleHandler()], force=True
     )
@@ -0,0 +1,328 @@
+import functools
+import logging
+import os
+import struct
+import typing
+from dataclasses import dataclass, field
+
+import numpy as np
+import polars as pl
+
+from elma_recplot import profiling
+from elma_recplot.elma_loader import (
+    FRAME_RATE,
+    LEV_HEADER_FORMAT_STR,
+    LEV_HEADER_SIZE,
+    LEV_INTEGRITY_FORMAT_STR,
+    LEV_INTEGRITY_OFFSET,
+    LEV_ITEM_COUNT_SUBTRAHEND,
+    LEV_OBJECT_DTYPE,
+    LEV_VERSION,
+    MAGIC_TIME_SCALER,
+    POLY_HEADER_SIZE,
+    POLY_VERTEX_SIZE,
+    REC_END_MARKER,
+    REC_EVENT_DTYPE,
+    REC_FRAME_SIZE,
+    REC_HEADER_FORMAT_STR,
+    REC_HEADER_SIZE,
+    ROT_FULL_TURN,
+    EventType,
+    ObjType,
+    decode_rec_lev_name,
+    frame_columns_from_block,
+    load_many,
+    scan_polygon_headers,
+)
+
+logger = logging.getLogger(__name__)
+
+# Checks run on the raw file bytes: header counts against the file length, then
+#  vectorized range checks over zero-copy views of the columns. Nothing is
+#  decoded into DataFrames, so a directory is checked at about read speed
+
+# Elma stores integrity sum i (i > 0) as a random value in [low, low + span)
+#  minus sum 0. Sum 2 uses the second range for levels with topology errors
+LEV_INTEGRITY_RANGES = (
+    ((11_877, 5_871),),
+    ((12_112, 6_102), (20_961, 4_982)),
+    ((23_090, 6_310),),
+)
+REC_MULTI_OFFSET = struct.calcsize("I I")
+# How far the bike's centre may be outside the bounding box of the polygons
+REC_POSITION_MARGIN = 5.0  # world units
+EVENT_TYPES = np.array([event_type.value for event_type in EventType])
+OBJ_TYPES = np.array([obj_type.value for obj_type in ObjType])
+STATUS_SCHEMA = {
+    "file": pl.String,
+    "kind": pl.String,  # "rec" / "lev"
+    "ok": pl.Boolean,
+    "problems": pl.String,  # "; "-separated
+    "lev_name": pl.String,  # rec only: lev it was driven on
+    "link": pl.Int64,  # rec: its checksum; lev: the link recs are checked against
+    "lev_checked": pl.Boolean,  # rec only: whether its lev was among the files
+}
+
+Bounds = tuple[float, float, float, float]  # x_min, x_max, y_min, y_max
+
+
+@dataclass
+class FileStatus:
+    kind: str
+    problems: list[str] = field(default_factory=list)
+    lev_name: str | None = None
+    link: int | None = None
+    lev_checked: bool = False
+    bounds: Bounds | None = None  # lev only; in the loaded (flipped y) coordinates
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+
+def _item_count(raw: float) -> int | None:
+    # Lev counts are stored as float + LEV_ITEM_COUNT_SUBTRAHEND
+    count = raw - LEV_ITEM_COUNT_SUBTRAHEND
+    if not np.isfinite(count) or count < 0 or abs(count - round(count)) > 1e-6:
+        return None
+    return round(count)
+
+
+def _integrity_problems(integrity: tuple[float, ...]) -> list[str]:
+    if not np.isfinite(integrity).all():
+        return ["non-finite integrity sums"]
+    problems = []
+    for i, ranges in enumerate(LEV_INTEGRITY_RANGES, start=1):
+        value = integrity[i] + integrity[0]
+        if not any(low - 1e-3 <= value <= low + span + 1e-3 for low, span in ranges):
+            problems.append(f"integrity sum {i} out of range")
+    return problems
+
+
+def _frame_problems(columns: dict[str, np.ndarray], bounds: Bounds | None) -> list:
+    problems = []
+    x, y = columns["x"], columns["y"]
+    if not (np.isfinite(x).all() and np.isfinite(y).all()):
+        problems.append("non-finite bike positions")
+    elif bounds is not None:
+        x_min, x_max, y_min, y_max = bounds
+        margin = REC_POSITION_MARGIN
+        outside = (
+            (x < x_min - margin)
+            | (x > x_max + margin)
+            | (y < y_min - margin)
+            | (y > y_max + margin)
+        )
+        if outside.any():
+            problems.append(f"{np.count_nonzero(outside)} frames outside the level")
+    rot = columns["rot"]
+    n_bad_rot = np.count_nonzero((rot < 0) | (rot > ROT_FULL_TURN))
+    if n_bad_rot:
+        problems.append(f"{n_bad_rot} frames with rotation out of range")
+    return problems
+
+
+def _event_problems(events: np.ndarray, n_frames: int) -> list[str]:
+    problems = []
+    t = events["timestamp"] * MAGIC_TIME_SCALER
+    if not np.isfinite(t).all():
+        problems.append("non-finite event times")
+    elif len(t):
+        if t[0] < 0:
+            problems.append("negative event times")
+        if (np.diff(t) < 0).any():
+            problems.append("event times out of order")
+        # One frame of slack: the finish can fall between the last two frames
+        if t[-1] > (n_frames + 1) / FRAME_RATE:
+            problems.append("events after the last frame")
+    n_unknown = np.count_nonzero(~np.isin(events["event_type"], EVENT_TYPES))
+    if n_unknown:
+        problems.append(f"{n_unknown} events of unknown type")
+    return problems
+
+
+def _check_rec_part(
+    data: memoryview, offset: int, bounds: Bounds | None, problems: list[str]
+) -> int | None:
+    # One player's part of a rec, starting at `offset`; -> offset after it, or
+    #  None if the file ends early
+    if len(data) < offset + REC_HEADER_SIZE:
+        problems.append(f"truncated header at byte {offset}")
+        return None
+    (n_frames,) = struct.unpack_from("I", data, offset)
+    frames_start = offset + REC_HEADER_SIZE
+    events_start = frames_start + REC_FRAME_SIZE * n_frames + 4
+    if len(data) < events_start:
+        held = max(0, len(data) - frames_start) // REC_FRAME_SIZE
+        problems.append(f"truncated frames: header says {n_frames}, file holds {held}")
+        return None
+    (n_events,) = struct.unpack_from("I", data, events_start - 4)
+    end = events_start + REC_EVENT_DTYPE.itemsize * n_events
+    if len(data) < end:
+        held = (len(data) - events_start) // REC_EVENT_DTYPE.itemsize
+        problems.append(f"truncated events: file says {n_events}, holds {held}")
+        return None
+    if n_frames == 0:
+        problems.append("no frames")
+    columns = frame_columns_from_block(data[frames_start : events_start - 4], n_frames)
+    problems.extend(_frame_problems(columns, bounds))
+    events = np.frombuffer(data, REC_EVENT_DTYPE, count=n_events, offset=events_start)
+    problems.extend(_event_problems(events, n_frames))
+    if len(data) < end + 4 or struct.unpack_from("I", data, end)[0] != REC_END_MARKER:
+        problems.append(f"no end marker after the events at byte {end}")
+        return end
+    return end + 4
+
+
+@profiling.timed("validate_rec")
+def check_rec(
+    data: bytes | memoryview, levs: typing.Mapping[str, FileStatus] | None = None
+) -> FileStatus:
+    # `levs`: `check_lev` results by lower-case file name. A rec whose lev is
+    #  among them is checked against its link and bounds
+    data = memoryview(data).cast("B")
+    if len(data) < REC_HEADER_SIZE:
+        return FileStatus("rec", [f"truncated header: {len(data)} bytes"])
+    _, link, raw_lev_name = struct.unpack_from(REC_HEADER_FORMAT_STR, data)
+    status = FileStatus("rec", lev_name=decode_rec_lev_name(raw_lev_name), link=link)
+    lev = (levs or {}).get(status.lev_name.lower())
+    if lev is not None:
+        status.lev_checked = True
+        if lev.link != link:
+            status.problems.append(
+                f"checksum {link} doesn't match {status.lev_name}'s link {lev.link}"
+            )
+    (multi,) = struct.unpack_from("I", data, REC_MULTI_OFFSET)
+    offset: int | None = 0
+    for _ in range(2 if multi else 1):
+        offset = _check_rec_part(data, offset, lev and lev.bounds, status.problems)
+        if offset is None:
+            break
+    else:
+        if offset < len(data):
+            status.problems.append(f"{len(data) - offset} unexpected trailing bytes")
+    return status
+
+
+@profiling.timed("validate_lev")
+def check_lev(data: bytes | memoryview) -> FileStatus:
+    data = memoryview(data).cast("B")
+    if len(data) < LEV_HEADER_SIZE:
+        return FileStatus("lev", [f"truncated header: {len(data)} bytes"])
+    version, link, *_, raw_n_polygons = struct.unpack_from(LEV_HEADER_FORMAT_STR, data)
+    status = FileStatus("lev", link=link)
+    if version != LEV_VERSION:
+        status.problems.append(f"unsupported version {version!r}")
+        return status
+    status.problems.extend(
+        _integrity_problems(
+            struct.unpack_from(LEV_INTEGRITY_FORMAT_STR, data, LEV_INTEGRITY_OFFSET)
+        )
+    )
+
+    body = data[LEV_HEADER_SIZE:]
+    n_polygons = _item_count(raw_n_polygons)
+    if n_polygons is None or n_polygons * POLY_HEADER_SIZE > len(body):
+        status.problems.append(f"bad polygon count {raw_n_polygons!r}")
+        return status
+    try:
+        header_offsets, headers = scan_polygon_headers(body, n_polygons)
+    except struct.error:
+        status.problems.append("truncated polygons")
+        return status
+    n_vertices = headers[:, 1]
+    polys_end = int(
+        np.sum(POLY_HEADER_SIZE + POLY_VERTEX_SIZE * n_vertices, dtype=np.int64)
+    )
+    if len(body) < polys_end + 8:
+        status.problems.append("truncated polygons")
+        return status
+    n_small = np.count_nonzero(n_vertices < 3)
+    if n_small:
+        status.problems.append(f"{n_small} polygons with fewer than 3 vertices")
+    slots = np.frombuffer(body, dtype=np.float64, count=polys_end // 8)
+    is_vertex = np.ones(len(slots), dtype=bool)
+    is_vertex[header_offsets // 8] = False
+    coords = slots[is_vertex].reshape(-1, 2)
+    if not np.isfinite(coords).all():
+        status.problems.append("non-finite polygon vertices")
+    elif len(coords):
+        # Same y flip as `load_lev`, so that bounds compare with rec positions
+        status.bounds = (
+            float(coords[:, 0].min()),
+            float(coords[:, 0].max()),
+            float(-coords[:, 1].max()),
+            float(-coords[:, 1].min()),
+        )
+
+    (raw_n_objects,) = struct.unpack_from("d", body, polys_end)
+    n_objects = _item_count(raw_n_objects)
+    objects_start = polys_end + 8
+    if n_objects is None:
+        status.problems.append(f"bad object count {raw_n_objects!r}")
+        return status
+    if len(body) < objects_start + LEV_OBJECT_DTYPE.itemsize * n_objects:
+        status.problems.append("truncated objects")
+        return status
+    objects = np.frombuffer(
+        body, dtype=LEV_OBJECT_DTYPE, count=n_objects, offset=objects_start
+    )
+    types = objects["object_type"]
+    if not (np.isfinite(objects["x"]).all() and np.isfinite(objects["y"]).all()):
+        status.problems.append("non-finite object positions")
+    n_unknown = np.count_nonzero(~np.isin(types, OBJ_TYPES))
+    if n_unknown:
+        status.problems.append(f"{n_unknown} objects of unknown type")
+    n_players = np.count_nonzero(types == ObjType.PLAYER.value)
+    if n_players != 1:
+        status.problems.append(f"{n_players} start positions")
+    if not (types == ObjType.EXIT.value).any():
+        status.problems.append("no exit")
+    return status
+
+
+def _check_file(checker: typing.Callable[..., FileStatus], f, **kwargs) -> FileStatus:
+    return checker(f.read(), **kwargs)
+
+
+def validate_many(
+    paths: typing.Sequence[str], workers: int | None = None
+) -> pl.DataFrame:
+    # One row per file, see STATUS_SCHEMA. Levs are checked first, so that recs
+    #  of levs among `paths` are checked against them
+    lev_paths = [path for path in paths if path.lower().endswith(".lev")]
+    rec_paths = [path for path in paths if not path.lower().endswith(".lev")]
+    lev_results = load_many(
+        functools.partial(_check_file, check_lev), lev_paths, workers, "process"
+    )
+    levs = {
+        os.path.basename(result.source).lower(): result.value
+        for result in lev_results
+        if result.ok and result.value.link is not None
+    }
+    rec_results = load_many(
+        functools.partial(_check_file, check_rec, levs=levs),
+        rec_paths,
+        workers,
+        "process",
+    )
+
+    rows = []
+    for kind, results in (("lev", lev_results), ("rec", rec_results)):
+        for result in results:
+            status = result.value or FileStatus(kind, [repr(result.error)])
+            rows.append(
+                {
+                    "file": result.source,
+                    "kind": kind,
+                    "ok": status.ok,
+                    "problems": "; ".join(status.problems),
+                    "lev_name": status.lev_name,
+                    "link": status.link,
+                    "lev_checked": status.lev_checked if kind == "rec" else None,
+                }
+            )
+    statuses = pl.DataFrame(rows, schema=STATUS_SCHEMA)
+    n_bad = statuses.filter(~pl.col("ok")).height
+    logger.info(f"Validated {len(statuses)} files, {n_bad} with problems")
+    return statuses
@@ -0,0 +1,141 @@
+import math
+
+import numpy as np
+import polars as pl
+import pytest
+from synthetic import make_rec
+
+from elma_recplot.analysis import (
+    MIN_AIR_GAP,
+    ROT_FULL_TURN,
+    apple_splits,
+    summarize,
+    summarize_many,
+    with_airtime,
+    with_motion,
+)
+from elma_recplot.elma_loader import BufferReader, EventType, Rec, load_rec
+
+FPS = 30
+N_FRAMES = 90
+GROUND_TOUCHES = [0.25, 0.45, 1.55, 1.75]
+APPLES = [0.5, 1.25, 2.0]
+# 100 units per frame, passing the 0/ROT_FULL_TURN wrap at frame 10
+ANGULAR_VELOCITY = 100 * FPS * 2 * math.pi / ROT_FULL_TURN
+
+
+def _known_rec(n_frames: int = N_FRAMES, vx: float = 2.0, compact=False) -> Rec:
+    # x at constant speed `vx`, y at constant acceleration 1, steady rotation
+    rec = load_rec(BufferReader(make_rec(n_frames, 1)), compact=compact)
+    t = np.arange(n_frames) / FPS
+    frames = rec.frames.with_columns(
+        pl.Series("x", vx * t, pl.Float32),
+        pl.Series("y", 0.5 * t**2, pl.Float32),
+        pl.Series("rot", (9_000 + 100 * np.arange(n_frames)) % ROT_FULL_TURN, pl.Int16),
+    )
+    times = [*GROUND_TOUCHES, *APPLES, 2.5]
+    types = [EventType.GROUND] * len(GROUND_TOUCHES) + [EventType.APPLE] * len(APPLES)
+    types.append(EventType.VOLT_LEFT)
+    events = pl.DataFrame(
+        {
+            "timestamp": times,
+            "event_type": [event_type.value for event_type in types],
+        },
+        schema={"timestamp": pl.Float64, "event_type": pl.UInt8},
+    ).sort("timestamp")
+    return Rec(checksum=0, lev_name="SYNTH.lev", frames=frames, events=events)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_with_motion(compact):
+    motion = with_motion(_known_rec(compact=compact).frames)
+    t = np.arange(N_FRAMES) / FPS
+    assert motion["vx"][0] is None
+    assert motion["ax"][1] is None
+    np.testing.assert_allclose(motion["vx"][1:], 2.0, rtol=1e-4)
+    # Backward differences of y = t²/2
+    np.testing.assert_allclose(motion["vy"][1:], t[1:] - 0.5 / FPS, atol=1e-4)
+    np.testing.assert_allclose(motion["ax"][2:], 0.0, atol=1e-2)
+    np.testing.assert_allclose(motion["ay"][2:], 1.0, atol=1e-2)
+    np.testing.assert_allclose(
+        motion["speed"][1:], np.hypot(motion["vx"][1:], motion["vy"][1:]), rtol=1e-6
+    )
+    np.testing.assert_allclose(
+        motion["angular_velocity"][1:], ANGULAR_VELOCITY, rtol=1e-4
+    )
+
+
+def test_with_airtime():
+    rec = _known_rec()
+    airborne = with_airtime(rec.frames, rec.events)["airborne"].to_numpy()
+    # Only the gap between the 2nd and 3rd touch is long enough
+    assert GROUND_TOUCHES[2] - GROUND_TOUCHES[1] >= MIN_AIR_GAP
+    t = np.arange(N_FRAMES) / FPS
+    expected = (t >= GROUND_TOUCHES[1]) & (t < GROUND_TOUCHES[2])
+    np.testing.assert_array_equal(airborne, expected)
+
+
+def test_with_airtime_by_rec(recwarn):
+    rec = _known_rec()
+    single = with_airtime(rec.frames, rec.events)["airborne"]
+    frames, events = (
+        pl.concat(
+            [
+                table.with_columns(pl.lit(rec_id, pl.UInt32).alias("rec_id"))
+                for rec_id in (1, 0)
+            ]
+        )
+        for table in (rec.frames, rec.events)
+    )
+    airborne = with_airtime(frames, events, by="rec_id")["airborne"]
+    assert airborne.to_list() == 2 * single.to_list()
+    # polars can't check sortedness within `by` groups and would warn
+    assert not recwarn.list
+
+
+def test_apple_splits():
+    splits = apple_splits(_known_rec().events)
+    assert splits["apple"].to_list() == [1, 2, 3]
+    assert splits["t"].to_list() == APPLES
+    np.testing.assert_allclose(splits["split"], [0.5, 0.75, 0.75])
+
+
+def test_summarize_many():
+    recs = [_known_rec(), _known_rec(n_frames=60, vx=4.0)]
+    # The second rec has no events: its stats are zero/null
+    recs[1].events = recs[1].events.clear()
+    frames = pl.concat(
+        rec.frames.with_columns(pl.lit(i, pl.UInt32).alias("rec_id"))
+        for i, rec in enumerate(recs)
+    )
+    events = pl.concat(
+        rec.events.with_columns(pl.lit(i, pl.UInt32).alias("rec_id"))
+        for i, rec in enumerate(recs)
+    )
+    stats = summarize_many(frames, events).rows_by_key("rec_id", named=True)
+    first, second = stats[0][0], stats[1][0]
+
+    assert first["n_frames"] == 90
+    assert first["duration"] == pytest.approx(89 / FPS)
+    t = np.arange(N_FRAMES) / FPS
+    distance = np.hypot(np.diff(2 * t), np.diff(0.5 * t**2)).sum()
+    assert first["distance"] == pytest.approx(distance, rel=1e-4)
+    assert first["max_angular_velocity"] == pytest.approx(ANGULAR_VELOCITY, rel=1e-4)
+    assert first["max_acceleration"] == pytest.approx(1.0, abs=1e-2)
+    assert (first["n_apples"], first["n_ground_touches"]) == (3, 4)
+    assert (first["n_volts"], first["n_turns"]) == (1, 0)
+    airtime = GROUND_TOUCHES[2] - GROUND_TOUCHES[1]
+    assert first["airtime"] == pytest.approx(airtime, rel=1e-5)
+    assert first["max_airtime"] == pytest.approx(airtime, rel=1e-5)
+
+    # Per-rec t and differences: the second rec's first frame isn't a step
+    #  from the first rec's last one
+    assert second["n_frames"] == 60
+    assert second["duration"] == pytest.approx(59 / FPS)
+    assert second["max_speed"] == pytest.approx(np.hypot(4.0, 59 / FPS - 0.5 / FPS))
+    assert (second["n_apples"], second["airtime"]) == (0, 0)
+    assert second["max_airtime"] is None
+
+    assert summarize(recs[0]) == pytest.approx(
+        {key: value for key, value in first.items() if key != "rec_id"}
+    )
@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from elma_recplot.blob_store import STORE_FILE, BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"), max_bytes=None)
+    for i in range(4):
+        store.put("rec", i, f"{i}.rec", bytes([i]) * 100)
+    return store
+
+
+def _keys(store: BlobStore) -> list[str]:
+    return [key for (key,) in store.db.execute("SELECT id FROM entries ORDER BY id")]
+
+
+def _stored(store: BlobStore, sha256: str) -> bool:
+    try:
+        store.read(sha256)
+    except KeyError:
+        return False
+    return True
+
+
+def test_gc_evicts_least_recently_used(store):
+    shas = [store.lookup("rec", i, f"{i}.rec") for i in (2, 3, 0, 1)]
+    assert store.gc(max_bytes=250) == 200
+    assert _keys(store) == ["0", "1"]
+    assert not _stored(store, shas[0])
+    assert _stored(store, shas[2])
+    # All in the one file, next to its WAL
+    assert {name.split("-")[0] for name in os.listdir(store.store_dir)} == {STORE_FILE}
+
+
+def test_gc_keeps_pinned(store):
+    pinned = store.lookup("rec", 0, "0.rec", pin=True)
+    assert store.gc(max_bytes=0) == 300
+    assert _keys(store) == ["0"]
+    assert bytes(store.read(pinned)) == bytes([0]) * 100
+
+    store.unpin(pinned)
+    assert store.gc(max_bytes=0) == 100
+    assert not _stored(store, pinned)
+
+
+_PIN_SCRIPT = """
+import sys
+from elma_recplot.blob_store import BlobStore
+
+BlobStore(sys.argv[1]).lookup("rec", 0, "0.rec", pin=True)
+print("pinned", flush=True)
+sys.stdin.read()
+"""
+
+
+def test_gc_keeps_pins_of_other_processes(store):
+    # As `cache gc` run while a page is being made
+    pinner = subprocess.Popen(
+        [sys.executable, "-c", _PIN_SCRIPT, store.store_dir],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert pinner.stdout.readline() == "pinned\n"
+        assert BlobStore(store.store_dir).gc(max_bytes=0) == 300
+        assert _keys(store) == ["0"]
+    finally:
+        pinner.communicate("")
+    # Pins of exited processes don't count
+    assert BlobStore(store.store_dir).gc(max_bytes=0) == 100
+    assert not store.db.execute("SELECT * FROM pins").fetchall()
+
+
+def test_put_gc_keeps_pinned(tmp_path):
+    # gc run by put, as when a download lands while earlier ones wait to render
+    store = BlobStore(str(tmp_path / "blobs"), max_bytes=150)
+    pinned = store.put("lev", 1, "", b"l" * 100, pin=True)
+    store.put("rec", 1, "1.rec", b"r" * 100)
+    assert bytes(store.read(pinned)) == b"l" * 100
+
+
+class _FailingDb:
+    # Passes through to the connection, fails on evicting an entry
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, sql, *args):
+        if sql.startswith("DELETE FROM entries"):
+            raise RuntimeError("disk on fire")
+        return self.db.execute(sql, *args)
+
+
+def test_gc_rolls_back_on_error(store):
+    shas = [store.lookup("rec", i, f"{i}.rec") for i in range(4)]
+    db = store.db
+    store._db = _FailingDb(db)
+    with pytest.raises(RuntimeError):
+        store.gc(max_bytes=0)
+    store._db = db
+    assert not db.in_transaction
+    assert all(_stored(store, sha256) for sha256 in shas)
+    assert store.total_bytes() == 400
+    assert store.gc(max_bytes=0) == 400
@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from click.testing import CliRunner
+from synthetic import make_lev, make_rec
+
+pty = pytest.importorskip("pty")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loaded only by commands that do work
+HEAVY_MODULES = ("rich", "plotly", "polars")
+# Runs the CLI, then prints which heavy modules it imported
+_PROBE = """
+import json, runpy, sys
+sys.argv = ["elma_recplot", *sys.argv[1:]]
+try:
+    runpy.run_module("elma_recplot", run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps(sorted(m for m in {heavy!r} if m in sys.modules)))
+"""
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--help"],
+        ["plot-rec", "--help"],
+        ["cache", "stats", "--help"],
+        ["layer-cache", "prune", "--help"],
+    ],
+)
+def test_help_skips_heavy_imports(tmp_path, args):
+    # stderr on a terminal, where logging goes through rich
+    master, slave = pty.openpty()
+    try:
+        result = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(heavy=HEAVY_MODULES), *args],
+            stdout=subprocess.PIPE,
+            stderr=slave,
+            text=True,
+            cwd=tmp_path,
+            env={**os.environ, "PYTHONPATH": REPO_DIR},
+            check=True,
+        )
+    finally:
+        os.close(slave)
+        os.close(master)
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+
+
+# Prints the modules a CLI run imported, of this package and the dependencies
+_IMPORTS_PROBE = """
+import json, runpy, sys
+sys.argv = ["elma_recplot", *sys.argv[1:]]
+try:
+    runpy.run_module("elma_recplot", run_name="__main__")
+except SystemExit:
+    pass
+packages = {"elma_recplot", "numpy", "pandas", "requests", "urllib3", *HEAVY}
+print(json.dumps(sorted(m for m in sys.modules if m.split(".")[0] in packages)))
+""".replace("HEAVY", repr(HEAVY_MODULES))
+
+
+def test_get_lev_help_imports(tmp_path):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", _IMPORTS_PROBE, "get-lev", "--help"],
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": REPO_DIR},
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+    assert "--outfile" in result.stdout
+    assert json.loads(result.stdout.splitlines()[-1]) == [
+        "elma_recplot",
+        "elma_recplot.defaults",
+        "elma_recplot.util",
+    ]
+    # Loose, for slow CI machines; about 0.2 s locally
+    assert elapsed < 3.0
+
+
+def test_plot_recs(tmp_path, monkeypatch):
+    from elma_recplot.__main__ import cli
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "SYNTH.lev").write_bytes(make_lev(4, 5, 3))
+    for name, n_frames in (("a.rec", 40), ("b.rec", 60)):
+        (tmp_path / name).write_bytes(make_rec(n_frames, 3, seed=n_frames))
+    args = ["plot-recs", "SYNTH.lev", "a.rec", "b.rec", "--outfile", "out.html"]
+
+    result = CliRunner().invoke(cli, [*args, "--reference", "1"])
+    assert result.exit_code == 0, result.output
+    page = (tmp_path / "out.html").read_text()
+    assert page.count("Plotly.newPlot") == 2
+    # Both recs on the map; the delta of a.rec against b.rec on the timeline
+    assert '"name":"a.rec"' in page and '"name":"b.rec"' in page
+    assert "t a.rec" in page and "t b.rec" not in page
+
+    result = CliRunner().invoke(cli, [*args, "--reference", "2"])
+    assert result.exit_code == 2
+    assert "must be below the number of recs (2)" in result.output
@@ -0,0 +1,55 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from elma_recplot.compare import progress, resample_progress, time_deltas
+from elma_recplot.elma_loader import FRAME_RATE, Rec, empty_rec
+
+
+def _straight_rec(n_frames: int) -> Rec:
+    # From x = 0 to 10 at constant speed, in `n_frames` frames
+    frames = pl.DataFrame(
+        {
+            "x": np.linspace(0.0, 10.0, n_frames),
+            "y": np.zeros(n_frames),
+            "t": np.arange(n_frames) / FRAME_RATE,
+        }
+    )
+    return Rec(checksum=0, lev_name="", frames=frames, events=empty_rec().events)
+
+
+def test_progress():
+    p = progress(_straight_rec(11).frames)
+    np.testing.assert_allclose(p, np.linspace(0.0, 1.0, 11))
+    # Standing still: no progress rather than division by zero
+    still = pl.DataFrame({"x": [1.0, 1.0], "y": [2.0, 2.0]})
+    np.testing.assert_array_equal(progress(still), [0.0, 0.0])
+
+
+def test_resample_progress():
+    rec = _straight_rec(31)
+    resampled = resample_progress(rec.frames, np.array([0.0, 0.5, 1.0]))
+    np.testing.assert_allclose(resampled["x"], [0.0, 5.0, 10.0])
+    np.testing.assert_allclose(resampled["t"], [0.0, 0.5, 1.0])
+
+
+def test_time_deltas():
+    # Same path at half the speed, and a rec without frames
+    recs = [_straight_rec(31), _straight_rec(61), _straight_rec(0)]
+    deltas = time_deltas(recs, n_points=50)
+    assert deltas.schema == {"rec": pl.UInt32, "t": pl.Float64, "delta": pl.Float64}
+    assert deltas["rec"].unique().to_list() == [1]
+    # Twice as slow: as far behind as the reference has been going
+    np.testing.assert_allclose(deltas["delta"], deltas["t"], atol=1e-9)
+    assert deltas["delta"][-1] == pytest.approx(1.0)
+
+    reverse = time_deltas(recs, reference=1, n_points=50)
+    np.testing.assert_allclose(reverse["delta"], -reverse["t"] / 2, atol=1e-9)
+
+
+def test_time_deltas_single_rec():
+    deltas = time_deltas([_straight_rec(10)])
+    assert deltas.is_empty()
+    assert deltas.schema == {"rec": pl.UInt32, "t": pl.Float64, "delta": pl.Float64}
+    with pytest.raises(ValueError, match="no frames"):
+        time_deltas([_straight_rec(10), _straight_rec(0)], reference=1)
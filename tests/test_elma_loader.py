@@ -0,0 +1,276 @@
+import io
+import struct
+
+import polars as pl
+import previous_loaders
+import pytest
+from polars.testing import assert_frame_equal
+from synthetic import make_lev, make_rec
+
+from elma_recplot.elma_loader import (
+    FRAME_COLUMNS,
+    FRAME_RATE,
+    LEV_HEADER_SIZE,
+    POLY_HEADER_SIZE,
+    POLY_VERTEX_SIZE,
+    REC_EVENT_DTYPE,
+    REC_FRAME_SIZE,
+    REC_HEADER_SIZE,
+    REC_VERSION,
+    BufferReader,
+    LevCache,
+    concat_rec_events,
+    concat_rec_frames,
+    dump_lev,
+    dump_rec,
+    empty_lev,
+    empty_rec,
+    expand_frames,
+    first_roundtrip_mismatch,
+    frame_expr,
+    idle_prefix_length,
+    iter_rec_frames,
+    load_lev,
+    load_rec,
+    load_recs_many,
+    scan_polygon_headers,
+    slice_rec,
+    splice_recs,
+    trim_idle_prefix,
+)
+
+
+def _with_rec_id(df: pl.DataFrame) -> pl.DataFrame:
+    return df.with_columns(pl.lit(0, pl.UInt32).alias("rec_id"))
+
+
+def test_concat_rec_tables_tags_rec_id(tmp_path):
+    broken = tmp_path / "broken.rec"
+    broken.write_bytes(b"\0\0")
+    good = tmp_path / "good.rec"
+    good.write_bytes(make_rec(10, 3))
+    results = load_recs_many([good, broken, good], workers=1)
+    assert [result.ok for result in results] == [True, False, True]
+    frames = concat_rec_frames(results)
+    assert frames["rec_id"].unique().sort().to_list() == [0, 2]
+    assert len(frames) == 20
+    assert len(concat_rec_events(results)) == 6
+
+
+def test_concat_rec_tables_all_failed(tmp_path):
+    broken = tmp_path / "broken.rec"
+    broken.write_bytes(b"\0\0")
+    results = load_recs_many([broken], workers=1)
+    assert not results[0].ok
+    rec = load_rec(BufferReader(make_rec(10, 3)))
+
+    frames = concat_rec_frames(results)
+    assert frames.is_empty()
+    assert frames.schema == _with_rec_id(rec.frames).schema
+    events = concat_rec_events(results)
+    assert events.is_empty()
+    assert events.schema == _with_rec_id(rec.events).schema
+
+
+def test_idle_prefix_needs_columns():
+    rec = load_rec(BufferReader(make_rec(30, 2)), columns=("x", "y", "t"))
+    with pytest.raises(ValueError, match="dir_and_throttle"):
+        idle_prefix_length(rec.frames)
+    with pytest.raises(ValueError, match="dir_and_throttle"):
+        trim_idle_prefix(rec)
+
+
+def test_idle_prefix_length():
+    rec = load_rec(BufferReader(make_rec(30, 2)), compact=True)
+    idle = pl.Series([True] * 10 + [False] * 20)
+    frames = rec.frames.with_columns(
+        pl.when(idle).then(pl.col("x").first()).otherwise(pl.col("x")).alias("x"),
+        pl.when(idle).then(pl.col("y").first()).otherwise(pl.col("y")).alias("y"),
+        pl.when(idle).then(0).otherwise(1).cast(pl.Int8).alias("dir_and_throttle"),
+    )
+    assert idle_prefix_length(frames) == 10
+
+
+def test_dump_new_rec_header():
+    data = dump_rec(empty_rec())
+    assert struct.unpack_from("I I", data) == (0, REC_VERSION)
+
+
+def test_expand_frames_by_rec(tmp_path):
+    path = tmp_path / "a.rec"
+    path.write_bytes(make_rec(10, 3))
+    results = load_recs_many([path, path], workers=1, compact=True)
+    frames = concat_rec_frames(results)
+    t = load_rec(BufferReader(make_rec(10, 3))).frames["t"]
+    expanded = expand_frames(frames, by="rec_id")
+    assert expanded["t"].to_list() == 2 * t.to_list()
+    assert frames.select(frame_expr("t", by="rec_id"))["t"].to_list() == pytest.approx(
+        2 * t.to_list()
+    )
+
+
+@pytest.mark.parametrize(
+    "kind, data",
+    [
+        ("rec", make_rec(100, 20)),
+        ("rec", make_rec(0, 0)),
+        ("lev", make_lev(10, 8, 5)),
+        ("lev", make_lev(1, 3, 2) + b"trailer"),
+    ],
+)
+def test_roundtrip_is_byte_exact(kind, data):
+    loader, dumper = (load_rec, dump_rec) if kind == "rec" else (load_lev, dump_lev)
+    loaded = loader(BufferReader(data))
+    dumped = dumper(loaded)
+    assert dumped == data
+    again = loader(BufferReader(dumped))
+    for table in ("frames", "events") if kind == "rec" else ("polygons", "objects"):
+        assert getattr(again, table).equals(getattr(loaded, table))
+    assert first_roundtrip_mismatch(data, kind) is None
+
+
+def test_first_roundtrip_mismatch():
+    # `is_grass` is read as a bool, so a first polygon flag of 2 is written as 1
+    data = bytearray(make_lev(3, 4, 2))
+    struct.pack_into("<I", data, LEV_HEADER_SIZE, 2)
+    assert first_roundtrip_mismatch(bytes(data), "lev") == LEV_HEADER_SIZE
+
+
+def test_dump_new_lev():
+    lev = load_lev(BufferReader(make_lev(4, 5, 3)))
+    new = empty_lev()
+    new.name, new.lgr = lev.name, lev.lgr
+    new.polygons, new.polygons_coords = lev.polygons, lev.polygons_coords
+    new.objects = lev.objects.reverse()
+    loaded = load_lev(BufferReader(dump_lev(new)))
+    assert loaded.name == lev.name
+    assert loaded.polygons.equals(lev.polygons)
+    assert loaded.polygons_coords.equals(lev.polygons_coords)
+    assert loaded.objects.equals(new.objects)
+
+
+def test_events_are_public_columns_only():
+    rec = load_rec(BufferReader(make_rec(10, 3)))
+    assert rec.events.columns == list(REC_EVENT_DTYPE.names)
+
+
+def test_slice_and_splice_shift_events():
+    rec = load_rec(BufferReader(make_rec(90, 30)))
+    head, tail = slice_rec(rec, 0, 40), slice_rec(rec, 40)
+    timestamps = rec.events["timestamp"]
+    split = (timestamps < 40 / FRAME_RATE).sum()
+    assert len(head.events) == split
+    assert tail.events["timestamp"].to_list() == pytest.approx(
+        (timestamps[split:] - 40 / FRAME_RATE).to_list()
+    )
+    spliced = splice_recs([head, tail])
+    assert spliced.events["timestamp"].to_list() == pytest.approx(timestamps.to_list())
+    assert spliced.frames.equals(rec.frames)
+    # Shifted events load back with exactly the timestamps they were given
+    for part in (head, tail, spliced):
+        reloaded = load_rec(BufferReader(dump_rec(part)))
+        assert reloaded.events.equals(part.events)
+
+
+@pytest.mark.parametrize("n_frames, n_events", [(100, 20), (0, 0), (1, 50)])
+def test_load_rec_matches_previous_loader(n_frames, n_events):
+    data = make_rec(n_frames, n_events)
+    frames, events = previous_loaders.load_rec(io.BytesIO(data))
+    for source in (BufferReader(data), io.BytesIO(data)):
+        rec = load_rec(source)
+        assert rec.frames.equals(frames)
+        assert rec.frames.schema == frames.schema
+        assert rec.events.equals(events)
+
+
+@pytest.mark.parametrize("args", [(10, 8, 5), (1, 3, 0), (300, 4, 20)])
+def test_load_lev_matches_previous_loader(args):
+    data = make_lev(*args)
+    polygons, polygons_coords, objects = previous_loaders.load_lev(io.BytesIO(data))
+    lev = load_lev(BufferReader(data))
+    assert lev.polygons.drop("area").equals(polygons.drop("area"))
+    assert lev.polygons.schema == polygons.schema
+    # Areas are summed in another order than the previous per-polygon np.dot
+    assert lev.polygons["area"].to_numpy() == pytest.approx(
+        polygons["area"].to_numpy(), rel=1e-10
+    )
+    assert lev.polygons_coords.equals(polygons_coords)
+    assert lev.objects.equals(objects)
+
+
+def test_scan_polygon_headers():
+    n_vertices = [3, 0, 5, 1]
+    body = b"".join(
+        struct.pack("<I I", i % 2, n) + bytes(POLY_VERTEX_SIZE * n)
+        for i, n in enumerate(n_vertices)
+    )
+    offsets, headers = scan_polygon_headers(body, len(n_vertices))
+    sizes = [POLY_HEADER_SIZE + POLY_VERTEX_SIZE * n for n in n_vertices]
+    assert offsets.tolist() == [0, sizes[0], sum(sizes[:2]), sum(sizes[:3])]
+    assert headers.tolist() == [[i % 2, n] for i, n in enumerate(n_vertices)]
+    for n_polygons in (0, 2):
+        assert len(scan_polygon_headers(body, n_polygons)[0]) == n_polygons
+    with pytest.raises(struct.error):
+        scan_polygon_headers(body[:-1], len(n_vertices))
+    with pytest.raises(struct.error):
+        scan_polygon_headers(body, len(n_vertices) + 1)
+
+
+@pytest.mark.parametrize("columns", [None, ("x", "t"), ("head_y", "is_right")])
+def test_load_rec_columns(columns):
+    data = make_rec(50, 4)
+    full = load_rec(BufferReader(data)).frames
+    frames = load_rec(BufferReader(data), columns=columns).frames
+    expected = FRAME_COLUMNS if columns is None else columns
+    assert sorted(frames.columns) == sorted(expected)
+    assert frames.equals(full.select(frames.columns))
+
+
+@pytest.mark.parametrize("columns", [None, ("x", "t", "head_x")])
+@pytest.mark.parametrize("chunk_size", [1, 7, 100])
+def test_iter_rec_frames(columns, chunk_size):
+    data = make_rec(40, 4)
+    expected = load_rec(BufferReader(data), columns=columns).frames
+    chunks = list(iter_rec_frames(io.BytesIO(data), chunk_size, columns))
+    assert [len(chunk) for chunk in chunks[:-1]] == [chunk_size] * (len(chunks) - 1)
+    # `t` and derived columns carry on across chunks. polars may divide a
+    #  one-row `t` exactly and longer ones by the reciprocal: last-bit differences
+    assert_frame_equal(pl.concat(chunks), expected)
+
+
+def test_iter_rec_frames_truncated(caplog):
+    data = make_rec(40, 4)
+    # 25 frames into the last column, collision_strength (1 byte per frame)
+    truncated = data[: REC_HEADER_SIZE + REC_FRAME_SIZE * 40 - 15]
+    expected = load_rec(BufferReader(data)).frames
+    chunks = list(iter_rec_frames(io.BytesIO(truncated), 10))
+    assert pl.concat(chunks).equals(expected.head(25))
+    assert "truncated" in caplog.text
+    # Columns before the cut are all there
+    chunks = list(iter_rec_frames(io.BytesIO(truncated), 10, columns=("x", "y")))
+    assert pl.concat(chunks).equals(expected.select("x", "y"))
+    with pytest.raises(EOFError):
+        load_rec(BufferReader(truncated))
+
+
+def test_lev_cache_lru():
+    levs = {lev_id: make_lev(2, 3, 1, seed=lev_id) for lev_id in range(3)}
+    cache = LevCache(maxsize=2)
+    first = cache.load(0, levs[0])
+    assert cache.load(0, levs[0]) is first
+    cache.load(1, levs[1])
+    cache.load(0, levs[0])  # 0 now most recently used
+    cache.load(2, levs[2])  # evicts 1
+    assert (cache.hits, cache.misses) == (2, 3)
+    assert cache.load(0, levs[0]) is first
+    cache.load(1, levs[1])
+    assert (cache.hits, cache.misses) == (3, 4)
+
+
+def test_lev_cache_keyed_by_contents():
+    # A re-uploaded level under the same ID is parsed again
+    cache = LevCache()
+    old = cache.load(7, make_lev(2, 3, 1, seed=0))
+    new = cache.load(7, make_lev(3, 3, 1, seed=1))
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert len(new.polygons) == 3 and len(old.polygons) == 2
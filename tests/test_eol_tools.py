@@ -0,0 +1,159 @@
+import functools
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import polars as pl
+import pytest
+import requests
+from synthetic import make_lev
+
+from elma_recplot import eol_tools
+from elma_recplot.blob_store import BlobStore
+from elma_recplot.elma_loader import BufferReader, load_lev
+from elma_recplot.eol_tools import crawl_replays_to_parquet, get_lev_by_id
+
+N_PAGES = 3
+PAGE_SIZE = 4
+# Status codes answered to the first requests of a page, before its replays
+FAILURES = {1: [429], 2: [503, 500]}
+
+
+class _ReplayApi(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        page, size = int(query["page"][0]), int(query["pageSize"][0])
+        server = self.server
+        with server.lock:
+            attempt = server.attempts[page]
+            server.attempts[page] += 1
+            server.requests.append(time.monotonic())
+        failures = FAILURES.get(page, [])
+        if url.path != "/api/replay" or page in server.broken:
+            self.send_error(404)
+            return
+        if attempt < len(failures):
+            self.send_response(failures[attempt])
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        replays = (
+            [
+                {"UUID": f"{page}-{i}", "LevelData": {"LevelName": f"lev{i}"}}
+                for i in range(size)
+            ]
+            if page < N_PAGES
+            else []
+        )
+        body = json.dumps(replays).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ReplayApi)
+    server.lock = threading.Lock()
+    server.attempts = Counter()
+    server.requests = []
+    server.broken = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_crawl_replays_to_parquet(api_server, tmp_path):
+    outfile = tmp_path / "replays.parquet"
+    rps = 20.0
+    n_replays = crawl_replays_to_parquet(
+        range(10),
+        str(outfile),
+        page_size=PAGE_SIZE,
+        workers=2,
+        requests_per_second=rps,
+        base_url=f"http://127.0.0.1:{api_server.server_port}",
+    )
+    assert n_replays == N_PAGES * PAGE_SIZE
+    replays = pl.read_parquet(outfile)
+    assert replays["UUID"].to_list() == [
+        f"{page}-{i}" for page in range(N_PAGES) for i in range(PAGE_SIZE)
+    ]
+    assert replays["page"].unique().sort().to_list() == list(range(N_PAGES))
+    assert "LevelData.LevelName" in replays.columns
+
+    # 429/5xx retried until the page came through
+    for page, failures in FAILURES.items():
+        assert api_server.attempts[page] == len(failures) + 1
+    # Stopped shortly after the first empty page
+    assert max(api_server.attempts) < N_PAGES + 2
+
+    # Requests, retries included, no faster than the rate limit
+    #  (retried without the limiter, they'd follow each other at once)
+    starts = sorted(api_server.requests)
+    assert starts[-1] - starts[0] >= (len(starts) - 1) / rps * 0.9
+    assert min(np.diff(starts)) >= 1 / rps / 2
+    # No parts left behind
+    assert [p.name for p in tmp_path.iterdir()] == ["replays.parquet"]
+
+
+def test_crawl_replays_to_parquet_resumes(api_server, tmp_path):
+    outfile = tmp_path / "replays.parquet"
+    crawl = functools.partial(
+        crawl_replays_to_parquet,
+        range(10),
+        str(outfile),
+        page_size=PAGE_SIZE,
+        workers=1,
+        base_url=f"http://127.0.0.1:{api_server.server_port}",
+    )
+    api_server.broken.add(N_PAGES - 1)
+    with pytest.raises(requests.HTTPError):
+        crawl()
+    # The pages before the failed one are kept
+    assert not outfile.exists()
+    parts = sorted(p.name for p in (tmp_path / ".replays.parquet.parts").iterdir())
+    assert parts == [f"page-{page:06d}.parquet" for page in range(N_PAGES - 1)]
+
+    api_server.broken.clear()
+    fetched = api_server.attempts.copy()
+    assert crawl() == N_PAGES * PAGE_SIZE
+    # Only the failed page and the empty one after it are fetched again
+    assert set(api_server.attempts - fetched) == {N_PAGES - 1, N_PAGES}
+    replays = pl.read_parquet(outfile)
+    assert replays["page"].to_list() == list(np.repeat(range(N_PAGES), PAGE_SIZE))
+    assert [p.name for p in tmp_path.iterdir()] == ["replays.parquet"]
+
+
+def test_crawl_replays_to_parquet_no_replays(api_server, tmp_path):
+    outfile = tmp_path / "replays.parquet"
+    n_replays = crawl_replays_to_parquet(
+        range(N_PAGES, N_PAGES + 5),
+        str(outfile),
+        base_url=f"http://127.0.0.1:{api_server.server_port}",
+    )
+    assert n_replays == 0
+    assert pl.read_parquet(outfile).is_empty()
+
+
+def test_get_lev_by_id_maps_stored_file(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "blobs"))
+    sha256 = store.put("lev", 7, "", make_lev(4, 5, 3))
+    monkeypatch.setattr(eol_tools, "blob_store", store)
+    monkeypatch.setattr(eol_tools, "fetch_lev_by_id", lambda lev_id: sha256)
+    reader = get_lev_by_id(7)
+    assert isinstance(reader, BufferReader)
+    assert load_lev(reader).sha256 == sha256
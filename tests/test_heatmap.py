@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from synthetic import make_lev, make_rec
+
+from elma_recplot.defaults import HEATMAP_LAYERS
+from elma_recplot.elma_loader import BufferReader, load_lev, load_rec
+from elma_recplot.heatmap import HEATMAP_FRAME_COLUMNS, Heatmap, heatmap_many
+
+
+@pytest.fixture
+def rec_paths(tmp_path):
+    paths = []
+    for i in range(7):
+        path = tmp_path / f"{i}.rec"
+        path.write_bytes(make_rec(300, 20, seed=i))
+        paths.append(str(path))
+    broken = tmp_path / "broken.rec"
+    broken.write_bytes(b"\0\0")
+    return paths + [str(broken)]
+
+
+@pytest.fixture
+def empty_heatmap():
+    return Heatmap.for_lev(load_lev(BufferReader(make_lev(4, 5, 3))), cell_size=5.0)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_heatmap_many(rec_paths, empty_heatmap, workers):
+    expected = Heatmap(x_edges=empty_heatmap.x_edges, y_edges=empty_heatmap.y_edges)
+    for path in rec_paths[:-1]:
+        with open(path, "rb") as f:
+            expected.add(load_rec(f, columns=HEATMAP_FRAME_COLUMNS))
+
+    # More batches than workers, so some are submitted as others finish
+    heatmap = heatmap_many(empty_heatmap, rec_paths, workers=workers, batch_size=2)
+    assert heatmap.n_recs == 7
+    for layer in HEATMAP_LAYERS:
+        np.testing.assert_array_equal(heatmap.counts[layer], expected.counts[layer])
+    assert heatmap.counts["position"].sum() > 0
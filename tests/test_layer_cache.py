@@ -0,0 +1,78 @@
+import io
+import json
+import re
+
+import plotly.graph_objects as go
+import pytest
+from synthetic import make_lev, make_rec
+
+from elma_recplot.elma_loader import BufferReader, load_lev, load_rec
+from elma_recplot.layer_cache import LevLayerCache
+from elma_recplot.plot import add_lev_to_fig, draw_rec, write_figures_html
+
+
+@pytest.fixture
+def lev():
+    lev = load_lev(BufferReader(make_lev(5, 6, 8)))
+    lev.sha256 = "ab" * 32
+    return lev
+
+
+def _figure_json(html: str) -> tuple[list, dict]:
+    # (data, layout) of the single figure in a page
+    data, layout = re.search(
+        r"Plotly\.newPlot\(\s*\"[^\"]+\",\s*(\[.*?\]),\s*(\{.*\}),\s*\{\"responsive",
+        html,
+        re.DOTALL,
+    ).groups()
+    return json.loads(data), json.loads(layout)
+
+
+@pytest.mark.parametrize("compact", [True, False])
+def test_cached_layer_page_matches_uncached(tmp_path, lev, compact):
+    rec = load_rec(BufferReader(make_rec(60, 3)))
+    cache = LevLayerCache(str(tmp_path / "cache"))
+    pages = []
+    # Uncached, then a cache miss, then a hit
+    for layer_cache in (None, cache, cache):
+        out = io.StringIO()
+        write_figures_html([draw_rec(rec, lev, layer_cache=layer_cache)], out, compact)
+        pages.append(_figure_json(out.getvalue()))
+    assert pages[1] == pages[0]
+    assert pages[2] == pages[0]
+    assert len(cache.stats()) == 1
+
+
+def test_cached_layer_not_parsed_into_figure(tmp_path, lev):
+    cache = LevLayerCache(str(tmp_path / "cache"))
+    cache.add_lev_to_fig(lev, go.Figure())
+    fig = go.Figure()
+    cache.add_lev_to_fig(lev, fig)
+    assert not fig.data
+    assert not fig.layout.shapes
+
+
+def test_prune_drops_old_format(tmp_path, lev):
+    cache = LevLayerCache(str(tmp_path / "cache"))
+    cache.add_lev_to_fig(lev, go.Figure())
+    old = tmp_path / "cache" / "v1" / f"{'cd' * 32}.json"
+    old.write_text("{}")
+    assert cache.prune() == 1
+    assert not old.exists()
+    assert cache.get(lev.sha256) is not None
+
+
+def test_layer_under_later_traces(tmp_path, lev):
+    # The layer is drawn first, as when rendered straight into the figure
+    cache = LevLayerCache(str(tmp_path / "cache"))
+    pages = []
+    for add in (add_lev_to_fig, cache.add_lev_to_fig):
+        fig = go.Figure()
+        add(lev, fig)
+        fig.add_trace(go.Scatter(x=[0, 1], y=[0, 1], name="after"))
+        fig.add_shape(type="line", x0=0, y0=0, x1=1, y1=1)
+        out = io.StringIO()
+        write_figures_html([fig], out, compact=False)
+        pages.append(_figure_json(out.getvalue()))
+    assert pages[1] == pages[0]
+    assert pages[1][0][-1]["name"] == "after"
@@ -0,0 +1,36 @@
+import numpy as np
+import polars as pl
+import pytest
+from synthetic import make_rec
+
+from elma_recplot.elma_loader import BufferReader, load_rec
+from elma_recplot.lod import downsample_frames
+
+
+@pytest.fixture
+def frames():
+    return load_rec(BufferReader(make_rec(2_000, 10, seed=3))).frames
+
+
+@pytest.mark.parametrize("method", ["lttb", "rdp", "grid"])
+def test_downsample_frames_fits_budget(frames, method):
+    kept = downsample_frames(frames, max_points=200, method=method)
+    assert 0 < len(kept) <= 200
+
+
+@pytest.mark.parametrize("method", ["lttb", "rdp", "grid"])
+def test_downsample_frames_thins_gas_edges(frames, method):
+    # Gas toggled every frame: every frame is a gas edge
+    toggling = frames.with_columns(
+        pl.Series("is_gasing_left", np.arange(len(frames)) % 2 == 0)
+    )
+    kept = downsample_frames(toggling, max_points=100, method=method)
+    assert len(kept) <= 100
+    assert kept["t"][0] == frames["t"][0]
+    assert kept["t"][-1] == frames["t"][-1]
+
+
+def test_downsample_frames_tolerance(frames):
+    coarse = downsample_frames(frames, method="rdp", tolerance=1.0)
+    fine = downsample_frames(frames, method="rdp", tolerance=0.01)
+    assert len(coarse) < len(fine) <= len(frames)
@@ -0,0 +1,174 @@
+import types
+
+import pytest
+from synthetic import make_lev, make_rec
+
+from elma_recplot import manifest, page_creation
+from elma_recplot.blob_store import BlobStore
+
+
+def _replay(i: int) -> dict:
+    return {
+        "UUID": f"uuid{i}",
+        "RecFileName": f"rec{i}.rec",
+        "LevelIndex": 1,
+        "Uploaded": 1_700_000_000 + i,
+        "ReplayTime": 10_000 + i,
+        "DrivenByData": {"Kuski": f"kuski{i}"},
+        "LevelData": {"LevelName": "SYNTH"},
+    }
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # Replays listed newest first; `api.broken` UUIDs fail to download, rec
+    #  contents change with `api.rec_seed`. `api.fetched`: rec download attempts
+    store = BlobStore(str(tmp_path / "blobs"))
+    state = type(
+        "Api", (), {"replays": [], "broken": set(), "rec_seed": 0, "fetched": []}
+    )()
+
+    def get_latest_replays(page=0, num=20):
+        return state.replays[page * num : (page + 1) * num]
+
+    def fetch_lev_by_id(lev_id, pin=False):
+        return store.put("lev", lev_id, "", make_lev(4, 5, 3), pin=pin)
+
+    def fetch_rec_by_id_and_name(rec_id, rec_name, pin=False):
+        state.fetched.append(rec_id)
+        if rec_id in state.broken:
+            raise OSError(f"can't download {rec_id}")
+        rec = make_rec(50, 3, seed=state.rec_seed)
+        return store.put("rec", rec_id, rec_name, rec, pin=pin)
+
+    monkeypatch.setattr(page_creation, "blob_store", store)
+    state.store = store
+    monkeypatch.setattr(page_creation, "get_latest_replays", get_latest_replays)
+    monkeypatch.setattr(page_creation, "fetch_lev_by_id", fetch_lev_by_id)
+    monkeypatch.setattr(
+        page_creation, "fetch_rec_by_id_and_name", fetch_rec_by_id_and_name
+    )
+    return state
+
+
+def _make_page(tmp_path, num=2):
+    rec_dir = tmp_path / "recs"
+    rec_dir.mkdir(exist_ok=True)
+    index_page = tmp_path / "index.md"
+    page_creation.make_recent_replay_page(
+        index_page=str(index_page),
+        rec_dir=str(rec_dir),
+        num=num,
+        render_workers=1,
+        layer_cache_dir=None,
+    )
+    return index_page.read_text(), sorted(p.name for p in rec_dir.glob("*.html"))
+
+
+def test_failed_replays_not_indexed(tmp_path, api):
+    api.replays = [_replay(0), _replay(1)]
+    api.broken = {"uuid1"}
+    index, rendered = _make_page(tmp_path)
+    assert rendered == ["rec0.html"]
+    assert "rec0.html" in index
+    assert "rec1.html" not in index
+    assert not api.store.db.execute("SELECT * FROM pins").fetchall()
+
+
+@pytest.mark.parametrize("version", ["PAGE_VERSION", "LAYER_VERSION"])
+def test_new_version_rerenders(tmp_path, api, monkeypatch, version):
+    api.replays = [_replay(0)]
+    _make_page(tmp_path)
+    page = tmp_path / "recs" / "rec0.html"
+    page.write_text("stale")
+    _make_page(tmp_path)
+    assert page.read_text() == "stale"
+
+    monkeypatch.setattr(f"elma_recplot.manifest.{version}", 2)
+    _make_page(tmp_path)
+    assert page.read_text() != "stale"
+
+
+def test_no_new_replays(tmp_path, api):
+    index, rendered = _make_page(tmp_path)
+    assert rendered == []
+    assert "Static rec" in index
+
+    api.replays = [_replay(0)]
+    _make_page(tmp_path)
+    # Index built from the manifest, not just what the API returned
+    api.replays = []
+    index, _ = _make_page(tmp_path)
+    assert "rec0.html" in index
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # The manifest's time, for retry backoff
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(manifest, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_failed_replays_retried(tmp_path, api, clock):
+    api.replays = [_replay(1), _replay(0)]
+    api.broken = {"uuid0"}
+    _make_page(tmp_path)
+
+    # uuid0 is now behind uuid1, on a page that isn't fetched
+    api.replays = [_replay(2), _replay(1), _replay(0)]
+    api.broken = set()
+    clock[0] += manifest.RETRY_BACKOFF_S
+    index, rendered = _make_page(tmp_path)
+    assert rendered == ["rec0.html", "rec1.html", "rec2.html"]
+    assert "rec2.html" in index and "rec1.html" in index
+    assert "rec0.html" not in index
+
+
+def test_failed_replays_back_off(tmp_path, api, clock):
+    api.replays = [_replay(0)]
+    api.broken = {"uuid0"}
+    _make_page(tmp_path)
+    _make_page(tmp_path)
+    assert api.fetched == ["uuid0"]
+    entry = manifest.Manifest(str(tmp_path / "recs")).entries["uuid0"]
+    assert entry["attempts"] == 1
+    assert entry["retry_at"] == clock[0] + manifest.RETRY_BACKOFF_S
+
+    # Each failure doubles the wait
+    clock[0] += manifest.RETRY_BACKOFF_S
+    _make_page(tmp_path)
+    clock[0] += manifest.RETRY_BACKOFF_S
+    _make_page(tmp_path)
+    assert api.fetched == ["uuid0"] * 2
+    entry = manifest.Manifest(str(tmp_path / "recs")).entries["uuid0"]
+    assert entry["attempts"] == 2
+
+    api.broken = set()
+    clock[0] += manifest.RETRY_BACKOFF_S
+    _, rendered = _make_page(tmp_path)
+    assert rendered == ["rec0.html"]
+    entry = manifest.Manifest(str(tmp_path / "recs")).entries["uuid0"]
+    assert (entry["attempts"], entry["retry_at"]) == (0, None)
+
+
+def test_rendered_replays_not_downloaded(tmp_path, api):
+    # Skipped by UUID, even if the file behind it changed
+    api.replays = [_replay(0)]
+    _make_page(tmp_path)
+    page = tmp_path / "recs" / "rec0.html"
+    page.write_text("stale")
+    api.rec_seed = 1
+    _make_page(tmp_path)
+    assert api.fetched == ["uuid0"]
+    assert page.read_text() == "stale"
+
+
+def test_changed_row_rerenders(tmp_path, api):
+    api.replays = [_replay(0)]
+    _make_page(tmp_path)
+    page = tmp_path / "recs" / "rec0.html"
+    page.write_text("stale")
+    api.replays[0]["ReplayTime"] += 1
+    _make_page(tmp_path)
+    assert page.read_text() != "stale"
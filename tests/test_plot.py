@@ -0,0 +1,108 @@
+import numpy as np
+import plotly.graph_objects as go
+import polars as pl
+import pytest
+from synthetic import make_lev, make_rec
+
+from elma_recplot.elma_loader import (
+    BufferReader,
+    EventType,
+    ObjType,
+    load_lev,
+    load_rec,
+    slice_rec,
+)
+from elma_recplot.plot import (
+    OBJ_COLORS,
+    REC_COLORS,
+    _segments,
+    _volt_positions,
+    add_lev_to_fig,
+    add_rec_to_fig,
+    draw_recs,
+)
+
+
+@pytest.fixture
+def lev():
+    return load_lev(BufferReader(make_lev(5, 6, 8)))
+
+
+def test_add_lev_to_fig_object_colors(lev):
+    expected = [
+        OBJ_COLORS[ObjType(obj_type)] for obj_type in lev.objects["object_type"]
+    ]
+    fig = go.Figure()
+    add_lev_to_fig(lev, fig, batched=False)
+    assert [shape.fillcolor for shape in fig.layout.shapes] == expected
+
+    fig = go.Figure()
+    add_lev_to_fig(lev, fig, batched=True)
+    markers = {trace.name: trace.marker.color for trace in fig.data if trace.marker}
+    for obj_type, color in OBJ_COLORS.items():
+        assert markers[obj_type.name.capitalize()] == color
+
+
+@pytest.fixture
+def volt_rec():
+    # Volts, unsorted: at frame 5, between frames 2 and 3, past the last frame;
+    #  and a non-volt event
+    rec = load_rec(BufferReader(make_rec(30, 4)))
+    t = rec.frames["t"]
+    rec.events = rec.events.with_columns(
+        pl.Series("timestamp", [t[5], (t[2] + t[3]) / 2, 10.0, t[1]]),
+        pl.Series(
+            "event_type",
+            [
+                EventType.VOLT_RIGHT.value,
+                EventType.VOLT_LEFT.value,
+                EventType.VOLT_LEFT.value,
+                EventType.GROUND.value,
+            ],
+            dtype=pl.UInt8,
+        ),
+    )
+    return rec
+
+
+def test_volt_positions(volt_rec):
+    volts = _volt_positions(volt_rec)
+    positions = ["l_wheel_x", "l_wheel_y", "r_wheel_x", "r_wheel_y", "head_x", "head_y"]
+    assert volts.select(positions).equals(volt_rec.frames.select(positions)[[3, 5, 29]])
+    assert volts["event_type"].to_list() == [
+        EventType.VOLT_LEFT.value,
+        EventType.VOLT_RIGHT.value,
+        EventType.VOLT_LEFT.value,
+    ]
+    assert _volt_positions(slice_rec(volt_rec, 0, 0)).is_empty()
+
+
+def test_segments():
+    a, b = pl.Series([1.0, 2.0]), pl.Series([3.0, 4.0])
+    np.testing.assert_array_equal(_segments(a, b), [1.0, 3.0, np.nan, 2.0, 4.0, np.nan])
+    empty = pl.Series([], dtype=pl.Float64)
+    np.testing.assert_array_equal(_segments(empty, empty), [np.nan])
+
+
+def test_volt_traces(volt_rec):
+    fig = go.Figure()
+    add_rec_to_fig(volt_rec, fig)
+    traces = {trace.name: trace for trace in fig.data}
+    # One trace per volt direction, one NaN-separated wheel-head-wheel line each
+    assert np.isnan(traces["Right volt"].x).sum() == 1
+    assert np.isnan(traces["Left volt"].x).sum() == 2
+    assert len(traces["Bike at volt"].x) == 3 * 3
+
+
+def test_draw_recs(lev):
+    recs = [load_rec(BufferReader(make_rec(n, 2, seed=n))) for n in (40, 60)]
+    fig = draw_recs(recs, lev, names=["a.rec", "b.rec"], max_points=20)
+    n_lev_traces = len(draw_recs([], lev).data)
+    traces = fig.data[n_lev_traces:]
+    assert [trace.name for trace in traces] == ["a.rec", "b.rec"]
+    assert [trace.line.color for trace in traces] == list(REC_COLORS[:2])
+    for trace in traces:
+        # Down to the point budget; hover times follow the kept points
+        assert len(trace.x) <= 20
+        assert len(trace.customdata) == len(trace.x)
+        assert trace.customdata[0] == 0.0
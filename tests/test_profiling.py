@@ -0,0 +1,83 @@
+import csv
+import json
+
+import pytest
+from synthetic import make_lev, make_rec
+
+from elma_recplot import profiling
+from elma_recplot.elma_loader import BufferReader, load_lev, load_recs_many
+from elma_recplot.heatmap import Heatmap, heatmap_many
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    # Spawned workers read the env var
+    monkeypatch.setattr(profiling, "_enabled", True)
+    monkeypatch.setenv(profiling.PROFILE_ENV_VAR, "1")
+    profiling.reset()
+    yield
+    profiling.reset()
+
+
+@pytest.fixture
+def rec_paths(tmp_path):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"{i}.rec"
+        path.write_bytes(make_rec(100, 5, seed=i))
+        paths.append(str(path))
+    return paths
+
+
+def _rows() -> dict[str, dict]:
+    return {row["name"]: row for row in profiling.summary()}
+
+
+def test_counters_have_own_columns(enabled, tmp_path):
+    with profiling.timer("stage"):
+        profiling.count("bytes", 100)
+        profiling.count("bytes", 50)
+    rows = _rows()
+    assert rows["stage"]["kind"] == "timer"
+    assert rows["stage"]["count"] == 1
+    assert rows["stage"]["value"] is None
+    assert rows["bytes"] == {
+        "name": "bytes",
+        "kind": "counter",
+        "count": 2,
+        "total_s": None,
+        "mean_s": None,
+        "max_s": None,
+        "value": 150,
+    }
+
+    profiling.write_summary(str(tmp_path / "profile.json"))
+    assert json.loads((tmp_path / "profile.json").read_text()) == profiling.summary()
+    profiling.write_summary(str(tmp_path / "profile.csv"))
+    with open(tmp_path / "profile.csv", newline="") as f:
+        counter = next(row for row in csv.DictReader(f) if row["name"] == "bytes")
+    assert (counter["mean_s"], counter["value"]) == ("", "150")
+
+
+def test_drain_merge_round_trip(enabled):
+    with profiling.timer("stage"):
+        profiling.count("hits")
+    stats = profiling.drain()
+    assert profiling.summary() == []
+    profiling.merge(stats)
+    profiling.merge(stats)
+    rows = _rows()
+    assert rows["stage"]["count"] == 2
+    assert rows["hits"]["value"] == 2
+
+
+def test_load_many_merges_worker_stats(enabled, rec_paths):
+    load_recs_many(rec_paths, workers=2)
+    assert _rows()["load_rec"]["count"] == len(rec_paths)
+
+
+def test_heatmap_many_merges_worker_stats(enabled, rec_paths):
+    lev = load_lev(BufferReader(make_lev(4, 5, 3)))
+    profiling.reset()
+    heatmap_many(Heatmap.for_lev(lev), rec_paths, workers=2, batch_size=2)
+    assert _rows()["load_rec"]["count"] == len(rec_paths)
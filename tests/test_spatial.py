@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from synthetic import make_lev
+
+from elma_recplot import spatial
+from elma_recplot.elma_loader import BufferReader, load_lev
+from elma_recplot.spatial import PolygonIndex, _point_segment_distance
+
+
+def _brute_nearest(index, x, y):
+    d = _point_segment_distance(
+        x[:, None], y[:, None], index.x0, index.y0, index.x1, index.y1
+    )
+    return d.min(axis=1)
+
+
+def _brute_containing(index, x, y):
+    spans = (index.y0 > y[:, None]) != (index.y1 > y[:, None])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_cross = index.x0 + (y[:, None] - index.y0) * (index.x1 - index.x0) / (
+            index.y1 - index.y0
+        )
+    crosses = spans & (x_cross > x[:, None])
+    result = np.full(len(x), -1)
+    smallest = np.full(len(x), np.inf)
+    for pos, polygon in enumerate(index._polygon_ids):
+        inside = crosses[:, index.edge_polygon == polygon].sum(axis=1) % 2 == 1
+        smaller = inside & (index._polygon_area[pos] < smallest)
+        result[smaller] = polygon
+        smallest[smaller] = index._polygon_area[pos]
+    return result
+
+
+def _brute_intersects(index, x0, y0, x1, y1):
+    return spatial._segments_intersect(
+        x0[:, None], y0[:, None], x1[:, None], y1[:, None],
+        index.x0, index.y0, index.x1, index.y1,
+    )  # fmt: skip
+
+
+def _square(x, y, size):
+    return [x, x + size, x + size, x], [y, y, y + size, y + size]
+
+
+@pytest.fixture
+def synthetic_index():
+    return PolygonIndex.from_lev(load_lev(BufferReader(make_lev(10, 40, 0))))
+
+
+@pytest.fixture
+def long_edge_index():
+    # A big triangle whose long edges cross many small cells, around a small
+    #  square; most cells are empty
+    xs = [[0.0, 100.0, 0.0], _square(10.0, 10.0, 2.0)[0]]
+    ys = [[0.0, 0.0, 100.0], _square(10.0, 10.0, 2.0)[1]]
+    polygon = np.repeat([0, 1], [len(xs[0]), len(xs[1])])
+    return PolygonIndex(
+        np.concatenate(xs),
+        np.concatenate(ys),
+        polygon,
+        polygon_area={0: 5000.0, 1: 4.0},
+        cell_size=0.5,
+    )
+
+
+@pytest.fixture
+def points():
+    # Inside, around and well outside the indexed area, plus a few far away
+    rng = np.random.default_rng(0)
+    far = np.array([1e4, -1e4, 50.0])
+    return (
+        np.concatenate([rng.uniform(-60, 260, 3_000), far]),
+        np.concatenate([rng.uniform(-260, 60, 3_000), far[::-1]]),
+    )
+
+
+@pytest.mark.parametrize("name", ["synthetic_index", "long_edge_index"])
+def test_queries_match_brute_force(request, name, points, monkeypatch):
+    # Small chunks and batches, so queries are split across several
+    monkeypatch.setattr(spatial, "QUERY_CHUNK", 1_000)
+    monkeypatch.setattr(spatial, "MAX_BATCH_PAIRS", 1_000)
+    index = request.getfixturevalue(name)
+    x, y = points
+    if name == "long_edge_index":
+        x, y = x / 2, y / 2 + 50
+
+    distance, edge, polygon = index.nearest_edge(x, y)
+    np.testing.assert_allclose(distance, _brute_nearest(index, x, y))
+    np.testing.assert_allclose(
+        _point_segment_distance(
+            x, y, index.x0[edge], index.y0[edge], index.x1[edge], index.y1[edge]
+        ),
+        distance,
+    )
+    assert (polygon == index.edge_polygon[edge]).all()
+
+    np.testing.assert_array_equal(
+        index.containing_polygon(x, y), _brute_containing(index, x, y)
+    )
+
+    x1, y1 = x[::-1], y[::-1]
+    hits = _brute_intersects(index, x, y, x1, y1)
+    result = index.intersects(x, y, x1, y1)
+    np.testing.assert_array_equal(result >= 0, hits.any(axis=1))
+    hit = result >= 0
+    # The reported polygon is one of those the segment touches
+    assert (hits & (index.edge_polygon == result[:, None]))[hit].any(axis=1).all()
+
+
+def test_long_edges_fill_only_their_cells(long_edge_index):
+    # The hypotenuse crosses about 2 * 200 cells, not its 200 x 200 bounding box
+    assert len(long_edge_index._cell_edges) < 2_000
+
+
+def test_empty_index():
+    index = PolygonIndex(np.array([]), np.array([]), np.array([], dtype=np.int64))
+    x = np.array([0.0, 1.0])
+    distance, edge, polygon = index.nearest_edge(x, x)
+    assert np.isinf(distance).all()
+    assert (edge == -1).all() and (polygon == -1).all()
+    assert (index.containing_polygon(x, x) == -1).all()
+    assert (index.intersects(x, x, x + 1, x) == -1).all()
@@ -0,0 +1,72 @@
+import polars as pl
+import pytest
+from synthetic import make_lev, make_rec
+
+from elma_recplot.elma_loader import BufferReader, load_lev, load_rec
+from elma_recplot.store import (
+    LEV_TABLES,
+    REC_TABLES,
+    ingest,
+    load_rec_from_store,
+    read_index,
+    scan_table,
+)
+
+
+@pytest.fixture
+def src_dir(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.rec").write_bytes(make_rec(30, 4, seed=1))
+    (src / "b.rec").write_bytes(make_rec(60, 5, seed=2))
+    (src / "broken.rec").write_bytes(b"\0\0")
+    (src / "SYNTH.lev").write_bytes(make_lev(4, 5, 3))
+    return src
+
+
+@pytest.mark.parametrize("table", REC_TABLES + LEV_TABLES)
+def test_scan_table_empty_store(tmp_path, table):
+    rec = load_rec(BufferReader(make_rec(10, 2)))
+    lev = load_lev(BufferReader(make_lev(2, 3, 2)))
+    expected = getattr(rec if table in REC_TABLES else lev, table)
+    empty = scan_table(str(tmp_path / "store"), table).collect()
+    assert empty.is_empty()
+    assert (
+        empty.schema
+        == expected.with_columns(pl.lit("", pl.String).alias("file_id")).schema
+    )
+
+
+def test_ingest_records_failures(src_dir, tmp_path):
+    store = str(tmp_path / "store")
+    new_index = ingest(str(src_dir), store, workers=1)
+    assert len(new_index) == 4
+    failed = new_index.filter(pl.col("error").is_not_null())
+    assert failed["filename"].to_list() == ["broken.rec"]
+    assert scan_table(store, "frames").collect().height == 90
+
+    # Failed files are known by content: not retried, and not loadable
+    assert ingest(str(src_dir), store, workers=1).is_empty()
+    assert read_index(store).height == 4
+    with pytest.raises(KeyError):
+        load_rec_from_store(store, "broken.rec")
+    assert len(load_rec_from_store(store, "b.rec").frames) == 60
+
+
+def test_ingest_in_batches(src_dir, tmp_path):
+    store = tmp_path / "store"
+    new_index = ingest(str(src_dir), str(store), workers=1, files_per_part=1)
+    assert len(new_index) == 4
+    # One part per loaded file; the broken rec has no rows to write
+    assert len(list((store / "frames").glob("*.parquet"))) == 2
+    assert len(list((store / "polygons").glob("*.parquet"))) == 1
+    assert scan_table(str(store), "frames").collect().height == 90
+    assert read_index(str(store)).equals(new_index)
+
+
+def test_read_index_adds_missing_columns(src_dir, tmp_path):
+    store = tmp_path / "store"
+    ingest(str(src_dir), str(store), workers=1)
+    old = read_index(str(store)).drop("error")
+    old.write_parquet(store / "index.parquet")
+    assert read_index(str(store))["error"].null_count() == 4
@@ -0,0 +1,98 @@
+import os
+import struct
+
+import pytest
+from synthetic import make_lev, make_rec
+
+from elma_recplot.elma_loader import (
+    LEV_LINK_OFFSET,
+    REC_EVENT_DTYPE,
+    REC_FRAME_SIZE,
+    REC_HEADER_SIZE,
+)
+from elma_recplot.validate import check_lev, check_rec, validate_many
+
+N_FRAMES = 120
+N_EVENTS = 10
+
+
+@pytest.fixture
+def lev() -> bytes:
+    return make_lev(4, 5, 3)
+
+
+@pytest.fixture
+def link(lev) -> int:
+    return struct.unpack_from("<I", lev, LEV_LINK_OFFSET)[0]
+
+
+@pytest.fixture
+def rec(link) -> bytes:
+    return make_rec(N_FRAMES, N_EVENTS, link=link)
+
+
+@pytest.fixture
+def levs(lev):
+    return {"synth.lev": check_lev(lev)}
+
+
+def test_good_files(lev, rec, link, levs):
+    lev_status = check_lev(lev)
+    assert lev_status.ok, lev_status.problems
+    assert lev_status.link == link
+    status = check_rec(rec, levs)
+    assert status.ok, status.problems
+    assert (status.lev_name, status.link, status.lev_checked) == (
+        "SYNTH.lev",
+        link,
+        True,
+    )
+
+
+def test_truncated_frames(rec):
+    status = check_rec(rec[: REC_HEADER_SIZE + 10 * REC_FRAME_SIZE])
+    assert status.problems == [
+        f"truncated frames: header says {N_FRAMES}, file holds 10"
+    ]
+
+
+def test_truncated_events(rec):
+    events_start = REC_HEADER_SIZE + REC_FRAME_SIZE * N_FRAMES + 4
+    status = check_rec(rec[: events_start + 3 * REC_EVENT_DTYPE.itemsize + 5])
+    assert status.problems == [f"truncated events: file says {N_EVENTS}, holds 3"]
+
+
+def test_missing_end_marker(rec):
+    status = check_rec(rec[:-4])
+    assert len(status.problems) == 1
+    assert status.problems[0].startswith("no end marker")
+
+
+def test_link_mismatch(link, levs):
+    status = check_rec(make_rec(N_FRAMES, N_EVENTS, link=link + 1), levs)
+    assert status.lev_checked
+    assert status.problems == [
+        f"checksum {link + 1} doesn't match SYNTH.lev's link {link}"
+    ]
+
+
+def test_unchecked_without_lev(rec):
+    status = check_rec(rec)
+    assert status.ok
+    assert not status.lev_checked
+
+
+def test_truncated_lev(lev):
+    assert check_lev(lev[:100]).problems == ["truncated header: 100 bytes"]
+    assert check_lev(lev[:-20]).problems == ["truncated objects"]
+
+
+def test_validate_many(tmp_path, lev, rec, link):
+    (tmp_path / "SYNTH.lev").write_bytes(lev)
+    (tmp_path / "good.rec").write_bytes(rec)
+    (tmp_path / "bad.rec").write_bytes(make_rec(N_FRAMES, N_EVENTS, link=link + 1))
+    paths = [str(tmp_path / name) for name in ("bad.rec", "good.rec", "SYNTH.lev")]
+    statuses = validate_many(paths, workers=1)
+    ok = dict(zip(map(os.path.basename, statuses["file"]), statuses["ok"]))
+    assert ok == {"SYNTH.lev": True, "bad.rec": False, "good.rec": True}
+    assert statuses.filter(statuses["kind"] == "rec")["lev_checked"].all()